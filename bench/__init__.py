@@ -0,0 +1,7 @@
+"""Benchmarks for python-musicbrainz2.
+
+Run them using C{python setup.py bench}. See L{harness} for details.
+"""
+__revision__ = '$Id$'
+
+# EOF
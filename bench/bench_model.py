@@ -0,0 +1,149 @@
+"""Benchmarks for the model classes and utility functions."""
+__revision__ = '$Id$'
+
+import StringIO
+from musicbrainz2.model import Artist, Release, Track, ReleaseEvent, \
+	Relation, Tag, Disc, NS_MMD_1, NS_REL_1
+from musicbrainz2.wsxml import MbXmlParser, DefaultFactory, LazyFactory, \
+	IdentityMap, getParserEngines
+from musicbrainz2.utils import extractUuid
+from bench.harness import Benchmark
+from bench.documents import makeId, artistDocument, releaseDocument, \
+	trackSearchDocument
+
+
+class RelationsBenchmark(Benchmark):
+
+	def setUp(self):
+		self.artist = MbXmlParser().parse(
+			StringIO.StringIO(artistDocument(0, 200))).artist
+
+	def benchAll(self):
+		self.artist.getRelations()
+
+	def benchTargetType(self):
+		self.artist.getRelations(Relation.TO_URL)
+
+	def benchRelationType(self):
+		self.artist.getRelations(Relation.TO_ARTIST,
+			NS_REL_1 + 'MemberOfBand')
+
+	def benchAttributes(self):
+		self.artist.getRelations(Relation.TO_ARTIST,
+			NS_REL_1 + 'MemberOfBand', [ NS_REL_1 + 'Guest' ])
+
+	def benchDirection(self):
+		self.artist.getRelations(direction=Relation.DIR_FORWARD)
+
+
+class SizeBenchmark(Benchmark):
+	"""Memory used per object, including its strings."""
+
+	count = 1000
+
+	def _uri(self, entity, kind, i):
+		return 'http://musicbrainz.org/%s/%s' % (entity, makeId(kind, i))
+
+	def sizeArtist(self):
+		return [Artist(self._uri('artist', 1, i), NS_MMD_1 + 'Person',
+			u'Artist %d' % i, u'Artist %d' % i) for i in range(self.count)]
+
+	def sizeRelease(self):
+		releases = [ ]
+		for i in range(self.count):
+			release = Release(self._uri('release', 2, i), u'Release %d' % i)
+			release.addType(Release.TYPE_ALBUM)
+			releases.append(release)
+		return releases
+
+	def sizeTrack(self):
+		tracks = [ ]
+		for i in range(self.count):
+			track = Track(self._uri('track', 3, i), u'Track %d' % i)
+			track.setDuration(180000 + i)
+			tracks.append(track)
+		return tracks
+
+	def sizeReleaseEvent(self):
+		return [ReleaseEvent('GB', '1994-%02d-01' % (i % 12 + 1))
+			for i in range(self.count)]
+
+	def sizeRelation(self):
+		return [Relation(NS_REL_1 + 'Wikipedia', Relation.TO_URL,
+			'http://example.com/%d' % i) for i in range(self.count)]
+
+	def sizeTag(self):
+		return [Tag(u'tag%d' % i, i) for i in range(self.count)]
+
+	def sizeDisc(self):
+		return [Disc('%027d-' % i) for i in range(self.count)]
+
+	def sizeParsedRelease(self):
+		return [MbXmlParser().parse(StringIO.StringIO(releaseDocument(10)))
+			for i in range(self.count / 10)]
+
+	def sizeParsedTracks(self):
+		md = MbXmlParser().parse(StringIO.StringIO(
+			trackSearchDocument(self.count)))
+		return [result.track for result in md.trackResults]
+
+	def _parseLibrary(self, factory):
+		# 20 tracks per artist, read in pages of 100 tracks
+		tracks = [ ]
+		for offset in range(0, self.count, 100):
+			xml = trackSearchDocument(100, offset, self.count,
+				self.count / 20)
+			md = MbXmlParser(factory).parse(StringIO.StringIO(xml))
+			tracks.extend([result.track for result in md.trackResults])
+		return tracks
+
+	def sizeLibraryTracks(self):
+		return self._parseLibrary(DefaultFactory())
+
+	def sizeLibraryTracksInterned(self):
+		return self._parseLibrary(DefaultFactory(IdentityMap()))
+
+
+class _LazySizeBenchmark(Benchmark):
+	"""Memory used per object with undecoded child lists."""
+
+	engine = None
+	count = 100
+
+	def _parse(self, xml):
+		parser = MbXmlParser(factory=LazyFactory(), engine=self.engine)
+		return parser.parse(StringIO.StringIO(xml))
+
+	def sizeLazyRelease(self):
+		return [self._parse(releaseDocument(10)).release
+			for i in range(self.count)]
+
+	def sizeLazySearchResult(self):
+		# only the first track of each page of results is kept
+		return [self._parse(trackSearchDocument(50)).trackResults[0].track
+			for i in range(self.count)]
+
+
+class ExpatLazySizeBenchmark(_LazySizeBenchmark):
+	engine = 'expat'
+
+
+if 'lxml' in getParserEngines():
+	class LxmlLazySizeBenchmark(_LazySizeBenchmark):
+		engine = 'lxml'
+
+
+class ExtractUuidBenchmark(Benchmark):
+
+	def benchAbsolute(self):
+		extractUuid('http://musicbrainz.org/artist/'
+			'c0b2500e-0cef-4130-869d-732b23ed9df5')
+
+	def benchAbsoluteChecked(self):
+		extractUuid('http://musicbrainz.org/artist/'
+			'c0b2500e-0cef-4130-869d-732b23ed9df5', 'artist')
+
+	def benchRelative(self):
+		extractUuid('c0b2500e-0cef-4130-869d-732b23ed9df5')
+
+# EOF
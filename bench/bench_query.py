@@ -0,0 +1,85 @@
+"""Benchmarks for complete Query round trips.
+
+The documents are served over HTTP by a local L{StandInServer
+<musicbrainz2.replay.StandInServer>}, so these benchmarks include
+connection handling, parsing and model construction, but no network
+latency.
+"""
+__revision__ = '$Id$'
+
+import shutil
+import StringIO
+import tempfile
+from musicbrainz2.webservice import IWebService, WebService, Query, \
+	ArtistIncludes, ReleaseIncludes, TrackFilter
+from musicbrainz2.transport import NullScheduler
+from musicbrainz2.replay import RecordingWebService, StandInServer
+from musicbrainz2.model import Release
+from bench.harness import Benchmark
+from bench.documents import makeId, artistDocument, releaseDocument, \
+	trackSearchDocument
+
+class _DocumentWebService(IWebService):
+	"""Returns one document per entity type, for recording."""
+
+	def __init__(self, documents):
+		self._documents = documents
+
+	def get(self, entity, id_, include=( ), filter={ }, version='1'):
+		return StringIO.StringIO(self._documents[entity])
+
+
+class QueryBenchmark(Benchmark):
+	artistIncludes = ArtistIncludes(releases=(Release.TYPE_OFFICIAL,),
+		artistRelations=True, urlRelations=True)
+	releaseIncludes = ReleaseIncludes(artist=True, tracks=True,
+		releaseEvents=True, labels=True, discs=True, isrcs=True)
+	trackFilter = TrackFilter(title='Track', limit=25)
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		ws = RecordingWebService(_DocumentWebService({
+			'artist': artistDocument(50, 20),
+			'release': releaseDocument(20),
+			'track': trackSearchDocument(25),
+		}), self.directory)
+
+		q = Query(ws)
+		q.getArtistById(makeId(1, 0), self.artistIncludes)
+		q.getReleaseById(makeId(2, 0), self.releaseIncludes)
+		q.getTracks(self.trackFilter)
+
+		self.server = StandInServer(self.directory)
+		self.server.start()
+		self.ws = WebService(host='127.0.0.1', port=self.server.port,
+			scheduler=NullScheduler())
+
+		self.gzipServer = StandInServer(self.directory, compression=True)
+		self.gzipServer.start()
+		self.gzipWs = WebService(host='127.0.0.1',
+			port=self.gzipServer.port, scheduler=NullScheduler())
+
+	def tearDown(self):
+		for ws in (self.ws, self.gzipWs):
+			ws.getConnectionPool().closeAll()
+		self.server.stop()
+		self.gzipServer.stop()
+		shutil.rmtree(self.directory)
+
+	def benchArtist(self):
+		Query(self.ws).getArtistById(makeId(1, 0), self.artistIncludes)
+
+	def benchRelease(self):
+		Query(self.ws).getReleaseById(makeId(2, 0), self.releaseIncludes)
+
+	def benchTrackSearch(self):
+		Query(self.ws).getTracks(self.trackFilter)
+
+	def benchArtistGzip(self):
+		Query(self.gzipWs).getArtistById(makeId(1, 0), self.artistIncludes)
+
+	def benchReleaseGzip(self):
+		Query(self.gzipWs).getReleaseById(makeId(2, 0),
+			self.releaseIncludes)
+
+# EOF
@@ -0,0 +1,192 @@
+"""Benchmarks for parsing and writing XML documents."""
+__revision__ = '$Id$'
+
+import StringIO
+import musicbrainz2.wsxml as wsxml
+from musicbrainz2.wsxml import MbXmlParser, MbXmlWriter, Projection, \
+	DefaultFactory, LazyFactory, IdentityMap, getParserEngines
+from bench.harness import Benchmark
+from bench.documents import artistDocument, releaseDocument, \
+	trackSearchDocument
+
+
+_DOCUMENTS = {
+	'SmallArtist': artistDocument(5, 3),
+	'LargeArtist': artistDocument(200, 100),
+	'SmallRelease': releaseDocument(10),
+	'LargeRelease': releaseDocument(100),
+	'SmallTracks': trackSearchDocument(10),
+	'LargeTracks': trackSearchDocument(100),
+}
+
+# Reads only IDs and titles.
+_PROJECTION = Projection({
+	'artist': ['name'],
+	'release': ['title'],
+	'track': ['title'],
+})
+
+
+class _ParseBenchmark(Benchmark):
+	engine = None
+
+	def _parse(self, name):
+		MbXmlParser(engine=self.engine).parse(
+			StringIO.StringIO(_DOCUMENTS[name]))
+
+	def benchSmallArtist(self):
+		self._parse('SmallArtist')
+
+	def benchLargeArtist(self):
+		self._parse('LargeArtist')
+
+	def benchSmallRelease(self):
+		self._parse('SmallRelease')
+
+	def benchLargeRelease(self):
+		self._parse('LargeRelease')
+
+	def benchSmallTracks(self):
+		self._parse('SmallTracks')
+
+	def benchLargeTracks(self):
+		self._parse('LargeTracks')
+
+
+class ExpatParseBenchmark(_ParseBenchmark):
+	engine = 'expat'
+
+
+class MinidomParseBenchmark(_ParseBenchmark):
+	engine = 'minidom'
+
+
+if 'lxml' in getParserEngines():
+	class LxmlParseBenchmark(_ParseBenchmark):
+		engine = 'lxml'
+
+
+class _TreeBenchmark(Benchmark):
+	"""Reads documents into element trees, without creating objects."""
+	engine = None
+	projection = None
+
+	def _parse(self, name):
+		wsxml._engines[self.engine]().parse(
+			StringIO.StringIO(_DOCUMENTS[name]), self.projection)
+
+	def benchLargeArtist(self):
+		self._parse('LargeArtist')
+
+	def benchLargeRelease(self):
+		self._parse('LargeRelease')
+
+	def benchLargeTracks(self):
+		self._parse('LargeTracks')
+
+
+class ExpatTreeBenchmark(_TreeBenchmark):
+	engine = 'expat'
+
+
+class ExpatProjectionTreeBenchmark(_TreeBenchmark):
+	engine = 'expat'
+	projection = _PROJECTION
+
+
+if 'lxml' in getParserEngines():
+	class LxmlTreeBenchmark(_TreeBenchmark):
+		engine = 'lxml'
+
+	class LxmlProjectionTreeBenchmark(_TreeBenchmark):
+		engine = 'lxml'
+		projection = _PROJECTION
+
+
+class ProjectionParseBenchmark(Benchmark):
+	"""Parses documents, reading only IDs and titles."""
+
+	def _parse(self, name):
+		MbXmlParser(projection=_PROJECTION).parse(
+			StringIO.StringIO(_DOCUMENTS[name]))
+
+	def benchLargeArtist(self):
+		self._parse('LargeArtist')
+
+	def benchLargeRelease(self):
+		self._parse('LargeRelease')
+
+	def benchLargeTracks(self):
+		self._parse('LargeTracks')
+
+
+class LazyParseBenchmark(Benchmark):
+	"""Parses documents using a LazyFactory.
+
+	The C{Used} benchmarks access one of the child lists, too.
+	"""
+
+	def _parse(self, name):
+		return MbXmlParser(factory=LazyFactory()).parse(
+			StringIO.StringIO(_DOCUMENTS[name]))
+
+	def benchLargeArtist(self):
+		self._parse('LargeArtist')
+
+	def benchLargeArtistUsed(self):
+		self._parse('LargeArtist').artist.getReleases()
+
+	def benchLargeRelease(self):
+		self._parse('LargeRelease')
+
+	def benchLargeReleaseUsed(self):
+		self._parse('LargeRelease').release.getTracks()
+
+	def benchLargeTracks(self):
+		self._parse('LargeTracks')
+
+
+class IdentityMapParseBenchmark(Benchmark):
+	"""Parses documents using a factory with an identity map.
+
+	The map is kept between calls, so all entities are merged into
+	the ones from the first call.
+	"""
+
+	def setUp(self):
+		self.factory = DefaultFactory(IdentityMap())
+
+	def _parse(self, name):
+		MbXmlParser(self.factory).parse(StringIO.StringIO(_DOCUMENTS[name]))
+
+	def benchLargeArtist(self):
+		self._parse('LargeArtist')
+
+	def benchLargeRelease(self):
+		self._parse('LargeRelease')
+
+	def benchLargeTracks(self):
+		self._parse('LargeTracks')
+
+
+class WriteBenchmark(Benchmark):
+
+	def setUp(self):
+		self.metadata = { }
+		for (name, xml) in _DOCUMENTS.items():
+			self.metadata[name] = MbXmlParser(engine='expat').parse(
+				StringIO.StringIO(xml))
+
+	def _write(self, name):
+		MbXmlWriter().write(StringIO.StringIO(), self.metadata[name])
+
+	def benchLargeArtist(self):
+		self._write('LargeArtist')
+
+	def benchLargeRelease(self):
+		self._write('LargeRelease')
+
+	def benchLargeTracks(self):
+		self._write('LargeTracks')
+
+# EOF
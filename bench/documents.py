@@ -0,0 +1,165 @@
+"""Synthetic web service documents for benchmarks.
+
+The documents are generated deterministically, so results of different
+runs and versions are comparable. Each function takes a size parameter;
+the benchmarks use a small and a large variant of each document.
+"""
+__revision__ = '$Id$'
+
+__all__ = [
+	'makeId', 'artistDocument', 'releaseDocument', 'trackSearchDocument',
+]
+
+_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n' \
+	'<metadata xmlns="http://musicbrainz.org/ns/mmd-1.0#"\n' \
+	'    xmlns:ext="http://musicbrainz.org/ns/ext-1.0#">\n'
+_FOOTER = '</metadata>\n'
+
+_ARTIST_RELATIONS = ('MemberOfBand', 'Collaboration', 'IsPerson')
+_URL_RELATIONS = ('Wikipedia', 'Discogs', 'OfficialHomepage', 'Myspace')
+_RELEASE_TYPES = ('Album Official', 'Single Official', 'Live Bootleg',
+	'Compilation Promotion')
+
+
+def makeId(kind, n):
+	"""Returns a deterministic UUID.
+
+	@param kind: an integer identifying the entity type
+	@param n: an integer
+
+	@return: a string
+	"""
+	return '%08x-0000-4000-8000-%012x' % (kind, n)
+
+
+def artistDocument(numReleases, numRelations):
+	"""Returns an artist with releases and relations.
+
+	@param numReleases: the number of releases
+	@param numRelations: the number of relations of each target type
+
+	@return: a string containing an XML document
+	"""
+	parts = [ _HEADER ]
+	parts.append('<artist id="%s" type="Group">\n'
+		'<name>Benchmark Artist</name>\n'
+		'<sort-name>Artist, Benchmark</sort-name>\n'
+		'<life-span begin="1980-01-01" end="2005-12-31"/>\n'
+		'<alias-list><alias>Bench</alias><alias>BA</alias></alias-list>\n'
+		% makeId(1, 0))
+
+	parts.append('<release-list count="%d" offset="0">\n' % numReleases)
+	for i in range(numReleases):
+		parts.append('<release id="%s" type="%s">'
+			'<title>Release %d</title>'
+			'<text-representation language="ENG" script="Latn"/>'
+			'<asin>B%09d</asin>'
+			'<release-event-list><event date="%d-01-01" country="GB"/>'
+			'</release-event-list>'
+			'<track-list count="%d"/></release>\n'
+			% (makeId(2, i), _RELEASE_TYPES[i % len(_RELEASE_TYPES)],
+			i, i, 1980 + i % 30, 8 + i % 10))
+	parts.append('</release-list>\n')
+
+	parts.append('<relation-list target-type="Artist">\n')
+	for i in range(numRelations):
+		attrs = ''
+		if i % 3 == 0:
+			attrs = ' attributes="Additional Guest"'
+		parts.append('<relation type="%s" target="%s" direction="%s"'
+			' begin="%d"%s><artist id="%s"><name>Member %d</name>'
+			'</artist></relation>\n'
+			% (_ARTIST_RELATIONS[i % len(_ARTIST_RELATIONS)],
+			makeId(1, i + 1), ('forward', 'backward')[i % 2],
+			1980 + i % 20, attrs, makeId(1, i + 1), i))
+	parts.append('</relation-list>\n')
+
+	parts.append('<relation-list target-type="Url">\n')
+	for i in range(numRelations):
+		parts.append('<relation type="%s" '
+			'target="http://example.com/artist/%d"/>\n'
+			% (_URL_RELATIONS[i % len(_URL_RELATIONS)], i))
+	parts.append('</relation-list>\n')
+
+	parts.append('<tag-list><tag count="10">rock</tag>'
+		'<tag count="3">pop</tag></tag-list>\n'
+		'<rating votes-count="42">4.2</rating>\n</artist>\n')
+	parts.append(_FOOTER)
+	return ''.join(parts)
+
+
+def releaseDocument(numTracks):
+	"""Returns a release with tracks and release events.
+
+	@param numTracks: the number of tracks
+
+	@return: a string containing an XML document
+	"""
+	parts = [ _HEADER ]
+	parts.append('<release id="%s" type="Album Official">\n'
+		'<title>Benchmark Release</title>\n'
+		'<text-representation language="ENG" script="Latn"/>\n'
+		'<asin>B000000000</asin>\n'
+		'<artist id="%s"><name>Benchmark Artist</name></artist>\n'
+		'<release-group id="%s" type="Album">'
+		'<title>Benchmark Release</title></release-group>\n'
+		'<release-event-list>\n'
+		% (makeId(2, 0), makeId(1, 0), makeId(4, 0)))
+	for country in ('GB', 'US', 'DE', 'JP'):
+		parts.append('<event date="1994-01-31" country="%s" '
+			'catalog-number="CAT-%s" barcode="0123456789012" format="CD">'
+			'<label id="%s"><name>Label %s</name></label></event>\n'
+			% (country, country, makeId(5, 0), country))
+	parts.append('</release-event-list>\n'
+		'<disc-list><disc id="zuO.9qXrwQkV6Tnh7Z4cD4ILjWI-" '
+		'sectors="230690"/></disc-list>\n')
+
+	parts.append('<track-list count="%d" offset="0">\n' % numTracks)
+	for i in range(numTracks):
+		parts.append('<track id="%s"><title>Track %d</title>'
+			'<duration>%d</duration>'
+			'<artist id="%s"><name>Guest %d</name></artist>'
+			'<puid-list><puid id="%s"/></puid-list>'
+			'<isrc-list><isrc id="GBAAA%07d"/></isrc-list></track>\n'
+			% (makeId(3, i), i, 180000 + i * 1000, makeId(1, i + 1), i,
+			makeId(6, i), i))
+	parts.append('</track-list>\n</release>\n')
+	parts.append(_FOOTER)
+	return ''.join(parts)
+
+
+def trackSearchDocument(numResults, offset=0, count=None, numArtists=None):
+	"""Returns track search results.
+
+	By default, each track has a different artist. If C{numArtists} is
+	given, the tracks share that many artists.
+
+	@param numResults: the number of results
+	@param offset: the offset of the first result
+	@param count: the total number of results, or None
+	@param numArtists: the number of different artists, or None
+
+	@return: a string containing an XML document
+	"""
+	if count is None:
+		count = numResults
+	if numArtists is None:
+		numArtists = offset + numResults
+
+	parts = [ _HEADER ]
+	parts.append('<track-list count="%d" offset="%d">\n' % (count, offset))
+	for i in range(offset, offset + numResults):
+		parts.append('<track id="%s" ext:score="%d">'
+			'<title>Track %d</title><duration>%d</duration>'
+			'<artist id="%s"><name>Artist %d</name></artist>'
+			'<release-list><release id="%s" type="Album Official">'
+			'<title>Release %d</title><track-list offset="%d"/>'
+			'</release></release-list></track>\n'
+			% (makeId(3, i), 100 - i % 100, i, 180000 + i * 1000,
+			makeId(1, i % numArtists), i % numArtists, makeId(2, i), i,
+			i % 12))
+	parts.append('</track-list>\n')
+	parts.append(_FOOTER)
+	return ''.join(parts)
+
+# EOF
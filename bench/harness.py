@@ -0,0 +1,299 @@
+"""A minimal benchmark harness.
+
+Benchmarks are written like unit tests: A benchmark module contains
+subclasses of L{Benchmark}, and each method starting with C{bench} is
+one benchmark. L{setUp} and L{tearDown} are called before and after
+each of them.
+
+Each benchmark method is called repeatedly, with garbage collection
+disabled, until C{minTime} seconds have passed. This is repeated
+C{repeat} times, and the best and the median time per call are
+reported. The results can be written as JSON and compared with the
+results of an earlier run.
+
+Methods starting with C{size} measure memory instead. They return a
+list of objects, and the number of bytes per object is reported (see
+L{measureSize}).
+"""
+__revision__ = '$Id$'
+
+import gc
+import sys
+import time
+import types
+import platform
+
+try:
+	import json
+except ImportError:
+	import simplejson as json
+
+try:
+	import lxml.etree as _lxml
+except ImportError:
+	_lxml = None
+
+import musicbrainz2
+
+__all__ = [
+	'Benchmark', 'measure', 'measureSize', 'loadBenchmarks', 'runBenchmarks',
+	'writeResults', 'readResults', 'compareResults',
+]
+
+if sys.platform == 'win32':
+	_timer = time.clock
+else:
+	_timer = time.time
+
+
+class Benchmark(object):
+	"""Base class for benchmarks."""
+
+	def setUp(self):
+		"""Called before each benchmark method."""
+		pass
+
+	def tearDown(self):
+		"""Called after each benchmark method."""
+		pass
+
+
+def measure(func, minTime=0.2, repeat=5):
+	"""Measures the time needed to call a function.
+
+	@param func: a callable object without parameters
+	@param minTime: the min. number of seconds per measurement
+	@param repeat: the number of measurements
+
+	@return: a dictionary containing the best and the median time per
+		call in seconds, the number of calls per measurement, and the
+		number of measurements
+	"""
+	func() # warm up, and find out how long a call takes
+	number = 1
+	while True:
+		elapsed = _time(func, number)
+		if elapsed >= minTime:
+			break
+		number = max(number * 2, int(number * minTime / max(elapsed, 1e-6)))
+
+	times = [elapsed / number]
+	for i in range(repeat - 1):
+		times.append(_time(func, number) / number)
+	times.sort()
+
+	return {
+		'best': times[0],
+		'median': times[len(times) / 2],
+		'number': number,
+		'repeat': repeat,
+	}
+
+
+# Objects of these types are shared by all objects, so they aren't counted.
+_SHARED_TYPES = (type, types.ClassType, types.ModuleType, types.FunctionType,
+	types.BuiltinFunctionType, types.CodeType, types.NoneType)
+
+def measureSize(func):
+	"""Measures the memory used by objects.
+
+	The sizes of all objects reachable from the objects returned by
+	C{func} are added up, counting each object once. Classes, modules
+	and functions aren't counted. Objects referenced by all of the
+	returned objects, like interned strings, are counted, so the
+	result depends a bit on the number of objects.
+
+	lxml elements keep their whole document alive, which isn't
+	visible to Python. Each referenced document is counted once, see
+	L{_lxmlDocumentSize}.
+
+	@param func: a callable object without parameters returning a list
+
+	@return: a dictionary containing the number of bytes per object
+		and the number of objects
+	"""
+	objects = func()
+	seen = set([ id(objects) ])
+	pending = list(objects)
+	documents = { } # keeps the root proxies, so their ids aren't reused
+	total = 0
+	while len(pending) > 0:
+		obj = pending.pop()
+		if id(obj) in seen or isinstance(obj, _SHARED_TYPES):
+			continue
+		seen.add(id(obj))
+		total += sys.getsizeof(obj)
+		pending.extend(gc.get_referents(obj))
+		if _lxml is not None and isinstance(obj, _lxml._Element):
+			root = obj.getroottree().getroot()
+			if id(root) not in documents:
+				documents[id(root)] = root
+				total += _lxmlDocumentSize(root)
+
+	return {
+		'bytes': float(total) / len(objects),
+		'count': len(objects),
+	}
+
+
+# Approximate sizes of libxml2's node and attribute structures.
+_LXML_NODE_SIZE = 120
+_LXML_ATTR_SIZE = 96
+
+def _lxmlDocumentSize(root):
+	"""Estimates the memory used by libxml2 for a document.
+
+	Element, text and attribute nodes and their strings are added up.
+	Names and the parser's buffers aren't counted, so this is less
+	than what is actually used.
+
+	@param root: the root element of an lxml document
+
+	@return: the number of bytes
+	"""
+	total = 0
+	for node in root.iter():
+		total += _LXML_NODE_SIZE + len(node.text or '')
+		if node.tail:
+			total += _LXML_NODE_SIZE + len(node.tail)
+		for value in node.attrib.values():
+			total += _LXML_ATTR_SIZE + _LXML_NODE_SIZE + len(value)
+	return total
+
+
+def _time(func, number):
+	gcEnabled = gc.isenabled()
+	gc.collect()
+	gc.disable()
+	try:
+		start = _timer()
+		for i in xrange(number):
+			func()
+		return _timer() - start
+	finally:
+		if gcEnabled:
+			gc.enable()
+
+
+def loadBenchmarks(moduleNames, pattern=None):
+	"""Finds all benchmarks in the given modules.
+
+	@param moduleNames: a list of module names
+	@param pattern: a string, only benchmarks with names containing it
+		are returned, or None
+
+	@return: a list of tuples (name, class, methodName)
+	"""
+	result = [ ]
+	for moduleName in moduleNames:
+		module = __import__(moduleName, { }, { }, [ '' ])
+		for (className, cls) in sorted(vars(module).items()):
+			if className.startswith('_') or not isinstance(cls, type) \
+					or not issubclass(cls, Benchmark):
+				continue
+			for methodName in sorted(dir(cls)):
+				if not methodName.startswith('bench') and \
+						not methodName.startswith('size'):
+					continue
+				name = '.'.join((moduleName.split('.')[-1], className,
+					methodName))
+				if pattern is None or pattern in name:
+					result.append( (name, cls, methodName) )
+	return result
+
+
+def runBenchmarks(benchmarks, minTime=0.2, repeat=5, out=sys.stdout):
+	"""Runs benchmarks, printing the results.
+
+	@param benchmarks: a list as returned by L{loadBenchmarks}
+	@param minTime: the min. number of seconds per measurement
+	@param repeat: the number of measurements
+	@param out: a file-like object for progress output
+
+	@return: a dictionary mapping benchmark names to results of
+		L{measure} or L{measureSize}
+	"""
+	results = { }
+	for (name, cls, methodName) in benchmarks:
+		bench = cls()
+		bench.setUp()
+		try:
+			func = getattr(bench, methodName)
+			if methodName.startswith('size'):
+				result = measureSize(func)
+			else:
+				result = measure(func, minTime, repeat)
+		finally:
+			bench.tearDown()
+
+		results[name] = result
+		if 'bytes' in result:
+			print >>out, '%-60s %12.1f B' % (name, result['bytes'])
+		else:
+			print >>out, '%-60s %12.1f us' % (name, result['best'] * 1e6)
+	return results
+
+
+def writeResults(outStream, results):
+	"""Writes results as JSON, along with version information.
+
+	@param outStream: a file-like object
+	@param results: a dictionary as returned by L{runBenchmarks}
+	"""
+	doc = {
+		'version': musicbrainz2.__version__,
+		'python': platform.python_version(),
+		'platform': platform.platform(),
+		'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+		'results': results,
+	}
+	json.dump(doc, outStream, indent=2, sort_keys=True)
+
+
+def readResults(inStream):
+	"""Reads results written by L{writeResults}.
+
+	@param inStream: a file-like object
+
+	@return: a dictionary mapping benchmark names to results
+	"""
+	return json.load(inStream)['results']
+
+
+def compareResults(results, previous, out=sys.stdout, threshold=0.1):
+	"""Prints a comparison of two result sets.
+
+	Benchmarks which are slower than before by more than C{threshold}
+	(0.1 meaning 10%) are marked. For memory benchmarks, the number of
+	bytes per object is compared. If the earlier result was 0, any
+	increase is a regression.
+
+	@param results: a dictionary as returned by L{runBenchmarks}
+	@param previous: a dictionary as returned by L{readResults}
+	@param out: a file-like object
+	@param threshold: the relative slowdown considered a regression
+
+	@return: a list of the names of regressed benchmarks
+	"""
+	regressions = [ ]
+	for name in sorted(results.keys()):
+		if name not in previous:
+			continue
+		key = 'bytes' in results[name] and 'bytes' or 'best'
+		old = previous[name][key]
+		new = results[name][key]
+		if old > 0:
+			change = float(new - old) / old
+		elif new > 0:
+			change = float('inf')
+		else:
+			change = 0.0
+		if change > threshold:
+			regressions.append(name)
+			mark = ' REGRESSION'
+		else:
+			mark = ''
+		print >>out, '%-60s %+7.1f%%%s' % (name, change * 100, mark)
+	return regressions
+
+# EOF
@@ -30,6 +30,63 @@ class TestCommand(Command):
 		t.run(tests)
 
 
+class BenchCommand(Command):
+	description = 'run the benchmarks'
+	user_options = [
+		('filter=', 'f', 'only run benchmarks containing this string'),
+		('output=', 'o', 'write the results to this JSON file'),
+		('compare=', 'c', 'compare with the results in this JSON file '
+			'and fail on regressions'),
+		('min-time=', 't', 'min. number of seconds per measurement'),
+		('repeat=', 'r', 'number of measurements per benchmark'),
+	]
+
+	def initialize_options(self):
+		self.filter = None
+		self.output = None
+		self.compare = None
+		self.min_time = 0.2
+		self.repeat = 5
+
+	def finalize_options(self):
+		self.min_time = float(self.min_time)
+		self.repeat = int(self.repeat)
+
+	def run(self):
+		sys.path.insert(0, '.')
+		from bench import harness
+
+		modules = [ ]
+		for f in sorted(os.listdir('bench')):
+			elems = os.path.splitext(f)
+			if f.startswith('bench_') and elems[1] == '.py':
+				modules.append('bench.' + elems[0])
+
+		benchmarks = harness.loadBenchmarks(modules, self.filter)
+		results = harness.runBenchmarks(benchmarks, self.min_time,
+			self.repeat)
+
+		if self.output:
+			f = open(self.output, 'w')
+			try:
+				harness.writeResults(f, results)
+			finally:
+				f.close()
+
+		if self.compare:
+			f = open(self.compare)
+			try:
+				previous = harness.readResults(f)
+			finally:
+				f.close()
+			print
+			regressions = harness.compareResults(results, previous)
+			if regressions:
+				print>>sys.stderr, 'error: %d benchmark(s) regressed' \
+					% len(regressions)
+				sys.exit(1)
+
+
 class GenerateDocsCommand(Command):
 	description = 'generate the API documentation'
 	user_options = [ ]
@@ -94,8 +151,9 @@ setup_args = {
 	'license':	'BSD',
 	'packages':	[ 'musicbrainz2', 'musicbrainz2.data' ],
 	'package_dir':	{ 'musicbrainz2': 'src/musicbrainz2' },
-	'scripts':	[ 'bin/mb-submit-disc' ],
-	'cmdclass':	{ 'test': TestCommand, 'docs': GenerateDocsCommand },
+	'scripts':	[ 'bin/mb-submit-disc', 'bin/mb-cache' ],
+	'cmdclass':	{ 'test': TestCommand, 'bench': BenchCommand,
+			'docs': GenerateDocsCommand },
 }
 
 setup(**setup_args)
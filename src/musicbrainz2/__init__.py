@@ -18,6 +18,20 @@ This package contains the following modules:
 
  5. L{utils}: Utilities for working with URIs and other commonly needed tools.
 
+ 6. L{transport}: Connection handling used by L{webservice}.
+
+ 7. L{asyncws}: Non-blocking variants of the L{webservice} classes.
+
+ 8. L{workers}: Futures and a thread pool used for concurrent requests.
+
+ 9. L{cache}: Caches for web service responses.
+
+ 10. L{diskcache}: A persistent response cache using SQLite.
+
+ 11. L{replay}: Recording and replaying responses for offline testing.
+
+ 12. L{metrics}: Timing and tracing hooks for web service requests.
+
 @author: Matthias Friedrich <matt@mafr.de>
 """
 __revision__ = '$Id$'
@@ -0,0 +1,192 @@
+"""Non-blocking access to the MusicBrainz XML web service.
+
+The classes in this module mirror L{webservice.WebService
+<musicbrainz2.webservice.WebService>} and L{webservice.Query
+<musicbrainz2.webservice.Query>}, but their methods return immediately.
+Instead of a result, a L{Future <musicbrainz2.workers.Future>} is
+returned, which contains the result as soon as the request has been
+processed by a pool of background threads. This makes it easy to have
+many requests in flight from a single thread:
+
+>>> import musicbrainz2.asyncws as asyncws
+>>> q = asyncws.AsyncQuery()
+>>> f1 = q.getArtistById('c0b2500e-0cef-4130-869d-732b23ed9df5')
+>>> f2 = q.getReleaseById('33dbcf02-25b9-4a35-bdb7-729455f33ad7')
+>>> f1.result().name
+u'Tori Amos'
+>>> f2.result().title
+u'Tales of a Librarian'
+>>>
+
+The same filter and include classes as with L{Query
+<musicbrainz2.webservice.Query>} are used, and results are parsed by
+the same L{MbXmlParser <musicbrainz2.wsxml.MbXmlParser>}. Errors are
+raised when calling L{Future.result <musicbrainz2.workers.Future.result>}.
+
+Note that all requests are still subject to the web service's
+L{request scheduler <musicbrainz2.transport.IRequestScheduler>}, so
+more threads don't mean more requests per second to the MusicBrainz
+server.
+"""
+__revision__ = '$Id$'
+
+from musicbrainz2.webservice import IWebService, WebService, Query
+from musicbrainz2.workers import WorkerPool
+
+__all__ = [ 'AsyncWebService', 'AsyncQuery' ]
+
+
+class AsyncWebService(IWebService):
+	"""An L{IWebService} returning futures.
+
+	This wraps another L{IWebService} object. Its L{get} and L{post}
+	methods return a L{Future <musicbrainz2.workers.Future>} containing
+	the file-like object returned by the wrapped web service.
+	"""
+
+	def __init__(self, ws=None, pool=None, maxWorkers=4):
+		"""Constructor.
+
+		If C{ws} isn't given, a L{WebService} object with default
+		settings is used. If no C{pool} is given, a new L{WorkerPool
+		<musicbrainz2.workers.WorkerPool>} with C{maxWorkers} threads
+		is created.
+
+		@param ws: an L{IWebService} object, or None
+		@param pool: a L{WorkerPool <musicbrainz2.workers.WorkerPool>},
+			or None
+		@param maxWorkers: the number of threads for a new pool
+		"""
+		if ws is None:
+			ws = WebService()
+		if pool is None:
+			pool = WorkerPool(maxWorkers)
+		self._ws = ws
+		self._pool = pool
+
+	def getWebService(self):
+		"""Returns the wrapped web service.
+
+		@return: an L{IWebService} object
+		"""
+		return self._ws
+
+	def getPool(self):
+		"""Returns the pool running the requests.
+
+		@return: a L{WorkerPool <musicbrainz2.workers.WorkerPool>}
+		"""
+		return self._pool
+
+	def get(self, entity, id_, include=( ), filter={ }, version='1'):
+		"""Queries the web service in the background.
+
+		@return: a L{Future <musicbrainz2.workers.Future>} object
+
+		@see: L{IWebService.get}
+		"""
+		return self._pool.submit(self._ws.get, entity, id_, include,
+			filter, version)
+
+	def post(self, entity, id_, data, version='1'):
+		"""Submits data to the web service in the background.
+
+		@return: a L{Future <musicbrainz2.workers.Future>} object
+
+		@see: L{IWebService.post}
+		"""
+		return self._pool.submit(self._ws.post, entity, id_, data,
+			version)
+
+
+class AsyncQuery(object):
+	"""A L{Query} returning futures.
+
+	This class has the same methods as L{Query}, taking the same
+	arguments. Each method queues the request and returns a L{Future
+	<musicbrainz2.workers.Future>} immediately. See L{Query} for the
+	documentation of each method.
+	"""
+
+	def __init__(self, ws=None, wsFactory=WebService, clientId=None,
+			cache=None, pool=None, maxWorkers=4, tracer=None,
+			factory=None):
+		"""Constructor.
+
+		The C{ws}, C{wsFactory}, C{clientId}, C{cache}, C{tracer} and
+		C{factory} parameters work like in L{Query}. If C{ws} is an
+		L{AsyncWebService}, its wrapped web service and its pool are
+		used.
+
+		@param ws: an L{IWebService} or L{AsyncWebService} object, or None
+		@param wsFactory: a callable object which creates an object
+		@param clientId: a unicode string containing the application's ID
+		@param cache: an L{ICache <musicbrainz2.cache.ICache>}, or None
+		@param pool: a L{WorkerPool <musicbrainz2.workers.WorkerPool>},
+			or None
+		@param maxWorkers: the number of threads for a new pool
+		@param tracer: an L{ITracer <musicbrainz2.metrics.ITracer>},
+			or None
+		@param factory: a L{DefaultFactory
+			<musicbrainz2.wsxml.DefaultFactory>} object, or None
+		"""
+		if isinstance(ws, AsyncWebService):
+			if pool is None:
+				pool = ws.getPool()
+			ws = ws.getWebService()
+		if pool is None:
+			pool = WorkerPool(maxWorkers)
+
+		self._query = Query(ws, wsFactory, clientId, cache, tracer, factory)
+		self._pool = pool
+
+	def getQuery(self):
+		"""Returns the L{Query} object doing the actual work.
+
+		@return: a L{Query} object
+		"""
+		return self._query
+
+	def getPool(self):
+		"""Returns the pool running the requests.
+
+		@return: a L{WorkerPool <musicbrainz2.workers.WorkerPool>}
+		"""
+		return self._pool
+
+
+# The Query methods available in AsyncQuery.
+_QUERY_METHODS = (
+	'getArtistById', 'getArtists',
+	'getLabelById', 'getLabels',
+	'getReleaseById', 'getReleases',
+	'getReleaseGroupById', 'getReleaseGroups',
+	'getTrackById', 'getTracks',
+	'getUserByName',
+	'getArtistsByIds', 'getReleasesByIds', 'getTracksByIds',
+	'submitPuids', 'submitISRCs',
+	'submitPuidsInBulk', 'submitISRCsInBulk',
+	'addToUserCollection', 'removeFromUserCollection',
+	'getUserCollection', 'getUserCollectionChanges',
+	'submitUserTags', 'getUserTags',
+	'submitUserRating', 'getUserRating',
+	'submitCDStub',
+)
+
+def _makeAsyncMethod(name):
+	def method(self, *args, **kwargs):
+		return self._pool.submit(getattr(self._query, name),
+			*args, **kwargs)
+
+	method.__name__ = name
+	method.__doc__ = """Runs L{Query.%s} in the background.
+
+		@return: a L{Future <musicbrainz2.workers.Future>} object
+		""" % name
+	return method
+
+for _name in _QUERY_METHODS:
+	setattr(AsyncQuery, _name, _makeAsyncMethod(_name))
+del _name
+
+# EOF
@@ -0,0 +1,332 @@
+"""Caches for web service responses.
+
+L{MemoryCache} is a bounded in-memory cache which can be passed to
+L{Query <musicbrainz2.webservice.Query>}. It keeps parsed responses, so
+requesting the same resource again neither needs a server round trip
+nor parsing:
+
+>>> import musicbrainz2.webservice as ws
+>>> from musicbrainz2.cache import MemoryCache
+>>> cache = MemoryCache(maxEntries=500, ttl=3600)
+>>> q = ws.Query(cache=cache)
+>>> artist = q.getArtistById('c0b2500e-0cef-4130-869d-732b23ed9df5')
+>>> artist = q.getArtistById('c0b2500e-0cef-4130-869d-732b23ed9df5')
+>>> cache.hits, cache.misses
+(1, 1)
+>>>
+
+A response requested with more include tags than needed is used as
+well, even if it was stored by another L{Query} sharing the cache (see
+L{ICache.getSuperset}).
+
+Note that cached objects are shared between all callers requesting the
+same resource. Don't modify objects returned by a L{Query} using a cache.
+"""
+__revision__ = '$Id$'
+
+import time
+import threading
+
+__all__ = [ 'ICache', 'MemoryCache' ]
+
+
+class ICache(object):
+	"""An interface for caches used by L{Query
+	<musicbrainz2.webservice.Query>}.
+
+	Keys are tuples of strings, values are arbitrary objects. Caches
+	have to be thread safe.
+
+	L{Query <musicbrainz2.webservice.Query>} uses keys of the form
+	C{(entity, id, includes, filters)}, where C{includes} and
+	C{filters} are sorted tuples of strings. L{WebService
+	<musicbrainz2.webservice.WebService>} uses URLs as keys.
+	"""
+
+	def get(self, key):
+		"""Returns a cached value.
+
+		@param key: a hashable object
+
+		@return: the cached value, or None if there is none
+		"""
+		raise NotImplementedError()
+
+	def getSuperset(self, key):
+		"""Returns a value cached for a key, or for a key requesting more.
+
+		If there's no value for exactly this key, a value stored for the
+		same resource and a superset of the key's include tags may be
+		returned. Release type tags (like C{sa-Official}) restrict the
+		included releases, so they have to match exactly. The lookup
+		counts as a single hit or miss.
+
+		This implementation only looks up the exact key. Subclasses
+		override it if they know the format of their keys.
+
+		@param key: a hashable object
+
+		@return: the cached value, or None if there is none
+		"""
+		return self.get(key)
+
+	def put(self, key, value, size=0):
+		"""Adds a value to the cache.
+
+		@param key: a hashable object
+		@param value: the object to cache, not None
+		@param size: the approximate size of the value in bytes
+		"""
+		raise NotImplementedError()
+
+	def remove(self, key):
+		"""Removes a value from the cache, if it exists.
+
+		@param key: a hashable object
+		"""
+		raise NotImplementedError()
+
+	def clear(self):
+		"""Removes all values from the cache."""
+		raise NotImplementedError()
+
+
+class MemoryCache(ICache):
+	"""A bounded in-memory cache with LRU eviction.
+
+	The cache holds at most C{maxEntries} values. If C{maxBytes} is
+	given, the approximate sizes of all values may not exceed it. If
+	one of the limits is reached, the least recently used values are
+	evicted. Values are removed C{ttl} seconds after they have been
+	added, if a C{ttl} is given.
+
+	Values stored using L{Query <musicbrainz2.webservice.Query>} keys
+	are indexed by resource, so L{getSuperset} finds responses with
+	more include tags without scanning the cache.
+
+	The cache counts hits, misses, and evictions.
+	"""
+
+	def __init__(self, maxEntries=1000, maxBytes=None, ttl=None):
+		"""Constructor.
+
+		@param maxEntries: the max. number of values
+		@param maxBytes: the max. total size of all values, or None
+		@param ttl: the max. age of values in seconds, or None
+		"""
+		self._maxEntries = maxEntries
+		self._maxBytes = maxBytes
+		self._ttl = ttl
+		self._lock = threading.Lock()
+
+		# Each entry is a list [prev, next, key, value, size, expires].
+		# The entries form a circular doubly linked list, starting
+		# with the least recently used one.
+		self._entries = { }
+		self._root = [None, None, None, None, 0, None]
+		self._root[0] = self._root[1] = self._root
+		self._bytes = 0
+
+		# Maps (entity, id, filters) to the include tuples in the cache.
+		self._includes = { }
+
+		self._hits = 0
+		self._misses = 0
+		self._evictions = 0
+
+	def get(self, key):
+		self._lock.acquire()
+		try:
+			entry = self._entries.get(key)
+			if entry is None:
+				self._misses += 1
+				return None
+
+			if entry[5] is not None and entry[5] < time.time():
+				self._unlink(entry)
+				self._misses += 1
+				return None
+
+			# move to the end of the list (most recently used)
+			self._unlink(entry)
+			self._link(entry)
+			self._hits += 1
+			return entry[3]
+		finally:
+			self._lock.release()
+
+	def getSuperset(self, key):
+		split = _splitKey(key)
+		if split is None:
+			return self.get(key)
+
+		(resource, includes) = split
+		self._lock.acquire()
+		try:
+			candidates = [includes] + [k for k in
+				self._includes.get(resource, ())
+				if k != includes and _isIncludeSuperset(k, includes)]
+
+			now = time.time()
+			for cached in candidates:
+				entry = self._entries.get(
+					(resource[0], resource[1], cached, resource[2]))
+				if entry is None:
+					continue
+				if entry[5] is not None and entry[5] < now:
+					self._unlink(entry)
+					continue
+
+				self._unlink(entry)
+				self._link(entry)
+				self._hits += 1
+				return entry[3]
+
+			self._misses += 1
+			return None
+		finally:
+			self._lock.release()
+
+	def put(self, key, value, size=0):
+		assert value is not None, 'cannot cache None'
+
+		if self._maxBytes is not None and size > self._maxBytes:
+			return # would evict everything, including itself
+
+		if self._ttl is not None:
+			expires = time.time() + self._ttl
+		else:
+			expires = None
+
+		self._lock.acquire()
+		try:
+			old = self._entries.get(key)
+			if old is not None:
+				self._unlink(old)
+
+			self._link([None, None, key, value, size, expires])
+
+			while len(self._entries) > self._maxEntries or \
+					(self._maxBytes is not None and
+					self._bytes > self._maxBytes):
+				self._unlink(self._root[1])
+				self._evictions += 1
+		finally:
+			self._lock.release()
+
+	def remove(self, key):
+		self._lock.acquire()
+		try:
+			entry = self._entries.get(key)
+			if entry is not None:
+				self._unlink(entry)
+		finally:
+			self._lock.release()
+
+	def clear(self):
+		self._lock.acquire()
+		try:
+			self._entries.clear()
+			self._includes.clear()
+			self._root[0] = self._root[1] = self._root
+			self._bytes = 0
+		finally:
+			self._lock.release()
+
+	def __len__(self):
+		return len(self._entries)
+
+	def _link(self, entry):
+		last = self._root[0]
+		entry[0] = last
+		entry[1] = self._root
+		last[1] = entry
+		self._root[0] = entry
+		self._entries[entry[2]] = entry
+		self._bytes += entry[4]
+
+		split = _splitKey(entry[2])
+		if split is not None:
+			known = self._includes.setdefault(split[0], [ ])
+			if split[1] not in known:
+				known.append(split[1])
+
+	def _unlink(self, entry):
+		entry[0][1] = entry[1]
+		entry[1][0] = entry[0]
+		del self._entries[entry[2]]
+		self._bytes -= entry[4]
+
+		split = _splitKey(entry[2])
+		if split is not None:
+			known = self._includes.get(split[0], [ ])
+			if split[1] in known:
+				known.remove(split[1])
+			if len(known) == 0:
+				self._includes.pop(split[0], None)
+
+	def getSize(self):
+		"""Returns the approximate size of all cached values.
+
+		@return: an integer containing the size in bytes
+		"""
+		return self._bytes
+
+	size = property(getSize, doc='The approximate size in bytes.')
+
+	def getHits(self):
+		"""Returns the number of successful lookups.
+
+		@return: an integer
+		"""
+		return self._hits
+
+	hits = property(getHits, doc='The number of cache hits.')
+
+	def getMisses(self):
+		"""Returns the number of failed lookups.
+
+		@return: an integer
+		"""
+		return self._misses
+
+	misses = property(getMisses, doc='The number of cache misses.')
+
+	def getEvictions(self):
+		"""Returns the number of values evicted due to size limits.
+
+		@return: an integer
+		"""
+		return self._evictions
+
+	evictions = property(getEvictions, doc='The number of evictions.')
+
+
+def _splitKey(key):
+	"""Returns a tuple (resource, includes) for a key used by Query.
+
+	The resource is a tuple C{(entity, id, filters)}. None is returned
+	for keys of other formats.
+	"""
+	if not isinstance(key, tuple) or len(key) != 4:
+		return None
+	(entity, id_, includes, filters) = key
+	return ((entity, id_, filters), includes)
+
+def _isIncludeSuperset(cached, requested):
+	"""Checks if a response for the cached include tags contains
+	everything requested.
+
+	Release type tags (like C{sa-Official}) restrict the list of
+	included releases, so they have to match exactly.
+	"""
+	for tag in requested:
+		if tag not in cached:
+			return False
+
+	def releaseTypes(tags):
+		return [t for t in tags if t[:3] in ('sa-', 'va-')]
+
+	return releaseTypes(cached) == releaseTypes(requested)
+
+# EOF
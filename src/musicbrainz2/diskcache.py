@@ -0,0 +1,398 @@
+"""A persistent cache for web service responses.
+
+L{DiskCache} stores the raw XML returned by the web service in an SQLite
+database. Unlike L{MemoryCache <musicbrainz2.cache.MemoryCache>}, it
+survives restarts and can be shared by several processes on the same
+machine. Pass it to a L{WebService <musicbrainz2.webservice.WebService>}:
+
+>>> import musicbrainz2.webservice as ws
+>>> from musicbrainz2.diskcache import DiskCache
+>>> cache = DiskCache('/var/cache/mb/responses.db', maxBytes=50*1024*1024)
+>>> q = ws.Query(ws.WebService(responseCache=cache))
+>>>
+
+Responses are compressed using zlib and are keyed by their URL. How long
+they are kept depends on the entity type (see L{DiskCache.__init__}).
+A response requested with more include tags than needed is used as
+well, even if another process stored it.
+The C{mb-cache} script can be used to inspect and prune a cache file.
+
+This module needs the sqlite3 package, which is included in python-2.5
+and later.
+"""
+__revision__ = '$Id$'
+
+import time
+import zlib
+import urllib
+import logging
+import urlparse
+import threading
+import sqlite3
+from musicbrainz2.cache import ICache, _isIncludeSuperset
+
+__all__ = [ 'DiskCache', 'DEFAULT_TTLS' ]
+
+
+# Responses depending on the authenticated user aren't cached at all.
+DEFAULT_TTLS = {
+	'collection': 0,
+	'rating': 0,
+	'tag': 0,
+	'user': 0,
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+	url TEXT PRIMARY KEY,
+	entity TEXT NOT NULL,
+	body BLOB NOT NULL,
+	size INTEGER NOT NULL,
+	created REAL NOT NULL,
+	expires REAL NOT NULL,
+	accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+CREATE TABLE IF NOT EXISTS includes (
+	url TEXT PRIMARY KEY,
+	resource TEXT NOT NULL,
+	inc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS includes_resource ON includes (resource);
+"""
+
+
+class DiskCache(ICache):
+	"""A persistent, size-bounded cache for raw web service responses.
+
+	Keys are URLs, values are strings containing the response body.
+	The include tags of each URL are kept in a side table, so
+	L{getSuperset} finds responses with more include tags. The total
+	size of all (compressed) bodies is kept below
+	C{maxBytes} by evicting the least recently used responses.
+
+	Several threads and processes may use the same file at the same
+	time. If the database is locked for longer than C{timeout}
+	seconds, the lookup counts as a miss or the response isn't
+	stored, respectively; errors are logged but never raised.
+	"""
+
+	def __init__(self, path, maxBytes=100*1024*1024, ttl=86400,
+			entityTtls=None, timeout=5.0):
+		"""Constructor.
+
+		The C{ttl} is the number of seconds responses are kept. It can
+		be overridden for individual entity types (like C{'artist'} or
+		C{'release'}) using the C{entityTtls} dictionary. A TTL of 0
+		disables caching for an entity type. The C{entityTtls} are
+		added to L{DEFAULT_TTLS}, so responses depending on the user
+		aren't cached unless C{entityTtls} explicitly says so.
+
+		@param path: a string containing the database's file name
+		@param maxBytes: the max. total size of all responses
+		@param ttl: the default TTL in seconds
+		@param entityTtls: a dictionary mapping entity types to TTLs,
+			or None
+		@param timeout: max. number of seconds to wait for a lock
+		"""
+		self._path = path
+		self._maxBytes = maxBytes
+		self._ttl = ttl
+		self._entityTtls = dict(DEFAULT_TTLS)
+		if entityTtls is not None:
+			self._entityTtls.update(entityTtls)
+		self._timeout = timeout
+		self._local = threading.local()
+		self._lock = threading.Lock()
+		self._log = logging.getLogger(str(self.__class__))
+
+		self._hits = 0
+		self._misses = 0
+		self._evictions = 0
+
+		self._getConnection().executescript(_SCHEMA)
+
+	def getPath(self):
+		"""Returns the file name of the database.
+
+		@return: a string
+		"""
+		return self._path
+
+	path = property(getPath, doc='The file name of the database.')
+
+	def getTtl(self, entity):
+		"""Returns the TTL used for responses of an entity type.
+
+		@param entity: a string containing the entity type
+
+		@return: the TTL in seconds
+		"""
+		return self._entityTtls.get(entity, self._ttl)
+
+	def get(self, key):
+		try:
+			value = self._lookup(self._getConnection(), key)
+			if value is not None:
+				self._count('_hits')
+				return value
+		except (sqlite3.Error, zlib.error), e:
+			self._log.warning('cache lookup failed: %s', e)
+
+		self._count('_misses')
+		return None
+
+	def getSuperset(self, key):
+		(resource, includes) = _splitIncludes(key)
+		try:
+			conn = self._getConnection()
+			value = self._lookup(conn, key)
+			if value is None:
+				rows = conn.execute('SELECT url, inc FROM includes '
+					'WHERE resource = ? AND url != ?', (resource, key))
+				for (url, inc) in rows.fetchall():
+					if not _isIncludeSuperset(inc.split(), includes):
+						continue
+					value = self._lookup(conn, url)
+					if value is not None:
+						break
+
+			if value is not None:
+				self._count('_hits')
+				return value
+		except (sqlite3.Error, zlib.error), e:
+			self._log.warning('cache lookup failed: %s', e)
+
+		self._count('_misses')
+		return None
+
+	def put(self, key, value, size=0):
+		entity = _getEntity(key)
+		ttl = self.getTtl(entity)
+		if ttl <= 0:
+			return
+
+		body = zlib.compress(value)
+		if len(body) > self._maxBytes:
+			return
+
+		now = time.time()
+		try:
+			conn = self._getConnection()
+			conn.execute('BEGIN IMMEDIATE')
+			try:
+				conn.execute('INSERT OR REPLACE INTO responses '
+					'(url, entity, body, size, created, expires, '
+					'accessed) VALUES (?, ?, ?, ?, ?, ?, ?)',
+					(key, entity, sqlite3.Binary(body), len(body),
+					now, now + ttl, now))
+				(resource, includes) = _splitIncludes(key)
+				conn.execute('INSERT OR REPLACE INTO includes '
+					'(url, resource, inc) VALUES (?, ?, ?)',
+					(key, resource, ' '.join(includes)))
+				self._evict(conn)
+				conn.execute('COMMIT')
+			except:
+				conn.execute('ROLLBACK')
+				raise
+		except sqlite3.Error, e:
+			self._log.warning('cache update failed: %s', e)
+
+	def remove(self, key):
+		self._modify([
+			('DELETE FROM responses WHERE url = ?', (key,)),
+			('DELETE FROM includes WHERE url = ?', (key,)),
+		])
+
+	def clear(self):
+		self._modify([
+			('DELETE FROM responses', ()),
+			('DELETE FROM includes', ()),
+		])
+
+	def prune(self):
+		"""Removes all expired responses.
+
+		@return: the number of removed responses
+		"""
+		count = self._modify([
+			('DELETE FROM responses WHERE expires < ?', (time.time(),)),
+			('DELETE FROM includes WHERE url NOT IN '
+				'(SELECT url FROM responses)', ()),
+		])
+		return count or 0
+
+	def getEntries(self, entity=None):
+		"""Returns information about the cached responses.
+
+		Each entry is a tuple (url, entity, size, created, expires),
+		where C{size} is the compressed size in bytes and the times are
+		seconds since the epoch. Entries are sorted by URL.
+
+		@param entity: a string containing an entity type, or None
+			for all entity types
+
+		@return: a list of tuples
+		"""
+		sql = 'SELECT url, entity, size, created, expires FROM responses'
+		if entity is None:
+			rows = self._getConnection().execute(sql + ' ORDER BY url')
+		else:
+			rows = self._getConnection().execute(
+				sql + ' WHERE entity = ? ORDER BY url', (entity,))
+		return [tuple(row) for row in rows]
+
+	def getEntityStats(self):
+		"""Returns the number and size of responses per entity type.
+
+		@return: a dictionary mapping entity types to tuples (count, size)
+		"""
+		rows = self._getConnection().execute('SELECT entity, COUNT(*), '
+			'SUM(size) FROM responses GROUP BY entity')
+		result = { }
+		for (entity, count, size) in rows:
+			result[entity] = (count, size)
+		return result
+
+	def __len__(self):
+		return self._getConnection().execute(
+			'SELECT COUNT(*) FROM responses').fetchone()[0]
+
+	def getSize(self):
+		"""Returns the compressed size of all cached responses.
+
+		@return: an integer containing the size in bytes
+		"""
+		return self._getConnection().execute(
+			'SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+	size = property(getSize, doc='The size of all responses in bytes.')
+
+	def getHits(self):
+		"""Returns the number of successful lookups in this process.
+
+		@return: an integer
+		"""
+		return self._hits
+
+	hits = property(getHits, doc='The number of cache hits.')
+
+	def getMisses(self):
+		"""Returns the number of failed lookups in this process.
+
+		@return: an integer
+		"""
+		return self._misses
+
+	misses = property(getMisses, doc='The number of cache misses.')
+
+	def getEvictions(self):
+		"""Returns the number of responses evicted by this process.
+
+		@return: an integer
+		"""
+		return self._evictions
+
+	evictions = property(getEvictions, doc='The number of evictions.')
+
+	def _getConnection(self):
+		# sqlite3 connections can't be shared between threads
+		conn = getattr(self._local, 'conn', None)
+		if conn is None:
+			conn = sqlite3.connect(self._path, timeout=self._timeout,
+				isolation_level=None)
+			conn.execute('PRAGMA journal_mode=WAL')
+			conn.execute('PRAGMA synchronous=NORMAL')
+			self._local.conn = conn
+		return conn
+
+	def _modify(self, statements):
+		"""Executes (sql, parameters) tuples in one transaction.
+
+		@return: the number of rows changed by the first statement, or
+			None if the transaction failed
+		"""
+		try:
+			conn = self._getConnection()
+			conn.execute('BEGIN IMMEDIATE')
+			try:
+				count = conn.execute(*statements[0]).rowcount
+				for statement in statements[1:]:
+					conn.execute(*statement)
+				conn.execute('COMMIT')
+				return count
+			except:
+				conn.execute('ROLLBACK')
+				raise
+		except sqlite3.Error, e:
+			self._log.warning('cache update failed: %s', e)
+			return None
+
+	def _lookup(self, conn, url):
+		"""Returns the body stored for a URL, or None if it expired."""
+		now = time.time()
+		row = conn.execute('SELECT body, expires FROM responses '
+			'WHERE url = ?', (url,)).fetchone()
+		if row is None or row[1] < now:
+			return None
+
+		conn.execute('UPDATE responses SET accessed = ? '
+			'WHERE url = ?', (now, url))
+		return zlib.decompress(str(row[0]))
+
+	def _evict(self, conn):
+		total = conn.execute('SELECT SUM(size) FROM responses'
+			).fetchone()[0]
+		if total <= self._maxBytes:
+			return
+
+		victims = [ ]
+		rows = conn.execute('SELECT url, size FROM responses '
+			'ORDER BY accessed')
+		for (url, size) in rows:
+			if total <= self._maxBytes:
+				break
+			victims.append( (url,) )
+			total -= size
+
+		conn.executemany('DELETE FROM responses WHERE url = ?', victims)
+		conn.executemany('DELETE FROM includes WHERE url = ?', victims)
+		self._count('_evictions', len(victims))
+
+	def _count(self, name, n=1):
+		self._lock.acquire()
+		try:
+			setattr(self, name, getattr(self, name) + n)
+		finally:
+			self._lock.release()
+
+
+def _getEntity(url):
+	"""Returns the entity type of a web service URL.
+
+	URLs have the form C{http://host/prefix/version/entity/id?query}.
+	"""
+	path = urlparse.urlparse(url)[2]
+	return path.split('/')[-2]
+
+def _splitIncludes(url):
+	"""Returns a tuple (resource, includes) for a web service URL.
+
+	The resource is the URL without its C{inc} parameter and with the
+	other parameters sorted. The includes are a sorted tuple of tags.
+	"""
+	(scheme, netloc, path, params, query, fragment) = urlparse.urlparse(url)
+	includes = [ ]
+	others = [ ]
+	for (name, value) in urlparse.parse_qsl(query, True):
+		if name == 'inc':
+			includes = value.split()
+		else:
+			others.append( (name, value) )
+	includes.sort()
+	others.sort()
+	resource = urlparse.urlunparse((scheme, netloc, path, params,
+		urllib.urlencode(others), fragment))
+	return (resource, tuple(includes))
+
+# EOF
@@ -0,0 +1,592 @@
+"""Timing and tracing hooks for the web service classes.
+
+L{WebService <musicbrainz2.webservice.WebService>} and L{Query
+<musicbrainz2.webservice.Query>} report how long each phase of a request
+takes by creating timed spans using an L{ITracer}. By default, a
+L{NullTracer} is used which records nothing. To find out where time
+goes, pass a L{HistogramCollector}, which keeps a L{Histogram} of the
+durations per span name:
+
+>>> import sys
+>>> import musicbrainz2.webservice as ws
+>>> from musicbrainz2.metrics import HistogramCollector
+>>> collector = HistogramCollector(groupBy=('entity',))
+>>> q = ws.Query(ws.WebService(tracer=collector), tracer=collector)
+>>> artist = q.getArtistById('c0b2500e-0cef-4130-869d-732b23ed9df5')
+>>> collector.writeSummary(sys.stdout)
+>>>
+
+The following spans are created:
+ - C{query}: a lookup made by L{Query}, including cache lookups and
+   parsing. The C{source} tag is C{'cache'}, C{'server'} or
+   C{'coalesced'} (see L{Query.getCoalescedCount
+   <musicbrainz2.webservice.Query.getCoalescedCount>}).
+ - C{xml.parse}: reading and tokenizing the response.
+ - C{xml.build}: creating the model objects.
+ - C{ws.get} and C{ws.post}: a request made by L{WebService
+   <musicbrainz2.webservice.WebService>}, from calling C{get()} or
+   C{post()} until the response body has been read completely. Tags
+   are C{url}, C{status}, C{attempts}, C{cached}, C{encoding}, and
+   C{bytes} and C{wireBytes}, the body's size after and before
+   decompression.
+ - C{ws.schedule}: waiting for the request scheduler.
+ - C{ws.connect}: resolving the host name and opening a connection.
+   This is skipped if a pooled connection is reused.
+ - C{ws.server}: sending the request and waiting for the response
+   headers. This is mostly the time the server needs.
+ - C{ws.transfer}: the time spent reading the response body. Since the
+   body is usually parsed while it is read, this time is also part of
+   C{xml.parse}.
+
+All spans of a lookup have the C{entity} and C{include} tags. Phases
+are created as children of the span they belong to using
+L{Span.startChild}.
+
+To send the measurements to an external metrics or tracing system,
+subclass L{Tracer} and override L{Tracer.spanFinished}. L{LoggingTracer}
+writes one log record per request, which is cheaper than enabling debug
+logging in production. Several tracers can be combined using a
+L{MultiTracer}:
+
+>>> import logging
+>>> from musicbrainz2.metrics import MultiTracer, LoggingTracer
+>>> tracer = MultiTracer([collector, LoggingTracer(sampleRate=0.01)])
+>>> q = ws.Query(ws.WebService(tracer=tracer), tracer=tracer)
+>>>
+"""
+__revision__ = '$Id$'
+
+import math
+import time
+import random
+import logging
+import threading
+
+__all__ = [
+	'ITracer', 'Span', 'Tracer', 'NullTracer', 'MultiTracer',
+	'HistogramCollector', 'Histogram', 'LoggingTracer',
+]
+
+
+class ITracer(object):
+	"""An interface for classes creating timed spans.
+
+	Tracers have to be thread safe, because one tracer is usually shared
+	by several threads.
+	"""
+
+	def startSpan(self, name, tags=None, parent=None):
+		"""Starts a new span.
+
+		The span has to be finished using L{Span.finish}.
+
+		@param name: a string containing the span's name
+		@param tags: a dictionary mapping tag names to values, or None
+		@param parent: the L{Span} this span is a part of, or None
+
+		@return: a L{Span} object
+		"""
+		raise NotImplementedError()
+
+
+class Span(object):
+	"""A timed operation.
+
+	A span is started by L{ITracer.startSpan} and measures the time until
+	L{finish} is called. Tags can be used to describe the operation, for
+	example the entity type requested or the HTTP status code returned.
+	"""
+
+	def __init__(self, tracer, name, tags=None, parent=None):
+		"""Constructor.
+
+		@param tracer: the L{Tracer} creating this span
+		@param name: a string containing the span's name
+		@param tags: a dictionary mapping tag names to values, or None
+		@param parent: the L{Span} this span is a part of, or None
+		"""
+		self._tracer = tracer
+		self._name = name
+		if tags is None:
+			self._tags = { }
+		else:
+			self._tags = dict(tags)
+		self._parent = parent
+		self._start = time.time()
+		self._duration = None
+		self._error = None
+
+	def getName(self):
+		"""Returns the span's name.
+
+		@return: a string
+		"""
+		return self._name
+
+	name = property(getName, doc='The span\'s name.')
+
+	def getTags(self):
+		"""Returns the span's tags.
+
+		@return: a dictionary mapping tag names to values
+		"""
+		return self._tags
+
+	tags = property(getTags, doc='The span\'s tags.')
+
+	def getTag(self, name, default=None):
+		"""Returns the value of a tag.
+
+		@param name: a string containing the tag's name
+		@param default: the value returned if the tag isn't set
+
+		@return: the tag's value, or C{default}
+		"""
+		return self._tags.get(name, default)
+
+	def setTag(self, name, value):
+		"""Sets a tag.
+
+		@param name: a string containing the tag's name
+		@param value: the tag's value
+		"""
+		self._tags[name] = value
+
+	def getParent(self):
+		"""Returns the span this span is a part of.
+
+		@return: a L{Span} object, or None
+		"""
+		return self._parent
+
+	parent = property(getParent, doc='The parent span, or None.')
+
+	def getStart(self):
+		"""Returns the time the span was started.
+
+		@return: the number of seconds since the epoch
+		"""
+		return self._start
+
+	start = property(getStart, doc='The time the span was started.')
+
+	def getDuration(self):
+		"""Returns the span's duration.
+
+		@return: the duration in seconds, or None if the span
+			hasn't been finished yet
+		"""
+		return self._duration
+
+	duration = property(getDuration, doc='The duration in seconds.')
+
+	def getError(self):
+		"""Returns the exception the operation failed with.
+
+		@return: an exception object, or None
+		"""
+		return self._error
+
+	error = property(getError, doc='The exception, or None.')
+
+	def startChild(self, name, tags=None):
+		"""Starts a span for a part of this span's operation.
+
+		The new span has all tags of this span, plus the given ones.
+
+		@param name: a string containing the span's name
+		@param tags: a dictionary mapping tag names to values, or None
+
+		@return: a L{Span} object
+		"""
+		childTags = dict(self._tags)
+		if tags is not None:
+			childTags.update(tags)
+		return self._tracer.startSpan(name, childTags, self)
+
+	def finish(self, error=None, duration=None):
+		"""Ends the span and reports it to the tracer.
+
+		Finishing a span more than once has no effect.
+
+		@param error: the exception the operation failed with, or None
+		@param duration: the duration in seconds, or None to use the
+			time since the span was started
+		"""
+		if self._duration is not None:
+			return
+
+		if duration is None:
+			duration = time.time() - self._start
+		self._duration = duration
+		self._error = error
+		self._tracer.spanFinished(self)
+
+
+class Tracer(ITracer):
+	"""A base class for tracers.
+
+	This creates L{Span} objects and calls L{spanFinished} each time one
+	of them is finished, which does nothing. Subclasses override it to
+	collect or forward the measurements.
+	"""
+
+	def startSpan(self, name, tags=None, parent=None):
+		return Span(self, name, tags, parent)
+
+	def spanFinished(self, span):
+		"""Called when a span has been finished.
+
+		This may be called by several threads at the same time.
+
+		@param span: a finished L{Span} object
+		"""
+		pass
+
+
+class NullTracer(ITracer):
+	"""A tracer which records nothing.
+
+	All spans returned are the same object, which ignores all calls.
+	"""
+
+	def startSpan(self, name, tags=None, parent=None):
+		return _NULL_SPAN
+
+
+class _NullSpan(Span):
+	def __init__(self):
+		Span.__init__(self, None, '')
+
+	def setTag(self, name, value):
+		pass
+
+	def startChild(self, name, tags=None):
+		return self
+
+	def finish(self, error=None, duration=None):
+		pass
+
+_NULL_SPAN = _NullSpan()
+
+
+class MultiTracer(Tracer):
+	"""A tracer passing all spans to several other tracers.
+
+	@see: L{Tracer.spanFinished}
+	"""
+
+	def __init__(self, tracers):
+		"""Constructor.
+
+		@param tracers: a sequence of L{Tracer} objects
+		"""
+		self._tracers = tuple(tracers)
+
+	def spanFinished(self, span):
+		for tracer in self._tracers:
+			tracer.spanFinished(span)
+
+
+class HistogramCollector(Tracer):
+	"""A tracer keeping a histogram of durations per span name.
+
+	If C{groupBy} contains tag names, durations are also collected per
+	combination of span name and tag values. For a C{groupBy} of
+	C{('entity',)}, the durations of C{ws.get} spans are kept under the
+	keys C{'ws.get'}, C{('ws.get', 'artist')}, C{('ws.get', 'release')},
+	and so on.
+	"""
+
+	def __init__(self, groupBy=()):
+		"""Constructor.
+
+		@param groupBy: a sequence of tag names
+		"""
+		self._groupBy = tuple(groupBy)
+		self._histograms = { }
+		self._errors = { }
+		self._lock = threading.Lock()
+
+	def spanFinished(self, span):
+		keys = [ span.getName() ]
+		if len(self._groupBy) > 0:
+			values = [ span.getTag(name) for name in self._groupBy ]
+			keys.append( tuple([ span.getName() ] + values) )
+
+		self._lock.acquire()
+		try:
+			for key in keys:
+				histogram = self._histograms.get(key)
+				if histogram is None:
+					histogram = self._histograms[key] = Histogram()
+				histogram.add(span.getDuration())
+
+				if span.getError() is not None:
+					self._errors[key] = self._errors.get(key, 0) + 1
+		finally:
+			self._lock.release()
+
+	def getKeys(self):
+		"""Returns the keys of all histograms.
+
+		@return: a sorted list of strings and tuples
+		"""
+		self._lock.acquire()
+		try:
+			keys = self._histograms.keys()
+		finally:
+			self._lock.release()
+		keys.sort()
+		return keys
+
+	def getHistogram(self, key):
+		"""Returns the durations of spans with the given key.
+
+		@param key: a span name, or a tuple containing a span name and
+			values of the C{groupBy} tags
+
+		@return: a L{Histogram} object, or None
+		"""
+		self._lock.acquire()
+		try:
+			return self._histograms.get(key)
+		finally:
+			self._lock.release()
+
+	def getErrorCount(self, key):
+		"""Returns the number of failed spans with the given key.
+
+		@param key: a span name, or a tuple as in L{getHistogram}
+
+		@return: an integer
+		"""
+		self._lock.acquire()
+		try:
+			return self._errors.get(key, 0)
+		finally:
+			self._lock.release()
+
+	def reset(self):
+		"""Removes all collected durations."""
+		self._lock.acquire()
+		try:
+			self._histograms = { }
+			self._errors = { }
+		finally:
+			self._lock.release()
+
+	def writeSummary(self, outStream):
+		"""Writes a table with statistics for all keys.
+
+		Times are given in milliseconds.
+
+		@param outStream: a file-like object
+		"""
+		outStream.write('%-32s %7s %7s %9s %9s %9s %9s\n' % ('span',
+			'count', 'errors', 'mean', 'p50', 'p90', 'max'))
+		for key in self.getKeys():
+			h = self.getHistogram(key)
+			if isinstance(key, tuple):
+				name = ' '.join([str(k) for k in key])
+			else:
+				name = key
+			outStream.write('%-32s %7d %7d %9.1f %9.1f %9.1f %9.1f\n' % (
+				name, h.count, self.getErrorCount(key), h.mean * 1000,
+				h.getPercentile(50) * 1000, h.getPercentile(90) * 1000,
+				h.max * 1000))
+
+
+class LoggingTracer(Tracer):
+	"""A tracer writing one log record per request.
+
+	For each finished span with one of the given C{names}, a record like
+	this is logged::
+
+		ws.get duration=0.213 attempts=1 bytes=2405 cached=False
+			entity=artist include=aliases status=200 url=http://...
+
+	The message contains the duration in seconds and all tags, sorted by
+	name. The record's C{spanName}, C{duration} and C{tags} attributes
+	contain the same information for handlers writing structured logs.
+
+	Only a random sample of the successful requests is logged, as given
+	by C{sampleRate}. Failed requests are always logged, using the
+	C{WARNING} level. Records are only created if the logger is enabled
+	for the level in question.
+	"""
+
+	def __init__(self, logger=None, sampleRate=1.0, level=logging.INFO,
+			names=('ws.get', 'ws.post'), seed=None):
+		"""Constructor.
+
+		@param logger: a C{logging.Logger}, or None to use the
+			C{'musicbrainz2.requests'} logger
+		@param sampleRate: the fraction of successful requests to log,
+			from 0 to 1
+		@param level: the level used for successful requests
+		@param names: a sequence containing the span names to log
+		@param seed: a seed for the random number generator, or None
+		"""
+		if logger is None:
+			logger = logging.getLogger('musicbrainz2.requests')
+		self._logger = logger
+		self._sampleRate = sampleRate
+		self._level = level
+		self._names = frozenset(names)
+		self._random = random.Random(seed)
+		self._lock = threading.Lock()
+
+	def spanFinished(self, span):
+		if span.getName() not in self._names:
+			return
+
+		if span.getError() is not None:
+			level = logging.WARNING
+		else:
+			level = self._level
+			if self._sampleRate < 1.0:
+				self._lock.acquire()
+				try:
+					sampled = self._random.random() < self._sampleRate
+				finally:
+					self._lock.release()
+				if not sampled:
+					return
+
+		if not self._logger.isEnabledFor(level):
+			return
+
+		tags = span.getTags()
+		names = tags.keys()
+		names.sort()
+		fields = [ '%s=%s' % (name, tags[name]) for name in names ]
+		if span.getError() is not None:
+			fields.append('error=%s' % (span.getError(),))
+
+		self._logger.log(level, '%s duration=%.3f %s', span.getName(),
+			span.getDuration(), ' '.join(fields), extra={
+				'spanName': span.getName(),
+				'duration': span.getDuration(),
+				'tags': tags,
+			})
+
+
+class Histogram(object):
+	"""A histogram with exponentially growing buckets.
+
+	Each bucket is C{growth} times as wide as the previous one, starting
+	at C{minValue}. Percentiles are accurate to a factor of C{growth}.
+	Count, total, minimum and maximum are exact.
+
+	This class isn't thread safe.
+	"""
+
+	def __init__(self, minValue=1e-5, growth=1.1):
+		"""Constructor.
+
+		@param minValue: the upper bound of the first bucket
+		@param growth: the factor between the bounds of two buckets
+		"""
+		self._minValue = minValue
+		self._logGrowth = math.log(growth)
+		self._buckets = { }
+		self._count = 0
+		self._total = 0.0
+		self._min = None
+		self._max = None
+
+	def add(self, value):
+		"""Adds a value.
+
+		@param value: a non-negative number
+		"""
+		if value <= self._minValue:
+			index = 0
+		else:
+			index = int(math.ceil(
+				math.log(value / self._minValue) / self._logGrowth))
+		self._buckets[index] = self._buckets.get(index, 0) + 1
+
+		self._count += 1
+		self._total += value
+		if self._min is None or value < self._min:
+			self._min = value
+		if self._max is None or value > self._max:
+			self._max = value
+
+	def getCount(self):
+		"""Returns the number of values.
+
+		@return: an integer
+		"""
+		return self._count
+
+	count = property(getCount, doc='The number of values.')
+
+	def getTotal(self):
+		"""Returns the sum of all values.
+
+		@return: a float
+		"""
+		return self._total
+
+	total = property(getTotal, doc='The sum of all values.')
+
+	def getMin(self):
+		"""Returns the smallest value.
+
+		@return: a number, or None if there are no values
+		"""
+		return self._min
+
+	min = property(getMin, doc='The smallest value.')
+
+	def getMax(self):
+		"""Returns the largest value.
+
+		@return: a number, or None if there are no values
+		"""
+		return self._max
+
+	max = property(getMax, doc='The largest value.')
+
+	def getMean(self):
+		"""Returns the average of all values.
+
+		@return: a float, or None if there are no values
+		"""
+		if self._count == 0:
+			return None
+		return self._total / self._count
+
+	mean = property(getMean, doc='The average of all values.')
+
+	def getPercentile(self, percent):
+		"""Returns an approximate percentile.
+
+		The result is the upper bound of the bucket containing the
+		percentile, but never more than the largest value.
+
+		@param percent: a number between 0 and 100
+
+		@return: a float, or None if there are no values
+		"""
+		if self._count == 0:
+			return None
+		elif percent <= 0:
+			return self._min
+
+		rank = percent / 100.0 * self._count
+		seen = 0
+		indexes = self._buckets.keys()
+		indexes.sort()
+		for index in indexes:
+			seen += self._buckets[index]
+			if seen >= rank:
+				break
+
+		bound = self._minValue * math.exp(index * self._logGrowth)
+		return max(self._min, min(bound, self._max))
+
+# EOF
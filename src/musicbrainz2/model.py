@@ -42,7 +42,36 @@ NS_REL_1 = 'http://musicbrainz.org/ns/rel-1.0#'
 NS_EXT_1 = 'http://musicbrainz.org/ns/ext-1.0#'
 
 
-class Entity(object):
+class _Slotted(object):
+	"""A base class for model classes using C{__slots__}.
+
+	Model objects store their attributes in slots instead of a
+	C{__dict__}, which saves memory if many of them are kept. This
+	class makes them picklable with all pickle protocols. Attributes
+	of derived classes without C{__slots__} are in a C{__dict__},
+	which is pickled, too.
+	"""
+	__slots__ = ( )
+
+	def __getstate__(self):
+		state = { }
+		for cls in type(self).__mro__:
+			for name in cls.__dict__.get('__slots__', ( )):
+				if name == '__weakref__' or name in state:
+					continue
+				try:
+					state[name] = getattr(self, name)
+				except AttributeError:
+					pass # not set
+		state.update(getattr(self, '__dict__', { }))
+		return state
+
+	def __setstate__(self, state):
+		for (name, value) in state.items():
+			setattr(self, name, value)
+
+
+class Entity(_Slotted):
 	"""A first-level MusicBrainz class.
 
 	All entities in MusicBrainz have unique IDs (which are absolute URIs)
@@ -65,6 +94,8 @@ class Entity(object):
 	@see: L{Relation}
 	"""
 
+	__slots__ = ('_id', '_relations', '_tags', '_rating', '__weakref__')
+
 	def __init__(self, id_=None):
 		"""Constructor.
 
@@ -73,9 +104,9 @@ class Entity(object):
 		@param id_: a string containing an absolute URI
 		"""
 		self._id = id_
-		self._relations = { }
-		self._tags = { }
-		self._rating = Rating()
+		self._relations = None
+		self._tags = None
+		self._rating = None
 
 	def getId(self):
 		"""Returns a MusicBrainz ID.
@@ -129,8 +160,10 @@ class Entity(object):
 		"""
 		allRels = [ ]
 		if targetType is not None:
+			if self._relations is None:
+				self._relations = { }
 			allRels = self._relations.setdefault(targetType, [ ])
-		else:
+		elif self._relations is not None:
 			for (k, relList) in self._relations.items():
 				for rel in relList:
 					allRels.append(rel)
@@ -206,6 +239,8 @@ class Entity(object):
 		assert relation.getType is not None
 		assert relation.getTargetType is not None
 		assert relation.getTargetId is not None
+		if self._relations is None:
+			self._relations = { }
 		l = self._relations.setdefault(relation.getTargetType(), [ ])
 		l.append(relation)
 
@@ -222,6 +257,8 @@ class Entity(object):
 
 		@see: L{getRelations}
 		"""
+		if self._relations is None:
+			return [ ]
 		return self._relations.keys()
 
 	def getTag(self, value):
@@ -229,6 +266,8 @@ class Entity(object):
 
 		@return: the L{Tag} with the given name or raises a KeyError
 		"""
+		if self._tags is None:
+			raise KeyError(value)
 		return self._tags[value]
 
 	def getTags(self):
@@ -236,6 +275,8 @@ class Entity(object):
 
 		@return: a list of L{Tag} objects
 		"""
+		if self._tags is None:
+			return [ ]
 		return self._tags.values()
 
 	tags = property(getTags, doc='The tags for this entity.')
@@ -249,6 +290,8 @@ class Entity(object):
 
 		@see: L{getTags}
 		"""
+		if self._tags is None:
+			self._tags = { }
 		if self._tags.has_key(tag.value):
 			existing = self._tags[tag.value]
 			existing.count += tag.count
@@ -262,6 +305,8 @@ class Entity(object):
 
 		@return: rating
 		"""
+		if self._rating is None:
+			self._rating = Rating()
 		return self._rating
 
 	rating = property(getRating, doc='The rating for this entity.')
@@ -284,6 +329,13 @@ class Artist(Entity):
 	TYPE_PERSON = NS_MMD_1 + 'Person'
 	TYPE_GROUP = NS_MMD_1 + 'Group'
 
+	__slots__ = (
+		'_type', '_name', '_sortName', '_disambiguation', '_beginDate',
+		'_endDate', '_aliases', '_releases', '_releasesCount',
+		'_releasesOffset', '_releaseGroups', '_releaseGroupsCount',
+		'_releaseGroupsOffset',
+	)
+
 	def __init__(self, id_=None, type_=None, name=None, sortName=None):
 		"""Constructor.
 
@@ -299,11 +351,11 @@ class Artist(Entity):
 		self._disambiguation = None
 		self._beginDate = None
 		self._endDate = None
-		self._aliases = [ ]
-		self._releases = [ ]
+		self._aliases = None
+		self._releases = None
 		self._releasesCount = None
 		self._releasesOffset = None
-		self._releaseGroups = [ ]
+		self._releaseGroups = None
 		self._releaseGroupsCount = None
 		self._releaseGroupsOffset = None
 
@@ -467,6 +519,8 @@ class Artist(Entity):
 
 		@return: a list of L{ArtistAlias} objects
 		"""
+		if self._aliases is None:
+			self._aliases = [ ]
 		return self._aliases
 
 	aliases = property(getAliases, doc='The list of aliases.')
@@ -476,7 +530,7 @@ class Artist(Entity):
 		
 		@param alias: an L{ArtistAlias} object
 		"""
-		self._aliases.append(alias)
+		self.getAliases().append(alias)
 
 	def getReleases(self):
 		"""Returns a list of releases from this artist.
@@ -487,6 +541,8 @@ class Artist(Entity):
 
 		@return: a list of L{Release} objects
 		"""
+		if self._releases is None:
+			self._releases = [ ]
 		return self._releases
 
 	releases = property(getReleases, doc='The list of releases')
@@ -496,7 +552,7 @@ class Artist(Entity):
 
 		@param release: a L{Release} object
 		"""
-		self._releases.append(release)
+		self.getReleases().append(release)
 
 	def getReleasesOffset(self):
 		"""Returns the offset of the release list.
@@ -554,6 +610,8 @@ class Artist(Entity):
 		
 		@return: a list of L{ReleaseGroup} objects
 		"""
+		if self._releaseGroups is None:
+			self._releaseGroups = [ ]
 		return self._releaseGroups
 	
 	releaseGroups = property(getReleaseGroups, doc='The list of release groups')
@@ -563,7 +621,7 @@ class Artist(Entity):
 		
 		@param releaseGroup: a L{ReleaseGroup} object
 		"""
-		self._releaseGroups.append(releaseGroup)
+		self.getReleaseGroups().append(releaseGroup)
 
 	def getReleaseGroupsOffset(self):
 		"""Returns the offset of the release group list.
@@ -617,7 +675,7 @@ class Artist(Entity):
 		doc='The total number of release groups')
 
 
-class Rating(object):
+class Rating(_Slotted):
 	"""The representation of a MusicBrain rating.
 
 	The rating can have the following values:
@@ -625,6 +683,9 @@ class Rating(object):
 	0 = Unrated
 	[1..5] = Rating
 	"""
+
+	__slots__ = ('_value', '_count')
+
 	def __init__(self, value=None, count=None):
 		"""Constructor.
 
@@ -689,13 +750,16 @@ class Rating(object):
 		return unicode(self._value)
 
 
-class Tag(object):
+class Tag(_Slotted):
 	"""The representation of a MusicBrainz folksonomy tag.
 
 	The tag's value is the text that's displayed in the tag cloud.
 	The count attribute keeps track of how many users added the tag
 	to its owning entity.
 	"""
+
+	__slots__ = ('_value', '_count')
+
 	def __init__(self, value=None, count=None):
 		"""Constructor.
 
@@ -761,6 +825,11 @@ class Label(Entity):
 	TYPE_BOOTLEG = NS_MMD_1 + 'BootlegProduction'
 	TYPE_REISSUE = NS_MMD_1 + 'ReissueProduction'
 	
+	__slots__ = (
+		'_type', '_name', '_sortName', '_disambiguation', '_countryId',
+		'_code', '_beginDate', '_endDate', '_aliases',
+	)
+
 	def __init__(self, id_=None):
 		"""Constructor.
 
@@ -775,7 +844,7 @@ class Label(Entity):
 		self._code = None
 		self._beginDate = None
 		self._endDate = None
-		self._aliases = [ ]
+		self._aliases = None
 	
 	def getType(self):
 		"""Returns the type of this label.
@@ -960,6 +1029,8 @@ class Label(Entity):
 
 		@return: a list of L{LabelAlias} objects
 		"""
+		if self._aliases is None:
+			self._aliases = [ ]
 		return self._aliases
 
 	aliases = property(getAliases, doc='The list of aliases.')
@@ -969,7 +1040,7 @@ class Label(Entity):
 		
 		@param alias: a L{LabelAlias} object
 		"""
-		self._aliases.append(alias)
+		self.getAliases().append(alias)
 
 
 class Release(Entity):
@@ -1003,6 +1074,12 @@ class Release(Entity):
 	TYPE_BOOTLEG = NS_MMD_1 + 'Bootleg'
 	TYPE_PSEUDO_RELEASE = NS_MMD_1 + 'Pseudo-Release'
 
+	__slots__ = (
+		'_types', '_title', '_textLanguage', '_textScript', '_asin',
+		'_artist', '_releaseEvents', '_releaseGroup', '_discs', '_tracks',
+		'_tracksOffset', '_tracksCount',
+	)
+
 	def __init__(self, id_=None, title=None):
 		"""Constructor.
 
@@ -1010,18 +1087,18 @@ class Release(Entity):
 		@param title: a string containing the title
 		"""
 		Entity.__init__(self, id_)
-		self._types = [ ]
+		self._types = None
 		self._title = title
 		self._textLanguage = None
 		self._textScript = None
 		self._asin = None
 		self._artist = None
-		self._releaseEvents = [ ]
+		self._releaseEvents = None
 		#self._releaseEventsCount = None
 		self._releaseGroup = None
-		self._discs = [ ]
+		self._discs = None
 		#self._discIdsCount = None
-		self._tracks = [ ]
+		self._tracks = None
 		self._tracksOffset = None
 		self._tracksCount = None
 
@@ -1036,6 +1113,8 @@ class Release(Entity):
 
 		@see: L{musicbrainz2.utils.getReleaseTypeName}
 		"""
+		if self._types is None:
+			self._types = [ ]
 		return self._types
 
 	types = property(getTypes, doc='The list of types for this release.')
@@ -1047,7 +1126,7 @@ class Release(Entity):
 
 		@see: L{getTypes}
 		"""
-		self._types.append(type_)
+		self.getTypes().append(type_)
 
 	def getTitle(self):
 		"""Returns the release's title.
@@ -1204,6 +1283,8 @@ class Release(Entity):
 
 		@see: L{getTracksOffset}, L{getTracksCount}
 		"""
+		if self._tracks is None:
+			self._tracks = [ ]
 		return self._tracks
 
 	tracks = property(getTracks, doc='The list of tracks.')
@@ -1215,7 +1296,7 @@ class Release(Entity):
 
 		@param track: a L{Track} object
 		"""
-		self._tracks.append(track)
+		self.getTracks().append(track)
 
 	def getTracksOffset(self):
 		"""Returns the offset of the track list.
@@ -1280,6 +1361,8 @@ class Release(Entity):
 
 		@see: L{getReleaseEventsAsDict}
 		"""
+		if self._releaseEvents is None:
+			self._releaseEvents = [ ]
 		return self._releaseEvents
 
 	releaseEvents = property(getReleaseEvents,
@@ -1292,7 +1375,7 @@ class Release(Entity):
 
 		@see: L{getReleaseEvents}
 		"""
-		self._releaseEvents.append(event)
+		self.getReleaseEvents().append(event)
 
 	def getReleaseEventsAsDict(self):
 		"""Returns the release events represented as a dict.
@@ -1376,6 +1459,8 @@ class Release(Entity):
 
 		@return: a list of L{Disc} objects
 		"""
+		if self._discs is None:
+			self._discs = [ ]
 		return self._discs
 
 	discs = property(getDiscs, doc='The list of associated discs.')
@@ -1385,7 +1470,7 @@ class Release(Entity):
 
 		@param disc: a L{Disc} object
 		"""
-		self._discs.append(disc)
+		self.getDiscs().append(disc)
 
 	#def getDiscIdsCount(self):
 	#	return self._discIdsCount
@@ -1404,6 +1489,11 @@ class ReleaseGroup(Entity):
 	@see: L{Entity}
 	"""
 
+	__slots__ = (
+		'_title', '_type', '_releases', '_artist', '_releasesOffset',
+		'_releasesCount',
+	)
+
 	def __init__(self, id_=None, title=None):
 		"""Constructor.
 
@@ -1414,7 +1504,7 @@ class ReleaseGroup(Entity):
 		self._title = title
 		self._id = id_
 		self._type = None
-		self._releases = [ ]
+		self._releases = None
 		self._artist = None
 		self._releasesOffset = 0
 		self._releasesCount = 0
@@ -1453,6 +1543,8 @@ class ReleaseGroup(Entity):
 		@return: a list of L{Release} objects
 		@see: L{Release}
 		"""
+		if self._releases is None:
+			self._releases = [ ]
 		return self._releases
 
 	releases = property(getReleases,
@@ -1463,7 +1555,7 @@ class ReleaseGroup(Entity):
 
 		@param release: a L{Release} object
 		"""
-		self._releases.append(release)
+		self.getReleases().append(release)
 
 	def getReleasesOffset(self):
 		"""Returns the offset of the release list.
@@ -1561,6 +1653,11 @@ class Track(Entity):
 
 	@see: L{Release}, L{Artist}
 	"""
+
+	__slots__ = (
+		'_title', '_artist', '_duration', '_puids', '_releases', '_isrcs',
+	)
+
 	def __init__(self, id_=None, title=None):
 		"""Constructor.
 
@@ -1571,9 +1668,9 @@ class Track(Entity):
 		self._title = title
 		self._artist = None
 		self._duration = None
-		self._puids = [ ]
-		self._releases = [ ]
-		self._isrcs = [ ]
+		self._puids = None
+		self._releases = None
+		self._isrcs = None
 
 	def getTitle(self):
 		"""Returns the track's title.
@@ -1656,6 +1753,8 @@ class Track(Entity):
 
 		@return: a list of strings, each containing one PUID
 		"""
+		if self._puids is None:
+			self._puids = [ ]
 		return self._puids
 
 	puids = property(getPuids, doc='The list of associated PUIDs.')
@@ -1665,13 +1764,15 @@ class Track(Entity):
 
 		@param puid: a string containing a PUID
 		"""
-		self._puids.append(puid)
+		self.getPuids().append(puid)
 	
 	def getISRCs(self):
 		"""Returns the ISRCs associated with this track.
 
 		@return: a list of strings, each containing one ISRC
 		"""
+		if self._isrcs is None:
+			self._isrcs = [ ]
 		return self._isrcs
 
 	isrcs = property(getISRCs, doc='The list of associated ISRCs')
@@ -1681,13 +1782,15 @@ class Track(Entity):
 
 		@param isrc: a string containing an ISRC
 		"""
-		self._isrcs.append(isrc)
+		self.getISRCs().append(isrc)
 
 	def getReleases(self):
 		"""Returns the list of releases this track appears on.
 
 		@return: a list of L{Release} objects
 		"""
+		if self._releases is None:
+			self._releases = [ ]
 		return self._releases
 
 	releases = property(getReleases,
@@ -1698,10 +1801,10 @@ class Track(Entity):
 
 		@param release: a L{Release} object
 		"""
-		self._releases.append(release)
+		self.getReleases().append(release)
 
 
-class Relation(object):
+class Relation(_Slotted):
 	"""Represents a relation between two Entities.
 
 	There may be an arbitrary number of relations between all first
@@ -1738,6 +1841,11 @@ class Relation(object):
 	DIR_BACKWARD = 'backward'
 	DIR_NONE = 'none'
 
+	__slots__ = (
+		'_relationType', '_targetType', '_targetId', '_direction',
+		'_beginDate', '_endDate', '_target', '_attributes',
+	)
+
 	def __init__(self, relationType=None, targetType=None, targetId=None,
 			direction=DIR_NONE, attributes=None,
 			beginDate=None, endDate=None, target=None):
@@ -1946,7 +2054,7 @@ class Relation(object):
 		doc="The relation's target object.")
 
 
-class ReleaseEvent(object):
+class ReleaseEvent(_Slotted):
 	"""A release event, indicating where and when a release took place.
 
 	All country codes used must be valid ISO-3166 country codes (i.e. 'DE',
@@ -1972,6 +2080,11 @@ class ReleaseEvent(object):
 	FORMAT_PIANO_ROLL = NS_MMD_1 + 'PianoRoll'
 	FORMAT_OTHER = NS_MMD_1 + 'Other'
 
+	__slots__ = (
+		'_countryId', '_dateStr', '_catalogNumber', '_barcode', '_label',
+		'_format',
+	)
+
 	def __init__(self, country=None, dateStr=None):
 		"""Constructor.
 
@@ -2092,9 +2205,13 @@ class ReleaseEvent(object):
 		doc='The format of the release medium.')
 
 
-class CDStub(object):
+class CDStub(_Slotted):
 	"""Represents a CD Stub"""
 
+	__slots__ = (
+		'_disc', '_tracks', '_title', '_artist', '_barcode', '_comment',
+	)
+
 	def __init__(self, disc):
 		"""Constructor.
 
@@ -2195,7 +2312,7 @@ class CDStub(object):
 
 	tracks = property(getTracks, doc='The tracks of the release.')
 
-class Disc(object):
+class Disc(_Slotted):
 	"""Represents an Audio CD.
 
 	This class represents an Audio CD. A disc can have an ID (the
@@ -2215,6 +2332,11 @@ class Disc(object):
 	L{musicbrainz2.disc.readDisc}, however, can retrieve the other
 	attributes of L{Disc} from an Audio CD in the disc drive.
 	"""
+
+	__slots__ = (
+		'_id', '_sectors', '_firstTrackNum', '_lastTrackNum', '_tracks',
+	)
+
 	def __init__(self, id_=None):
 		"""Constructor.
 
@@ -2224,7 +2346,7 @@ class Disc(object):
 		self._sectors = None
 		self._firstTrackNum = None
 		self._lastTrackNum = None
-		self._tracks = [ ]
+		self._tracks = None
 
 	def getId(self):
 		"""Returns the MusicBrainz DiscID.
@@ -2304,6 +2426,8 @@ class Disc(object):
 
 		@return: a list of (offset, length) tuples (values are ints)
 		"""
+		if self._tracks is None:
+			self._tracks = [ ]
 		return self._tracks
 
 	tracks = property(getTracks,
@@ -2320,11 +2444,14 @@ class Disc(object):
 
 		@see: L{getTracks}
 		"""
-		self._tracks.append(track)
+		self.getTracks().append(track)
 
 
-class AbstractAlias(object):
+class AbstractAlias(_Slotted):
 	"""An abstract super class for all alias classes."""
+
+	__slots__ = ('_value', '_type', '_script')
+
 	def __init__(self, value=None, type_=None, script=None):
 		"""Constructor.
 
@@ -2396,7 +2523,7 @@ class ArtistAlias(AbstractAlias):
 	indicates which script is used for the alias value. To represent the
 	script, ISO-15924 script codes like 'Latn', 'Cyrl', or 'Hebr' are used.
 	"""
-	pass
+	__slots__ = ( )
 
 
 class LabelAlias(AbstractAlias):
@@ -2410,12 +2537,14 @@ class LabelAlias(AbstractAlias):
 	indicates which script is used for the alias value. To represent the
 	script, ISO-15924 script codes like 'Latn', 'Cyrl', or 'Hebr' are used.
 	"""
-	pass
+	__slots__ = ( )
 
 
-class User(object):
+class User(_Slotted):
 	"""Represents a MusicBrainz user."""
 
+	__slots__ = ('_name', '_types', '_showNag')
+
 	def __init__(self):
 		"""Constructor."""
 		self._name = None
@@ -0,0 +1,365 @@
+"""Recording and replaying web service responses.
+
+This module helps to test and benchmark code using the web service
+without access to a MusicBrainz server. A L{RecordingWebService} wraps
+another L{IWebService <musicbrainz2.webservice.IWebService>} and writes
+all responses to a directory:
+
+>>> import musicbrainz2.webservice as ws
+>>> from musicbrainz2.replay import RecordingWebService
+>>> q = ws.Query(RecordingWebService(ws.WebService(), 'recorded'))
+>>> artist = q.getArtistById('c0b2500e-0cef-4130-869d-732b23ed9df5')
+>>>
+
+Later, a L{ReplayWebService} returns the recorded responses, without
+network access. To test the complete stack including HTTP, a
+L{StandInServer} serves the recorded responses on a local port, adding
+configurable latency and errors:
+
+>>> from musicbrainz2.replay import StandInServer
+>>> server = StandInServer('recorded', latency=0.05, errorRate=0.1)
+>>> server.start()
+>>> q = ws.Query(ws.WebService(host='127.0.0.1', port=server.port))
+>>> artist = q.getArtistById('c0b2500e-0cef-4130-869d-732b23ed9df5')
+>>> server.stop()
+>>>
+
+The server can also be started from the command line::
+
+	python -m musicbrainz2.replay recorded 8080
+"""
+__revision__ = '$Id$'
+
+import os
+import sys
+import time
+import zlib
+import random
+import urllib
+import StringIO
+import threading
+import urlparse
+import SocketServer
+import BaseHTTPServer
+from musicbrainz2.webservice import IWebService, ResourceNotFoundError
+
+try:
+	from hashlib import md5
+except ImportError:
+	from md5 import new as md5
+
+try:
+	from urlparse import parse_qsl
+except ImportError:
+	from cgi import parse_qsl
+
+__all__ = [ 'RecordingWebService', 'ReplayWebService', 'StandInServer' ]
+
+
+class RecordingWebService(IWebService):
+	"""An L{IWebService} saving all responses to a directory.
+
+	Requests are passed to another L{IWebService}. The body of each
+	successful GET response is written to a file in C{directory},
+	which is created if necessary. POST requests aren't recorded.
+	"""
+
+	def __init__(self, ws, directory):
+		"""Constructor.
+
+		@param ws: the L{IWebService} object to record
+		@param directory: a string containing a directory name
+		"""
+		self._ws = ws
+		self._directory = directory
+
+	def get(self, entity, id_, include=( ), filter={ }, version='1'):
+		stream = self._ws.get(entity, id_, include, filter, version)
+		try:
+			body = stream.read()
+		finally:
+			stream.close()
+
+		path = _makePath(self._directory, entity, id_, include, filter,
+			version)
+		if not os.path.isdir(os.path.dirname(path)):
+			os.makedirs(os.path.dirname(path))
+
+		# write to a temporary file first, so readers never see
+		# partial files
+		tmpPath = '%s.%d.tmp' % (path, os.getpid())
+		f = open(tmpPath, 'wb')
+		try:
+			f.write(body)
+		finally:
+			f.close()
+		if os.path.exists(path):
+			os.remove(path) # required on windows
+		os.rename(tmpPath, path)
+
+		return StringIO.StringIO(body)
+
+	def post(self, entity, id_, data, version='1'):
+		return self._ws.post(entity, id_, data, version)
+
+
+class ReplayWebService(IWebService):
+	"""An L{IWebService} returning responses from a directory.
+
+	Responses have to be recorded using a L{RecordingWebService}
+	first. Requests for which no response has been recorded fail with
+	a L{ResourceNotFoundError
+	<musicbrainz2.webservice.ResourceNotFoundError>}. POST requests
+	are accepted, but ignored.
+	"""
+
+	def __init__(self, directory):
+		"""Constructor.
+
+		@param directory: a string containing a directory name
+		"""
+		self._directory = directory
+
+	def get(self, entity, id_, include=( ), filter={ }, version='1'):
+		path = _makePath(self._directory, entity, id_, include, filter,
+			version)
+		try:
+			f = open(path, 'rb')
+		except IOError, e:
+			raise ResourceNotFoundError('not recorded: ' + path, e)
+
+		try:
+			return StringIO.StringIO(f.read())
+		finally:
+			f.close()
+
+	def post(self, entity, id_, data, version='1'):
+		return StringIO.StringIO('')
+
+
+class StandInServer(object):
+	"""A local HTTP server serving recorded responses.
+
+	The server answers requests like a MusicBrainz server, using the
+	responses recorded in C{directory} by a L{RecordingWebService}.
+	Unknown resources result in 404 errors, POST requests are accepted
+	and ignored.
+
+	Each response is delayed by C{latency} seconds. A fraction of the
+	requests, as given by C{errorRate}, fails with C{errorCode}. The
+	random choices are reproducible if a C{seed} is given.
+
+	If C{compression} is True, responses are compressed using gzip or
+	deflate if the client accepts it, like the MusicBrainz server does.
+
+	The server uses one thread per connection and supports persistent
+	connections.
+	"""
+
+	def __init__(self, directory, host='127.0.0.1', port=0, latency=0.0,
+			errorRate=0.0, errorCode=503, seed=None, compression=False):
+		"""Constructor.
+
+		@param directory: a string containing a directory name
+		@param host: a string containing the address to listen on
+		@param port: an integer containing the port, or 0 to pick a
+			free one
+		@param latency: the number of seconds to delay each response
+		@param errorRate: the fraction of requests to fail, from 0 to 1
+		@param errorCode: an integer containing the HTTP status code
+			of failed requests
+		@param seed: a seed for the random number generator, or None
+		@param compression: a boolean, True to compress responses
+		"""
+		self._directory = directory
+		self._compression = compression
+		self._latency = latency
+		self._errorRate = errorRate
+		self._errorCode = errorCode
+		self._random = random.Random(seed)
+		self._lock = threading.Lock()
+		self._requestCount = 0
+		self._errorCount = 0
+		self._thread = None
+
+		self._server = _HTTPServer( (host, port), _RequestHandler)
+		self._server.standIn = self
+
+	def getPort(self):
+		"""Returns the port the server listens on.
+
+		@return: an integer
+		"""
+		return self._server.server_address[1]
+
+	port = property(getPort, doc='The port the server listens on.')
+
+	def getRequestCount(self):
+		"""Returns the number of requests received.
+
+		@return: an integer
+		"""
+		return self._requestCount
+
+	requestCount = property(getRequestCount,
+		doc='The number of requests received.')
+
+	def getErrorCount(self):
+		"""Returns the number of injected errors.
+
+		@return: an integer
+		"""
+		return self._errorCount
+
+	errorCount = property(getErrorCount,
+		doc='The number of injected errors.')
+
+	def start(self):
+		"""Starts serving requests in a background thread."""
+		assert self._thread is None, 'server is running already'
+		self._thread = threading.Thread(target=self._server.serve_forever)
+		self._thread.setDaemon(True)
+		self._thread.start()
+
+	def serveForever(self):
+		"""Serves requests in the calling thread until interrupted."""
+		self._server.serve_forever()
+
+	def stop(self):
+		"""Stops the server and closes its socket."""
+		if self._thread is not None:
+			self._server.shutdown()
+			self._thread = None
+		self._server.server_close()
+
+	def _handle(self, path, isPost):
+		"""Returns a tuple (status, body) for a request."""
+		self._lock.acquire()
+		try:
+			self._requestCount += 1
+			failed = self._random.random() < self._errorRate
+			if failed:
+				self._errorCount += 1
+		finally:
+			self._lock.release()
+
+		if self._latency > 0:
+			time.sleep(self._latency)
+
+		if failed:
+			return (self._errorCode, '')
+		elif isPost:
+			return (200, '')
+
+		(scheme, netloc, path, params, query, frag) = urlparse.urlparse(path)
+		parts = path.split('/')
+		if len(parts) < 4:
+			return (404, '')
+		(version, entity, id_) = parts[-3:]
+
+		filter = parse_qsl(query, True)
+		include = [ ]
+		for (name, value) in filter:
+			if name == 'inc':
+				include = value.split()
+		filter = [p for p in filter if p[0] not in ('inc', 'type')]
+
+		path = _makePath(self._directory, entity, id_, include, filter,
+			version)
+		try:
+			f = open(path, 'rb')
+		except IOError:
+			return (404, '')
+		try:
+			return (200, f.read())
+		finally:
+			f.close()
+
+
+class _HTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	daemon_threads = True
+	allow_reuse_address = True
+
+	def handle_error(self, request, clientAddress):
+		pass # clients drop idle connections
+
+
+class _RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+	# headers and body are written separately; without this, delayed
+	# ACKs add about 40ms to each response on a persistent connection
+	disable_nagle_algorithm = True
+
+	def do_GET(self):
+		(status, body) = self.server.standIn._handle(self.path, False)
+		self._respond(status, body)
+
+	def do_POST(self):
+		self.rfile.read(int(self.headers.get('Content-Length', 0)))
+		(status, body) = self.server.standIn._handle(self.path, True)
+		self._respond(status, body)
+
+	def _respond(self, status, body):
+		self.send_response(status)
+		if status == 200:
+			self.send_header('Content-Type', 'text/xml; charset=utf-8')
+			if self.server.standIn._compression:
+				body = self._compress(body)
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def _compress(self, body):
+		accepted = [ e.split(';')[0].strip().lower() for e in
+			self.headers.get('Accept-Encoding', '').split(',') ]
+
+		if 'gzip' in accepted:
+			self.send_header('Content-Encoding', 'gzip')
+			c = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+			return c.compress(body) + c.flush()
+		elif 'deflate' in accepted:
+			self.send_header('Content-Encoding', 'deflate')
+			return zlib.compress(body)
+		else:
+			return body
+
+	def log_message(self, *args):
+		pass
+
+
+def _makePath(directory, entity, id_, include, filter, version):
+	"""Returns the file name for a request.
+
+	Requests without parameters are stored as C{version/entity/id.xml}.
+	Otherwise, a hash of the sorted parameters is added to the name.
+	"""
+	include = list(include)
+	include.sort()
+	params = [ (name, str(value)) for (name, value) in dict(filter).items() ]
+	params.sort()
+
+	name = id_ or '_'
+	if len(include) > 0 or len(params) > 0:
+		key = ' '.join(include) + '?' + urllib.urlencode(params)
+		name += '-' + md5(key).hexdigest()
+
+	return os.path.join(directory, version, entity, name + '.xml')
+
+
+if __name__ == '__main__':
+	if len(sys.argv) not in (2, 3):
+		print >>sys.stderr, 'Usage: %s directory [port]' % sys.argv[0]
+		sys.exit(1)
+
+	port = 8080
+	if len(sys.argv) == 3:
+		port = int(sys.argv[2])
+
+	server = StandInServer(sys.argv[1], port=port)
+	print 'Serving %s on port %d' % (sys.argv[1], server.port)
+	try:
+		server.serveForever()
+	except KeyboardInterrupt:
+		server.stop()
+
+# EOF
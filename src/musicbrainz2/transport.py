@@ -0,0 +1,646 @@
+"""HTTP transport helpers used by the web service classes.
+
+This module contains the low-level connection handling for
+L{musicbrainz2.webservice.WebService}. Most users won't need anything
+from here, but the classes can be used to tune how the library talks
+to the server.
+
+L{ConnectionPool} keeps persistent HTTP/1.1 connections open between
+requests, so that a series of queries to the same server doesn't need
+a new TCP connection for every request. L{KeepAliveHandler} plugs the
+pool into a C{urllib2.OpenerDirector}.
+
+Request schedulers implementing L{IRequestScheduler} decide when a
+request may be sent. By default, all L{WebService
+<musicbrainz2.webservice.WebService>} objects in a process share one
+L{TokenBucketScheduler} (see L{getDefaultScheduler}) which limits the
+request rate per server, as required by the MusicBrainz server's usage
+rules.
+
+A L{RetryPolicy} decides whether a failed request is sent again.
+"""
+__revision__ = '$Id$'
+
+import time
+import errno
+import random
+import socket
+import rfc822
+import urllib
+import urllib2
+import httplib
+import threading
+from musicbrainz2.metrics import NullTracer
+
+__all__ = [
+	'ConnectionPool', 'KeepAliveHandler',
+	'IRequestScheduler', 'TokenBucketScheduler', 'NullScheduler',
+	'getDefaultScheduler', 'RetryPolicy',
+]
+
+_NULL_TRACER = NullTracer()
+
+
+class ConnectionPool(object):
+	"""A pool of persistent HTTP connections.
+
+	Idle connections are kept per server (host and port) and handed
+	out again for later requests to the same server. The pool is thread
+	safe and may be shared by several L{WebService
+	<musicbrainz2.webservice.WebService>} objects. A connection is only
+	used by one request at a time.
+
+	The C{maxConnections} parameter limits the number of idle
+	connections kept per server. Connections which have been idle for
+	more than C{idleTimeout} seconds are closed instead of being reused
+	because the server has most probably dropped them already. After
+	C{maxRequests} requests, a connection is closed and replaced by a
+	new one.
+
+	Setting C{maxConnections} to 0 disables connection reuse.
+	"""
+
+	def __init__(self, maxConnections=4, idleTimeout=30, maxRequests=100):
+		"""Constructor.
+
+		@param maxConnections: max. number of idle connections per server
+		@param idleTimeout: seconds after which idle connections expire
+		@param maxRequests: max. number of requests per connection
+		"""
+		self._maxConnections = maxConnections
+		self._idleTimeout = idleTimeout
+		self._maxRequests = maxRequests
+		self._idle = { }
+		self._lock = threading.Lock()
+		self._hits = 0
+		self._misses = 0
+
+	def acquire(self, host, timeout=None):
+		"""Returns a connection to the given server.
+
+		If there is a usable idle connection in the pool, it is
+		returned. Otherwise, a new (not yet connected) connection is
+		created. The connection has to be given back using L{release}
+		or L{discard} when it isn't needed anymore.
+
+		@param host: a string containing a host name and optional port
+		@param timeout: a socket timeout in seconds for new connections
+
+		@return: a tuple (C{connection}, C{reused})
+		"""
+		now = time.time()
+		expired = [ ]
+
+		self._lock.acquire()
+		try:
+			idle = self._idle.get(host, [ ])
+			while len(idle) > 0:
+				# Most recently used connections are at the end.
+				(conn, lastUsed) = idle.pop()
+				if now - lastUsed <= self._idleTimeout:
+					self._hits += 1
+					break
+				expired.append(conn)
+			else:
+				conn = None
+				self._misses += 1
+		finally:
+			self._lock.release()
+
+		for c in expired:
+			c.close()
+
+		if conn is not None:
+			return (conn, True)
+		else:
+			return (self.connect(host, timeout), False)
+
+	def connect(self, host, timeout=None):
+		"""Creates a new connection which isn't taken from the pool.
+
+		@param host: a string containing a host name and optional port
+		@param timeout: a socket timeout in seconds, or None
+
+		@return: an C{httplib.HTTPConnection} object
+		"""
+		if timeout is None:
+			conn = _PooledConnection(host)
+		else:
+			conn = _PooledConnection(host, timeout=timeout)
+		return conn
+
+	def release(self, host, conn):
+		"""Gives a connection back to the pool.
+
+		The response of the last request has to be read completely
+		before a connection can be released.
+
+		@param host: a string containing a host name and optional port
+		@param conn: a connection obtained from L{acquire}
+		"""
+		conn.requests += 1
+		if conn.requests >= self._maxRequests:
+			conn.close()
+			return
+
+		self._lock.acquire()
+		try:
+			idle = self._idle.setdefault(host, [ ])
+			if len(idle) < self._maxConnections:
+				idle.append( (conn, time.time()) )
+				conn = None
+		finally:
+			self._lock.release()
+
+		if conn is not None:
+			conn.close()
+
+	def discard(self, conn):
+		"""Closes a connection instead of giving it back to the pool.
+
+		@param conn: a connection obtained from L{acquire}
+		"""
+		conn.close()
+
+	def closeAll(self):
+		"""Closes all idle connections."""
+		self._lock.acquire()
+		try:
+			idle = self._idle
+			self._idle = { }
+		finally:
+			self._lock.release()
+
+		for conns in idle.values():
+			for (conn, lastUsed) in conns:
+				conn.close()
+
+	def getIdleCount(self, host=None):
+		"""Returns the number of idle connections.
+
+		@param host: a string containing a host name, or None for all
+
+		@return: an integer
+		"""
+		self._lock.acquire()
+		try:
+			if host is not None:
+				return len(self._idle.get(host, [ ]))
+			return sum([len(conns) for conns in self._idle.values()])
+		finally:
+			self._lock.release()
+
+	def getHits(self):
+		"""Returns the number of requests that reused a connection.
+
+		@return: an integer
+		"""
+		return self._hits
+
+	hits = property(getHits, doc='The number of reused connections.')
+
+	def getMisses(self):
+		"""Returns the number of requests that needed a new connection.
+
+		@return: an integer
+		"""
+		return self._misses
+
+	misses = property(getMisses, doc='The number of new connections.')
+
+
+class KeepAliveHandler(urllib2.HTTPHandler):
+	"""A C{urllib2} handler which uses a L{ConnectionPool}.
+
+	This handler replaces C{urllib2.HTTPHandler} for plain HTTP URLs.
+	Responses are returned as usual. As soon as a response has been read
+	completely, its connection goes back to the pool. Responses which
+	are closed before reading them completely close their connection.
+
+	If the request has a C{span} attribute containing a L{Span
+	<musicbrainz2.metrics.Span>}, connecting and waiting for the response
+	are recorded as its C{ws.connect} and C{ws.server} children.
+	"""
+	# run before urllib2.HTTPHandler, which would open a new connection
+	handler_order = urllib2.HTTPHandler.handler_order - 100
+
+	def __init__(self, pool):
+		"""Constructor.
+
+		@param pool: a L{ConnectionPool} object
+		"""
+		urllib2.HTTPHandler.__init__(self)
+		self._pool = pool
+
+	def http_open(self, req):
+		host = req.get_host()
+		if not host:
+			raise urllib2.URLError('no host given')
+
+		headers = dict(req.unredirected_hdrs)
+		for (k, v) in req.headers.items():
+			headers.setdefault(k, v)
+		headers['Connection'] = 'keep-alive'
+		headers = dict([(k.title(), v) for (k, v) in headers.items()])
+
+		timeout = getattr(req, 'timeout', None)
+		if timeout is getattr(socket, '_GLOBAL_DEFAULT_TIMEOUT', None):
+			timeout = None
+
+		span = getattr(req, 'span', None)
+		if span is None:
+			span = _NULL_TRACER.startSpan('ws.request')
+
+		(conn, reused) = self._pool.acquire(host, timeout)
+		try:
+			response = self._sendRequest(conn, req, headers, span)
+		except (socket.error, httplib.HTTPException), e:
+			self._pool.discard(conn)
+			if not reused:
+				raise urllib2.URLError(e)
+
+			# The server has probably closed the idle connection.
+			# Try again once, using a fresh connection.
+			conn = self._pool.connect(host, timeout)
+			try:
+				response = self._sendRequest(conn, req, headers, span)
+			except (socket.error, httplib.HTTPException), e:
+				self._pool.discard(conn)
+				raise urllib2.URLError(e)
+
+		reader = _PooledResponse(self._pool, host, conn, response)
+		fp = socket._fileobject(reader, close=True)
+
+		resp = urllib.addinfourl(fp, response.msg, req.get_full_url())
+		resp.code = response.status
+		resp.msg = response.reason
+		return resp
+
+	def _sendRequest(self, conn, req, headers, span):
+		if conn.sock is None:
+			child = span.startChild('ws.connect')
+			try:
+				conn.connect()
+			except (socket.error, httplib.HTTPException), e:
+				child.finish(error=e)
+				raise
+			child.finish()
+
+		child = span.startChild('ws.server')
+		try:
+			conn.request(req.get_method(), req.get_selector(),
+				req.data, headers)
+			response = conn.getresponse()
+		except (socket.error, httplib.HTTPException), e:
+			child.finish(error=e)
+			raise
+		child.setTag('status', response.status)
+		child.finish()
+		return response
+
+
+class IRequestScheduler(object):
+	"""An interface for classes deciding when requests may be sent.
+
+	Before sending a request, the web service calls L{acquire} which
+	blocks until the request may be sent. Schedulers have to be thread
+	safe, so one scheduler can be shared by several threads and L{WebService
+	<musicbrainz2.webservice.WebService>} objects.
+	"""
+
+	def acquire(self, host):
+		"""Waits until a request to the given server may be sent.
+
+		@param host: a string containing a host name and optional port
+
+		@return: the number of seconds the caller had to wait
+		"""
+		raise NotImplementedError()
+
+	def throttled(self, host, delay=None):
+		"""Reports that the server rejected a request due to overload.
+
+		This is called if the server returned a 503 status. The
+		scheduler should send fewer requests to this server for a
+		while.
+
+		@param host: a string containing a host name and optional port
+		@param delay: seconds the server asked us to wait, or None
+		"""
+		raise NotImplementedError()
+
+
+class TokenBucketScheduler(IRequestScheduler):
+	"""A scheduler limiting the request rate per server.
+
+	For each server, a bucket holds up to C{burst} tokens and is refilled
+	with C{rate} tokens per second. Each request takes one token. If the
+	bucket is empty, callers are queued and wait until it's their turn,
+	so requests are spaced out evenly instead of being sent in bursts.
+
+	The scheduler keeps statistics on how long requests had to wait.
+	"""
+
+	def __init__(self, rate=1.0, burst=1):
+		"""Constructor.
+
+		@param rate: a float containing the number of requests per second
+		@param burst: the number of requests which may be sent at once
+		"""
+		assert rate > 0, 'rate has to be positive'
+		assert burst >= 1, 'burst has to be at least 1'
+		self._rate = float(rate)
+		self._burst = float(burst)
+		self._buckets = { }
+		self._lock = threading.Lock()
+		self._requestCount = 0
+		self._totalDelay = 0.0
+		self._maxDelay = 0.0
+
+	def acquire(self, host):
+		self._lock.acquire()
+		try:
+			tokens = self._takeToken(host, 1)
+			if tokens >= 0:
+				delay = 0.0
+			else:
+				delay = -tokens / self._rate
+
+			self._requestCount += 1
+			self._totalDelay += delay
+			self._maxDelay = max(self._maxDelay, delay)
+		finally:
+			self._lock.release()
+
+		if delay > 0:
+			time.sleep(delay)
+		return delay
+
+	def throttled(self, host, delay=None):
+		if delay is None:
+			delay = 1.0 / self._rate
+
+		self._lock.acquire()
+		try:
+			tokens = self._takeToken(host, 0)
+			self._buckets[host][0] = min(tokens, 0) - delay * self._rate
+		finally:
+			self._lock.release()
+
+	def _takeToken(self, host, count):
+		# Tokens may become negative. In this case, callers have to
+		# wait until the bucket has been refilled to zero.
+		now = time.time()
+		bucket = self._buckets.setdefault(host, [self._burst, now])
+		elapsed = max(now - bucket[1], 0)
+		tokens = min(self._burst, bucket[0] + elapsed * self._rate)
+		tokens -= count
+		bucket[0] = tokens
+		bucket[1] = now
+		return tokens
+
+	def getRequestCount(self):
+		"""Returns the number of requests scheduled so far.
+
+		@return: an integer
+		"""
+		return self._requestCount
+
+	requestCount = property(getRequestCount,
+		doc='The number of scheduled requests.')
+
+	def getTotalDelay(self):
+		"""Returns the time all requests spent waiting, in seconds.
+
+		@return: a float
+		"""
+		return self._totalDelay
+
+	totalDelay = property(getTotalDelay,
+		doc='The total queueing delay in seconds.')
+
+	def getMaxDelay(self):
+		"""Returns the longest time a request had to wait, in seconds.
+
+		@return: a float
+		"""
+		return self._maxDelay
+
+	maxDelay = property(getMaxDelay,
+		doc='The maximum queueing delay in seconds.')
+
+
+class NullScheduler(IRequestScheduler):
+	"""A scheduler which never delays requests.
+
+	Only use this for servers you run yourself.
+	"""
+
+	def acquire(self, host):
+		return 0.0
+
+	def throttled(self, host, delay=None):
+		pass
+
+
+_defaultScheduler = None
+_defaultSchedulerLock = threading.Lock()
+
+def getDefaultScheduler():
+	"""Returns the scheduler shared by all web service objects.
+
+	This is a L{TokenBucketScheduler} allowing one request per second
+	and server, which is what the MusicBrainz server permits.
+
+	@return: an L{IRequestScheduler} object
+	"""
+	global _defaultScheduler
+
+	_defaultSchedulerLock.acquire()
+	try:
+		if _defaultScheduler is None:
+			_defaultScheduler = TokenBucketScheduler()
+		return _defaultScheduler
+	finally:
+		_defaultSchedulerLock.release()
+
+
+class RetryPolicy(object):
+	"""Decides if and when a failed request is sent again.
+
+	Requests failing with a temporary server error (502, 503, 504) or
+	a network problem like a timeout are retried up to C{maxAttempts}
+	times in total. Between attempts, the delay grows exponentially,
+	starting at C{backoff} seconds and never exceeding C{maxBackoff}
+	seconds. Each delay is shortened by a random amount of up to
+	C{jitter} (a fraction between 0 and 1) to keep clients from
+	retrying in lockstep. If the server sends a C{Retry-After} header,
+	its value is used as the delay instead. Requests are not retried
+	if the server asks for a delay longer than C{maxBackoff}.
+
+	Only GET requests are idempotent. POST requests are retried if it's
+	certain that they didn't reach the server (the connection was
+	refused), unless C{retryPosts} is set. Submitting the same data twice
+	is harmless for some POST requests, but not for all.
+
+	Override L{attemptFinished} to collect timing data for every attempt.
+	"""
+	RETRY_STATUS_CODES = (502, 503, 504)
+
+	def __init__(self, maxAttempts=3, backoff=1.0, maxBackoff=30.0,
+			jitter=0.5, retryPosts=False):
+		"""Constructor.
+
+		@param maxAttempts: the max. number of attempts per request
+		@param backoff: the delay before the first retry, in seconds
+		@param maxBackoff: the max. delay between attempts, in seconds
+		@param jitter: a float between 0 and 1
+		@param retryPosts: a boolean, True to retry all POST requests
+		"""
+		assert maxAttempts >= 1, 'at least one attempt is required'
+		self._maxAttempts = maxAttempts
+		self._backoff = backoff
+		self._maxBackoff = maxBackoff
+		self._jitter = jitter
+		self._retryPosts = retryPosts
+		self._retryCount = 0
+
+	def getDelay(self, method, attempt, error):
+		"""Returns the number of seconds to wait before the next attempt.
+
+		@param method: a string containing the HTTP method
+		@param attempt: the number of the failed attempt, starting at 1
+		@param error: a C{urllib2.HTTPError} or C{urllib2.URLError}
+
+		@return: a float, or None if the request shouldn't be retried
+		"""
+		if attempt >= self._maxAttempts:
+			return None
+
+		if not self._isRetryable(method, error):
+			return None
+
+		retryAfter = getRetryAfter(error)
+		if retryAfter is not None:
+			if retryAfter > self._maxBackoff:
+				return None
+			delay = retryAfter
+		else:
+			delay = min(self._backoff * 2 ** (attempt - 1),
+				self._maxBackoff)
+			delay -= delay * self._jitter * random.random()
+
+		self._retryCount += 1
+		return delay
+
+	def attemptFinished(self, method, url, attempt, duration, error):
+		"""Called after each attempt.
+
+		This does nothing. Subclasses may override it to collect
+		timing data or statistics.
+
+		@param method: a string containing the HTTP method
+		@param url: a string containing the URL
+		@param attempt: the number of the attempt, starting at 1
+		@param duration: a float containing the attempt's duration in seconds
+		@param error: an exception if the attempt failed, or None
+		"""
+		pass
+
+	def getRetryCount(self):
+		"""Returns the number of retries so far.
+
+		@return: an integer
+		"""
+		return self._retryCount
+
+	retryCount = property(getRetryCount, doc='The number of retries.')
+
+	def _isRetryable(self, method, error):
+		if isinstance(error, urllib2.HTTPError):
+			if error.code not in self.RETRY_STATUS_CODES:
+				return False
+			return method == 'GET' or self._retryPosts
+		else:
+			if method == 'GET' or self._retryPosts:
+				return True
+			# The request hasn't been sent, so it's safe to retry.
+			reason = getattr(error, 'reason', None)
+			return isinstance(reason, socket.error) \
+				and len(reason.args) > 0 \
+				and reason.args[0] == errno.ECONNREFUSED
+
+
+def getRetryAfter(error):
+	"""Returns the delay requested by a C{Retry-After} header.
+
+	The header may contain a number of seconds or an HTTP date.
+
+	@param error: a C{urllib2.HTTPError}, or another exception
+
+	@return: a float containing seconds, or None if there's no such header
+	"""
+	if not isinstance(error, urllib2.HTTPError) or error.hdrs is None:
+		return None
+
+	value = error.hdrs.getheader('Retry-After')
+	if value is None:
+		return None
+
+	try:
+		return max(float(value), 0.0)
+	except ValueError:
+		date = rfc822.parsedate_tz(value)
+		if date is None:
+			return None
+		return max(rfc822.mktime_tz(date) - time.time(), 0.0)
+
+
+class _PooledConnection(httplib.HTTPConnection):
+	"""An HTTP connection which counts the requests it served."""
+	requests = 0
+
+
+class _PooledResponse(object):
+	"""Gives the connection back to the pool once the body has been read.
+
+	This has the C{recv()} and C{close()} methods C{socket._fileobject}
+	needs to wrap it into a file-like object.
+	"""
+
+	def __init__(self, pool, host, conn, response):
+		self._pool = pool
+		self._host = host
+		self._conn = conn
+		self._response = response
+
+	def recv(self, amt):
+		data = self._response.read(amt)
+		if self._response.isclosed():
+			self._release()
+		return data
+
+	def close(self):
+		if self._conn is None:
+			return
+
+		if self._response.isclosed():
+			self._release()
+		else:
+			conn = self._conn
+			self._conn = None
+			self._response.close()
+			self._pool.discard(conn)
+
+	def _release(self):
+		conn = self._conn
+		self._conn = None
+		if conn is None:
+			return
+
+		if self._response.will_close:
+			self._pool.discard(conn)
+		else:
+			self._pool.release(self._host, conn)
+
+# EOF
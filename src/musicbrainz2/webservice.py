@@ -14,14 +14,23 @@ model <musicbrainz2.model>}.
 """
 __revision__ = '$Id$'
 
+import time
+import zlib
 import urllib
+import StringIO
 import urllib2
 import urlparse
 import logging
+import weakref
+import threading
 import musicbrainz2
 from musicbrainz2.model import Release
-from musicbrainz2.wsxml import MbXmlParser, ParseError
+from musicbrainz2.wsxml import MbXmlParser, ParseError, DefaultFactory
 import musicbrainz2.utils as mbutils
+from musicbrainz2.workers import WorkerPool, SingleFlight
+from musicbrainz2.metrics import NullTracer
+from musicbrainz2.transport import ConnectionPool, KeepAliveHandler, \
+	RetryPolicy, getDefaultScheduler, getRetryAfter
 
 __all__ = [
 	'WebServiceError', 'AuthenticationError', 'ConnectionError',
@@ -30,7 +39,7 @@ __all__ = [
 	'LabelIncludes', 'ReleaseGroupIncludes',
 	'IFilter', 'ArtistFilter', 'ReleaseFilter', 'TrackFilter',
 	'UserFilter', 'LabelFilter', 'ReleaseGroupFilter',
-	'IWebService', 'WebService', 'Query',
+	'IWebService', 'WebService', 'Query', 'BatchResult', 'ResultPager',
 ]
 
 
@@ -188,12 +197,53 @@ class WebService(IWebService):
 
 	def __init__(self, host='musicbrainz.org', port=80, pathPrefix='/ws',
 			username=None, password=None, realm='musicbrainz.org',
-			opener=None, userAgent=None):
+			opener=None, userAgent=None, connectionPool=None,
+			scheduler=None, retryPolicy=None, responseCache=None,
+			tracer=None, compression=True, maxAge=None):
 		"""Constructor.
 
 		This can be used without parameters. In this case, the
 		MusicBrainz server will be used.
 
+		HTTP connections are kept open and reused for later requests.
+		To configure this, pass a L{ConnectionPool
+		<musicbrainz2.transport.ConnectionPool>} object. A pool may be
+		shared by several L{WebService} objects.
+
+		Requests are spaced out by a request scheduler. Unless another
+		one is given, the L{default scheduler
+		<musicbrainz2.transport.getDefaultScheduler>} is used, which is
+		shared by all L{WebService} objects in the process.
+
+		Requests failing because of temporary problems are retried
+		as specified by the C{retryPolicy}. By default, a L{RetryPolicy
+		<musicbrainz2.transport.RetryPolicy>} with its default settings
+		is used. Pass C{RetryPolicy(maxAttempts=1)} to disable retries.
+
+		If a C{responseCache} is given, the bodies of successful GET
+		requests are stored in it, keyed by URL, along with their
+		C{ETag} and C{Last-Modified} headers. Later requests for the
+		same URL, or for one with a subset of its include tags, are
+		answered from the cache. Usually, this is a
+		L{DiskCache <musicbrainz2.diskcache.DiskCache>}.
+
+		By default, cached responses are used as long as the cache keeps
+		them. If C{maxAge} is given, responses older than C{maxAge}
+		seconds are revalidated: The cached response is returned right
+		away, and a conditional request is sent in the background. If
+		the server answers with 304 (Not Modified), the cached response
+		is used for another C{maxAge} seconds, otherwise it is replaced
+		by the new one. So callers never wait for a refresh, but may
+		get an outdated response while it is being revalidated.
+
+		If a C{tracer} is given, the phases of each request are timed
+		using it (see the L{metrics <musicbrainz2.metrics>} module).
+
+		Unless C{compression} is False, the server is asked to compress
+		responses using gzip or deflate. Compressed responses are
+		decompressed while they are read, so callers always get the
+		plain XML.
+
 		@param host: a string containing a host name
 		@param port: an integer containing a port number
 		@param pathPrefix: a string prepended to all URLs
@@ -202,6 +252,20 @@ class WebService(IWebService):
 		@param realm: a string containing the realm used for authentication
 		@param opener: an C{urllib2.OpenerDirector} object used for queries
 		@param userAgent: a string containing the user agent
+		@param connectionPool: a L{ConnectionPool
+			<musicbrainz2.transport.ConnectionPool>}, or None
+		@param scheduler: an L{IRequestScheduler
+			<musicbrainz2.transport.IRequestScheduler>}, or None
+		@param retryPolicy: a L{RetryPolicy
+			<musicbrainz2.transport.RetryPolicy>}, or None
+		@param responseCache: an L{ICache <musicbrainz2.cache.ICache>}
+			for response bodies, or None
+		@param tracer: an L{ITracer <musicbrainz2.metrics.ITracer>},
+			or None
+		@param compression: a boolean, True to accept compressed
+			responses
+		@param maxAge: the number of seconds cached responses are used
+			before revalidating them, or None
 		"""
 		self._host = host
 		self._port = port
@@ -216,6 +280,41 @@ class WebService(IWebService):
 		else:
 			self._opener = opener
 
+		if connectionPool is None:
+			self._connectionPool = ConnectionPool()
+		else:
+			self._connectionPool = connectionPool
+		self._opener.add_handler(KeepAliveHandler(self._connectionPool))
+
+		if scheduler is None:
+			self._scheduler = getDefaultScheduler()
+		else:
+			self._scheduler = scheduler
+
+		if retryPolicy is None:
+			self._retryPolicy = RetryPolicy()
+		else:
+			self._retryPolicy = retryPolicy
+
+		self._responseCache = responseCache
+
+		if tracer is None:
+			self._tracer = NullTracer()
+		else:
+			self._tracer = tracer
+
+		self._compression = compression
+		self._bytesLock = threading.Lock()
+		self._bytesReceived = 0
+		self._bytesDecoded = 0
+
+		self._maxAge = maxAge
+		self._revalidationPool = None
+		self._revalidating = set()
+		self._revalidationLock = threading.Lock()
+		self._revalidations = 0
+		self._notModified = 0
+
 		if userAgent is None:
 			self._userAgent = "python-musicbrainz/" + musicbrainz2.__version__
 		else:
@@ -230,6 +329,90 @@ class WebService(IWebService):
 		self._opener.add_handler(authHandler)
 
 
+	def getConnectionPool(self):
+		"""Returns the pool used for persistent HTTP connections.
+
+		The pool's counters show how many requests reused a connection.
+
+		@return: a L{ConnectionPool <musicbrainz2.transport.ConnectionPool>}
+		"""
+		return self._connectionPool
+
+	def getScheduler(self):
+		"""Returns the scheduler deciding when requests are sent.
+
+		@return: an L{IRequestScheduler
+			<musicbrainz2.transport.IRequestScheduler>}
+		"""
+		return self._scheduler
+
+	def getResponseCache(self):
+		"""Returns the cache used for response bodies.
+
+		@return: an L{ICache <musicbrainz2.cache.ICache>}, or None
+		"""
+		return self._responseCache
+
+	def getTracer(self):
+		"""Returns the tracer timing the requests.
+
+		@return: an L{ITracer <musicbrainz2.metrics.ITracer>}
+		"""
+		return self._tracer
+
+	def getBytesReceived(self):
+		"""Returns the number of response bytes received.
+
+		This is the size of all response bodies read completely or
+		partially, as sent by the server, so compressed responses are
+		counted with their compressed size. Responses from the response
+		cache aren't counted.
+
+		@return: an integer
+		"""
+		return self._bytesReceived
+
+	bytesReceived = property(getBytesReceived,
+		doc='The number of response bytes received.')
+
+	def getBytesDecoded(self):
+		"""Returns the number of response bytes after decompression.
+
+		Compare this to L{getBytesReceived} to see how much compression
+		saves. Responses from the response cache aren't counted.
+
+		@return: an integer
+		"""
+		return self._bytesDecoded
+
+	bytesDecoded = property(getBytesDecoded,
+		doc='The number of response bytes after decompression.')
+
+	def getRevalidationCount(self):
+		"""Returns the number of revalidation requests sent.
+
+		@return: an integer
+		"""
+		return self._revalidations
+
+	revalidationCount = property(getRevalidationCount,
+		doc='The number of revalidation requests sent.')
+
+	def getNotModifiedCount(self):
+		"""Returns the number of revalidated, unchanged responses.
+
+		These are revalidations which the server answered with 304 (Not
+		Modified), so the cached response could be used again without
+		transferring it.
+
+		@return: an integer
+		"""
+		return self._notModified
+
+	notModifiedCount = property(getNotModifiedCount,
+		doc='The number of revalidated, unchanged responses.')
+
+
 	def _makeUrl(self, entity, id_, include=( ), filter={ },
 			version='1', type_='xml'):
 		params = dict(filter)
@@ -250,9 +433,19 @@ class WebService(IWebService):
 		return url
 
 
-	def _openUrl(self, url, data=None):
-		req = urllib2.Request(url)
+	def _openUrl(self, url, data, span, headers):
+		req = urllib2.Request(url, headers=headers)
 		req.add_header('User-Agent', self._userAgent)
+		if self._compression:
+			req.add_header('Accept-Encoding', 'gzip, deflate')
+		req.span = span
+
+		child = span.startChild('ws.schedule')
+		delay = self._scheduler.acquire(req.get_host())
+		child.finish()
+		if delay > 0:
+			self._log.debug('request delayed by %.3fs', delay)
+
 		return self._opener.open(req, data)
 
 
@@ -272,24 +465,40 @@ class WebService(IWebService):
 		@see: L{IWebService.get}
 		"""
 		url = self._makeUrl(entity, id_, include, filter, version)
-
-		self._log.debug('GET ' + url)
+		span = self._tracer.startSpan('ws.get', {'entity': entity,
+			'include': ' '.join(include), 'url': url})
+
+		if self._responseCache is not None:
+			cached = _unpackResponse(
+				self._responseCache.getSuperset(url))
+			if cached is not None:
+				(storedUrl, body, validators, stored) = cached
+				self._log.debug('GET %s (cached)', url)
+				span.setTag('cached', True)
+				span.setTag('bytes', len(body))
+				if self._maxAge is not None and \
+						time.time() - stored > self._maxAge:
+					# a response for more include tags may have been
+					# returned, so its own URL is revalidated
+					span.setTag('stale', True)
+					self._revalidateLater(storedUrl, entity, body,
+						validators)
+				span.finish()
+				return _CachedResponse(body, validators)
+
+		self._log.debug('GET %s', url)
+
+		span.setTag('cached', False)
+		stream = self._request('GET', url, None, span)
+		if self._responseCache is None:
+			return stream
 
 		try:
-			return self._openUrl(url)
-		except urllib2.HTTPError, e:
-			self._log.debug("GET failed: " + str(e))
-			if e.code == 400:   # in python 2.4: httplib.BAD_REQUEST
-				raise RequestError(str(e), e)
-			elif e.code == 401: # httplib.UNAUTHORIZED
-				raise AuthenticationError(str(e), e)
-			elif e.code == 404: # httplib.NOT_FOUND
-				raise ResourceNotFoundError(str(e), e)
-			else:
-				raise WebServiceError(str(e), e)
-		except urllib2.URLError, e:
-			self._log.debug("GET failed: " + str(e))
-			raise ConnectionError(str(e), e)
+			body = stream.read()
+		finally:
+			stream.close()
+		self._store(url, body, stream.validators)
+		return _CachedResponse(body, stream.validators)
 
 
 	def post(self, entity, id_, data, version='1'):
@@ -307,24 +516,152 @@ class WebService(IWebService):
 		"""
 		url = self._makeUrl(entity, id_, version=version, type_=None)
 
-		self._log.debug('POST ' + url)
-		self._log.debug('POST-BODY: ' + data)
+		if self._log.isEnabledFor(logging.DEBUG):
+			self._log.debug('POST %s', url)
+			self._log.debug('POST-BODY: %s', data)
 
+		span = self._tracer.startSpan('ws.post',
+			{'entity': entity, 'url': url})
+		return self._request('POST', url, data, span)
+
+
+	def _request(self, method, url, data, span, headers={ }):
+		"""Sends a request, retrying it if necessary.
+
+		The returned stream finishes the C{span} once it has been read
+		completely or closed. If the request fails, the span is
+		finished right away. For conditional requests, None is returned
+		if the server answers with 304 (Not Modified).
+		"""
+		attempt = 0
+		while True:
+			attempt += 1
+			span.setTag('attempts', attempt)
+			start = time.time()
+			try:
+				stream = self._openUrl(url, data, span, headers)
+				self._retryPolicy.attemptFinished(method, url,
+					attempt, time.time() - start, None)
+				span.setTag('status', getattr(stream, 'code', None))
+				return self._wrapResponse(stream, span)
+			except urllib2.URLError, e:
+				if isinstance(e, urllib2.HTTPError) and e.code == 304:
+					self._retryPolicy.attemptFinished(method, url,
+						attempt, time.time() - start, None)
+					e.close()
+					span.setTag('status', 304)
+					span.finish()
+					return None
+
+				self._retryPolicy.attemptFinished(method, url,
+					attempt, time.time() - start, e)
+				self._log.debug('%s failed: %s', method, e)
+				if isinstance(e, urllib2.HTTPError):
+					span.setTag('status', e.code)
+
+				if isinstance(e, urllib2.HTTPError) and e.code == 503:
+					self._scheduler.throttled(
+						urlparse.urlparse(url)[1],
+						getRetryAfter(e))
+
+				delay = self._retryPolicy.getDelay(method, attempt, e)
+
+				# the error body isn't needed; this frees the connection
+				if isinstance(e, urllib2.HTTPError) and e.fp is not None:
+					e.close()
+
+				if delay is None:
+					span.finish(error=e)
+					raise _makeError(e)
+
+				self._log.debug('retrying in %.3fs (attempt %d)',
+					delay, attempt + 1)
+				time.sleep(delay)
+
+
+	def _wrapResponse(self, stream, span):
+		encoding = stream.info().get('Content-Encoding', '')
+		encoding = encoding.strip().lower()
+		if encoding in ('', 'identity'):
+			encoding = None
+		elif encoding == 'x-gzip':
+			encoding = 'gzip'
+		elif encoding not in ('gzip', 'deflate'):
+			stream.close()
+			e = ResponseError('unsupported content encoding: ' + encoding)
+			span.finish(error=e)
+			raise e
+
+		validators = { }
+		for name in ('ETag', 'Last-Modified'):
+			value = stream.info().get(name)
+			if value:
+				validators[name] = value
+
+		span.setTag('encoding', encoding)
+		return _ResponseReader(stream, span, encoding, self._countBytes,
+			validators)
+
+	def _store(self, url, body, validators):
+		value = _packResponse(url, body, validators, time.time())
+		self._responseCache.put(url, value, len(value))
+
+	def _revalidateLater(self, url, entity, body, validators):
+		"""Queues a revalidation, unless one is running already."""
+		self._revalidationLock.acquire()
 		try:
-			return self._openUrl(url, data)
-		except urllib2.HTTPError, e:
-			self._log.debug("POST failed: " + str(e))
-			if e.code == 400:   # in python 2.4: httplib.BAD_REQUEST
-				raise RequestError(str(e), e)
-			elif e.code == 401: # httplib.UNAUTHORIZED
-				raise AuthenticationError(str(e), e)
-			elif e.code == 404: # httplib.NOT_FOUND
-				raise ResourceNotFoundError(str(e), e)
-			else:
-				raise WebServiceError(str(e), e)
-		except urllib2.URLError, e:
-			self._log.debug("POST failed: " + str(e))
-			raise ConnectionError(str(e), e)
+			if url in self._revalidating:
+				return
+			self._revalidating.add(url)
+			self._revalidations += 1
+			if self._revalidationPool is None:
+				self._revalidationPool = WorkerPool(2)
+		finally:
+			self._revalidationLock.release()
+
+		self._revalidationPool.submit(self._revalidate, url, entity, body,
+			validators)
+
+	def _revalidate(self, url, entity, body, validators):
+		headers = { }
+		if 'ETag' in validators:
+			headers['If-None-Match'] = validators['ETag']
+		if 'Last-Modified' in validators:
+			headers['If-Modified-Since'] = validators['Last-Modified']
+
+		self._log.debug('GET %s (revalidating)', url)
+		span = self._tracer.startSpan('ws.get', {'entity': entity,
+			'url': url, 'cached': False, 'revalidation': True})
+		try:
+			try:
+				stream = self._request('GET', url, None, span, headers)
+				if stream is None:
+					self._store(url, body, validators)
+					self._revalidationLock.acquire()
+					self._notModified += 1
+					self._revalidationLock.release()
+				else:
+					try:
+						body = stream.read()
+					finally:
+						stream.close()
+					self._store(url, body, stream.validators)
+			except ResourceNotFoundError:
+				self._responseCache.remove(url)
+			except WebServiceError, e:
+				self._log.debug('revalidating %s failed: %s', url, e)
+		finally:
+			self._revalidationLock.acquire()
+			self._revalidating.discard(url)
+			self._revalidationLock.release()
+
+	def _countBytes(self, received, decoded):
+		self._bytesLock.acquire()
+		try:
+			self._bytesReceived += received
+			self._bytesDecoded += decoded
+		finally:
+			self._bytesLock.release()
 
 
 	# Special password manager which also works with redirects by simply
@@ -769,6 +1106,187 @@ class LabelIncludes(IIncludes):
 		return _createIncludes(self._includes)
 
 
+class BatchResult(object):
+	"""The result of looking up one ID in a batch request.
+
+	A BatchResult contains the requested ID and either the entity
+	returned by the web service or the exception raised while
+	requesting it.
+
+	@see: L{Query.getArtistsByIds}, L{Query.getReleasesByIds},
+		L{Query.getTracksByIds}
+	"""
+	def __init__(self, id_, entity=None, error=None):
+		self._id = id_
+		self._entity = entity
+		self._error = error
+
+	def getId(self):
+		"""Returns the ID as passed to the batch method.
+
+		@return: a string containing an ID
+		"""
+		return self._id
+
+	id = property(getId, doc='The requested ID.')
+
+	def getEntity(self):
+		"""Returns the entity.
+
+		@return: a L{musicbrainz2.model.Entity} object, or None on errors
+		"""
+		return self._entity
+
+	entity = property(getEntity, doc='The entity, or None.')
+
+	def getError(self):
+		"""Returns the error which occurred while requesting the entity.
+
+		@return: an exception (usually a L{WebServiceError}), or None
+		"""
+		return self._error
+
+	error = property(getError, doc='The exception, or None.')
+
+
+class ResultPager(object):
+	"""Iterates over all results of a search, page by page.
+
+	The web service returns search results in pages of limited size.
+	A ResultPager requests one page after the other, using the
+	C{limit} and C{offset} parameters of the filter, until the number
+	of results reported by the server is reached. While the results
+	of one page are consumed, the next C{prefetch} pages are requested
+	in the background.
+
+	Results may shift between pages if the data on the server changes
+	while paging. Results for entities which have been returned already
+	are skipped.
+
+	Example:
+
+	>>> import musicbrainz2.webservice as ws
+	>>> q = ws.Query()
+	>>> pager = ws.ResultPager(q, ws.ReleaseFilter(artistName='Tori Amos'))
+	>>> titles = [r.release.title for r in pager]
+	>>> len(titles) == pager.count
+	True
+	>>>
+
+	Note that prefetched requests are still subject to the web service's
+	request scheduler.
+	"""
+
+	def __init__(self, query, filter, pageSize=None, prefetch=1,
+			projection=None):
+		"""Constructor.
+
+		The C{filter} has to be one of L{ArtistFilter}, L{LabelFilter},
+		L{ReleaseFilter}, L{ReleaseGroupFilter}, or L{TrackFilter}.
+		Paging starts at the filter's offset, if it has one. If no
+		C{pageSize} is given, the filter's limit is used, or 100 if
+		the filter has no limit.
+
+		@param query: a L{Query} object
+		@param filter: an L{IFilter} object
+		@param pageSize: the number of results to request at once
+		@param prefetch: the number of pages to request in advance
+		@param projection: a L{Projection <musicbrainz2.wsxml.Projection>}
+			selecting the parts of the results to read, or None
+
+		@raise ValueError: if the filter type isn't supported
+		"""
+		self._query = query
+		self._filter = filter
+		self._projection = projection
+		self._entity = None
+		for (filterClass, entity) in _PAGED_FILTERS:
+			if isinstance(filter, filterClass):
+				self._entity = entity
+				break
+		if self._entity is None:
+			raise ValueError('unsupported filter: ' + str(filter))
+
+		params = dict(filter.createParameters())
+		self._offset = int(params.get('offset') or 0)
+		if pageSize is None:
+			pageSize = int(params.get('limit') or 100)
+		self._pageSize = pageSize
+		self._prefetch = prefetch
+		self._count = None
+		self._duplicates = 0
+
+	def getCount(self):
+		"""Returns the number of results reported by the server.
+
+		@return: an integer, or None if no page has been received yet
+		"""
+		return self._count
+
+	count = property(getCount, doc='The total number of results.')
+
+	def getDuplicates(self):
+		"""Returns the number of results skipped as duplicates.
+
+		@return: an integer
+		"""
+		return self._duplicates
+
+	duplicates = property(getDuplicates,
+		doc='The number of duplicate results.')
+
+	def __iter__(self):
+		pool = WorkerPool(max(self._prefetch, 1))
+		pending = [ pool.submit(self._getPage, self._offset) ]
+		nextOffset = self._offset + self._pageSize
+		seen = set()
+		try:
+			while len(pending) > 0:
+				(results, count) = pending.pop(0).result()
+				if count is not None:
+					self._count = count
+				more = len(results) > 0 and self._count is not None
+
+				# request the next pages while this one is consumed
+				while more and len(pending) < self._prefetch and \
+						nextOffset < self._count:
+					pending.append(pool.submit(self._getPage,
+						nextOffset))
+					nextOffset += self._pageSize
+
+				for result in results:
+					key = _getResultEntity(result).getId()
+					if key in seen:
+						self._duplicates += 1
+						continue
+					seen.add(key)
+					yield result
+
+				if not more:
+					break
+				if len(pending) == 0 and nextOffset < self._count:
+					pending.append(pool.submit(self._getPage,
+						nextOffset))
+					nextOffset += self._pageSize
+		finally:
+			pool.shutdown(wait=False)
+
+	def _getPage(self, offset):
+		filter = _PagedFilter(self._filter, offset, self._pageSize)
+		md = self._query._getFromWebService(self._entity, '',
+			filter=filter, projection=self._projection)
+		if self._entity == 'artist':
+			return (md.artistResults, md.artistResultsCount)
+		elif self._entity == 'label':
+			return (md.labelResults, md.labelResultsCount)
+		elif self._entity == 'release':
+			return (md.releaseResults, md.releaseResultsCount)
+		elif self._entity == 'release-group':
+			return (md.releaseGroupResults, md.releaseGroupResultsCount)
+		else:
+			return (md.trackResults, md.trackResultsCount)
+
+
 class Query(object):
 	"""A simple interface to the MusicBrainz web service.
 
@@ -922,7 +1440,11 @@ class Query(object):
 	>>>
 	"""
 
-	def __init__(self, ws=None, wsFactory=WebService, clientId=None):
+	# The max. number of resources tracked for validator lookups.
+	_MAX_INDEX_SIZE = 10000
+
+	def __init__(self, ws=None, wsFactory=WebService, clientId=None,
+			cache=None, tracer=None, factory=None):
 		"""Constructor.
 
 		The C{ws} parameter has to be a subclass of L{IWebService}.
@@ -945,9 +1467,40 @@ class Query(object):
 		encouraged because it will set the user agent used to make requests if
 		you don't supply the C{ws} parameter.
 
+		If a C{cache} is given, parsed responses are kept in it and
+		requesting the same resource again (with the same filter)
+		returns the cached objects without contacting the server. A
+		response requested with a superset of the include tags is
+		used as well, so the returned objects may contain more data
+		than requested (see L{ICache.getSuperset
+		<musicbrainz2.cache.ICache.getSuperset>}). Note that cached
+		objects are shared, so they must not be modified. If a cached
+		response has expired but the web service returns an unchanged
+		document for it (same C{ETag} or C{Last-Modified} header), the
+		old objects are returned again and the document isn't parsed.
+
+		Identical requests made by several threads at the same time are
+		sent only once. All threads get the same result objects, so they
+		must not be modified either.
+
+		If a C{tracer} is given, lookups are timed using it, including
+		parsing and creating the result objects (see the L{metrics
+		<musicbrainz2.metrics>} module). To time the requests as well,
+		pass the same tracer to the L{WebService}.
+
+		The C{factory} creates the returned objects. Pass a L{LazyFactory
+		<musicbrainz2.wsxml.LazyFactory>} to decode large child lists
+		only when they are used.
+
 		@param ws: a subclass instance of L{IWebService}, or None
 		@param wsFactory: a callable object which creates an object
 		@param clientId: a unicode string containing the application's ID
+		@param cache: an L{ICache <musicbrainz2.cache.ICache>} object,
+			like a L{MemoryCache <musicbrainz2.cache.MemoryCache>}, or None
+		@param tracer: an L{ITracer <musicbrainz2.metrics.ITracer>},
+			or None
+		@param factory: a L{DefaultFactory
+			<musicbrainz2.wsxml.DefaultFactory>} object, or None
 		"""
 		if ws is None:
 			self._ws = wsFactory(userAgent=clientId)
@@ -955,9 +1508,36 @@ class Query(object):
 			self._ws = ws
 
 		self._clientId = clientId
+		self._cache = cache
+
+		if factory is None:
+			self._factory = DefaultFactory()
+		else:
+			self._factory = factory
+
+		if tracer is None:
+			self._tracer = NullTracer()
+		else:
+			self._tracer = tracer
+
+		# Maps cache keys to (validator, weak reference to result).
+		self._validated = { }
+		self._validatedLock = threading.Lock()
+
+		self._singleFlight = SingleFlight()
 		self._log = logging.getLogger(str(self.__class__))
 
 
+	def getCoalescedCount(self):
+		"""Returns the number of coalesced requests.
+
+		This is the number of lookups which didn't send a request but
+		waited for an identical request made by another thread.
+
+		@return: an integer
+		"""
+		return self._singleFlight.getCoalesced()
+
 	def getArtistById(self, id_, include=None):
 		"""Returns an artist.
 
@@ -984,10 +1564,12 @@ class Query(object):
 			raise ResponseError("server didn't return artist")
 
 
-	def getArtists(self, filter):
+	def getArtists(self, filter, projection=None):
 		"""Returns artists matching given criteria.
 
 		@param filter: an L{ArtistFilter} object
+		@param projection: a L{Projection <musicbrainz2.wsxml.Projection>}
+			selecting the parts of the results to read, or None
 
 		@return: a list of L{musicbrainz2.wsxml.ArtistResult} objects
 
@@ -995,9 +1577,34 @@ class Query(object):
 		@raise RequestError: invalid ID or include tags
 		@raise ResponseError: server returned invalid data
 		"""
-		result = self._getFromWebService('artist', '', filter=filter)
+		result = self._getFromWebService('artist', '', filter=filter,
+			projection=projection)
 		return result.getArtistResults()
 
+	def iterArtists(self, filter, projection=None):
+		"""Returns artists matching given criteria, one at a time.
+
+		This works like L{getArtists}, but returns an iterator which parses
+		the results while the response is still being read. Each result
+		is available as soon as it has been received and isn't kept in
+		memory afterwards. The request is sent immediately. Responses
+		aren't cached. If you stop before reading all results, call the
+		iterator's C{close()} method to release the connection right
+		away; otherwise, this happens when it's garbage collected.
+
+		@param filter: an L{ArtistFilter} object
+		@param projection: a L{Projection <musicbrainz2.wsxml.Projection>}
+			selecting the parts of the results to read, or None
+
+		@return: an iterator yielding
+			L{musicbrainz2.wsxml.ArtistResult} objects
+
+		@raise ConnectionError: couldn't connect to server
+		@raise RequestError: invalid ID or include tags
+		@raise ResponseError: server returned invalid data
+		"""
+		return self._iterFromWebService('artist', filter, projection)
+
 	def getLabelById(self, id_, include=None):
 		"""Returns a L{model.Label}
 		
@@ -1019,8 +1626,9 @@ class Query(object):
 		else:
 			raise ResponseError("server didn't return a label")
 	
-	def getLabels(self, filter):
-		result = self._getFromWebService('label', '', filter=filter)
+	def getLabels(self, filter, projection=None):
+		result = self._getFromWebService('label', '', filter=filter,
+			projection=projection)
 		return result.getLabelResults()
 
 	def getReleaseById(self, id_, include=None):
@@ -1049,10 +1657,12 @@ class Query(object):
 			raise ResponseError("server didn't return release")
 
 
-	def getReleases(self, filter):
+	def getReleases(self, filter, projection=None):
 		"""Returns releases matching given criteria.
 
 		@param filter: a L{ReleaseFilter} object
+		@param projection: a L{Projection <musicbrainz2.wsxml.Projection>}
+			selecting the parts of the results to read, or None
 
 		@return: a list of L{musicbrainz2.wsxml.ReleaseResult} objects
 
@@ -1060,8 +1670,33 @@ class Query(object):
 		@raise RequestError: invalid ID or include tags
 		@raise ResponseError: server returned invalid data
 		"""
-		result = self._getFromWebService('release', '', filter=filter)
+		result = self._getFromWebService('release', '', filter=filter,
+			projection=projection)
 		return result.getReleaseResults()
+
+	def iterReleases(self, filter, projection=None):
+		"""Returns releases matching given criteria, one at a time.
+
+		This works like L{getReleases}, but returns an iterator which parses
+		the results while the response is still being read. Each result
+		is available as soon as it has been received and isn't kept in
+		memory afterwards. The request is sent immediately. Responses
+		aren't cached. If you stop before reading all results, call the
+		iterator's C{close()} method to release the connection right
+		away; otherwise, this happens when it's garbage collected.
+
+		@param filter: a L{ReleaseFilter} object
+		@param projection: a L{Projection <musicbrainz2.wsxml.Projection>}
+			selecting the parts of the results to read, or None
+
+		@return: an iterator yielding
+			L{musicbrainz2.wsxml.ReleaseResult} objects
+
+		@raise ConnectionError: couldn't connect to server
+		@raise RequestError: invalid ID or include tags
+		@raise ResponseError: server returned invalid data
+		"""
+		return self._iterFromWebService('release', filter, projection)
 	
 	def getReleaseGroupById(self, id_, include=None):
 		"""Returns a release group.
@@ -1088,10 +1723,12 @@ class Query(object):
 		else:
 			raise ResponseError("server didn't return releaseGroup")
 
-	def getReleaseGroups(self, filter):
+	def getReleaseGroups(self, filter, projection=None):
 		"""Returns release groups matching the given criteria.
 		
 		@param filter: a L{ReleaseGroupFilter} object
+		@param projection: a L{Projection <musicbrainz2.wsxml.Projection>}
+			selecting the parts of the results to read, or None
 		
 		@return: a list of L{musicbrainz2.wsxml.ReleaseGroupResult} objects
 		
@@ -1099,7 +1736,8 @@ class Query(object):
 		@raise RequestError: invalid ID or include tags
 		@raise ResponseError: server returned invalid data
 		"""
-		result = self._getFromWebService('release-group', '', filter=filter)
+		result = self._getFromWebService('release-group', '', filter=filter,
+			projection=projection)
 		return result.getReleaseGroupResults()
 
 	def getTrackById(self, id_, include=None):
@@ -1128,10 +1766,12 @@ class Query(object):
 			raise ResponseError("server didn't return track")
 
 
-	def getTracks(self, filter):
+	def getTracks(self, filter, projection=None):
 		"""Returns tracks matching given criteria.
 
 		@param filter: a L{TrackFilter} object
+		@param projection: a L{Projection <musicbrainz2.wsxml.Projection>}
+			selecting the parts of the results to read, or None
 
 		@return: a list of L{musicbrainz2.wsxml.TrackResult} objects
 
@@ -1139,9 +1779,34 @@ class Query(object):
 		@raise RequestError: invalid ID or include tags
 		@raise ResponseError: server returned invalid data
 		"""
-		result = self._getFromWebService('track', '', filter=filter)
+		result = self._getFromWebService('track', '', filter=filter,
+			projection=projection)
 		return result.getTrackResults()
 
+	def iterTracks(self, filter, projection=None):
+		"""Returns tracks matching given criteria, one at a time.
+
+		This works like L{getTracks}, but returns an iterator which parses
+		the results while the response is still being read. Each result
+		is available as soon as it has been received and isn't kept in
+		memory afterwards. The request is sent immediately. Responses
+		aren't cached. If you stop before reading all results, call the
+		iterator's C{close()} method to release the connection right
+		away; otherwise, this happens when it's garbage collected.
+
+		@param filter: a L{TrackFilter} object
+		@param projection: a L{Projection <musicbrainz2.wsxml.Projection>}
+			selecting the parts of the results to read, or None
+
+		@return: an iterator yielding
+			L{musicbrainz2.wsxml.TrackResult} objects
+
+		@raise ConnectionError: couldn't connect to server
+		@raise RequestError: invalid ID or include tags
+		@raise ResponseError: server returned invalid data
+		"""
+		return self._iterFromWebService('track', filter, projection)
+
 
 	def getUserByName(self, name):
 		"""Returns information about a MusicBrainz user.
@@ -1172,7 +1837,84 @@ class Query(object):
 			raise ResponseError("response didn't contain user data")
 
 
-	def _getFromWebService(self, entity, id_, include=None, filter=None):
+	def getArtistsByIds(self, ids, include=None, maxWorkers=4):
+		"""Returns several artists, requesting them concurrently.
+
+		This works like calling L{getArtistById} for each ID, but up
+		to C{maxWorkers} requests are run at the same time. Requests
+		are still subject to the web service's request scheduler, so
+		this doesn't exceed the server's rate limit.
+
+		Each ID is requested only once, even if it is given several
+		times (both as an absolute URI and as a UUID, for example).
+		Errors don't abort the whole batch. Instead, the returned
+		L{BatchResult} objects contain an exception for each ID
+		which couldn't be requested.
+
+		@param ids: an iterable containing artist IDs
+		@param include: an L{ArtistIncludes} object, or None
+		@param maxWorkers: the max. number of concurrent requests
+
+		@return: a list of L{BatchResult} objects, in the order of C{ids}
+		"""
+		return self._getBatch('artist', self.getArtistById, ids,
+			include, maxWorkers)
+
+	def getReleasesByIds(self, ids, include=None, maxWorkers=4):
+		"""Returns several releases, requesting them concurrently.
+
+		@param ids: an iterable containing release IDs
+		@param include: a L{ReleaseIncludes} object, or None
+		@param maxWorkers: the max. number of concurrent requests
+
+		@return: a list of L{BatchResult} objects, in the order of C{ids}
+
+		@see: L{getArtistsByIds}
+		"""
+		return self._getBatch('release', self.getReleaseById, ids,
+			include, maxWorkers)
+
+	def getTracksByIds(self, ids, include=None, maxWorkers=4):
+		"""Returns several tracks, requesting them concurrently.
+
+		@param ids: an iterable containing track IDs
+		@param include: a L{TrackIncludes} object, or None
+		@param maxWorkers: the max. number of concurrent requests
+
+		@return: a list of L{BatchResult} objects, in the order of C{ids}
+
+		@see: L{getArtistsByIds}
+		"""
+		return self._getBatch('track', self.getTrackById, ids,
+			include, maxWorkers)
+
+	def _getBatch(self, entity, getter, ids, include, maxWorkers):
+		ids = list(ids)
+		futures = { }
+		pool = WorkerPool(maxWorkers)
+		try:
+			for id_ in ids:
+				key = _makeBatchKey(id_, entity)
+				if key not in futures:
+					futures[key] = pool.submit(getter, id_, include)
+
+			results = [ ]
+			for id_ in ids:
+				future = futures[_makeBatchKey(id_, entity)]
+				error = future.exception()
+				if error is None:
+					results.append(BatchResult(id_,
+						future.result()))
+				else:
+					results.append(BatchResult(id_, error=error))
+		finally:
+			pool.shutdown(wait=False)
+
+		return results
+
+
+	def _getFromWebService(self, entity, id_, include=None, filter=None,
+			projection=None):
 		if filter is None:
 			filterParams = [ ]
 		else:
@@ -1183,13 +1925,100 @@ class Query(object):
 		else:
 			includeParams = include.createIncludeTags()
 
+		key = _makeCacheKey(entity, id_, includeParams, filterParams)
+		span = self._tracer.startSpan('query',
+			{'entity': entity, 'include': ' '.join(includeParams)})
+
+		# partial results from projections aren't cached
+		previous = None
+		if self._cache is not None and projection is None:
+			# keep the result alive even if the cache drops it now
+			previous = self._getValidated(key)
+			result = self._cache.getSuperset(key)
+			if result is not None:
+				span.setTag('source', 'cache')
+				span.finish()
+				return result
+
+		# _fetch() changes this unless we wait for another thread
+		span.setTag('source', 'coalesced')
+		try:
+			result = self._singleFlight.do( (key, projection), self._fetch,
+				key, entity, id_, includeParams, filterParams, span,
+				previous, projection)
+		except Exception, e:
+			span.finish(error=e)
+			raise
+		span.finish()
+		return result
+
+	def _fetch(self, key, entity, id_, includeParams, filterParams, span,
+			previous=None, projection=None):
+		span.setTag('source', 'server')
 		stream = self._ws.get(entity, id_, includeParams, filterParams)
+		validator = getattr(stream, 'validator', None)
+
+		if previous is not None and validator == previous[0]:
+			try:
+				size = len(stream.read())
+			finally:
+				stream.close()
+			span.setTag('source', 'unchanged')
+			self._cache.put(key, previous[1], size)
+			return previous[1]
+
 		try:
-			parser = MbXmlParser()
-			return parser.parse(stream)
+			parser = MbXmlParser(self._factory, projection=projection)
+			if self._cache is None or projection is not None:
+				return parser.parse(stream, span)
+
+			counter = _CountingReader(stream)
+			result = parser.parse(counter, span)
+			self._cache.put(key, result, counter.count)
+			if validator is not None:
+				self._putValidated(key, validator, result)
+			return result
+		except ParseError, e:
+			raise ResponseError(str(e), e)
+
+	def _iterFromWebService(self, entity, filter, projection=None):
+		stream = self._ws.get(entity, '', [ ], filter.createParameters())
+		return _ResultIterator(stream,
+			self._iterResults(stream, projection))
+
+	def _iterResults(self, stream, projection=None):
+		parser = MbXmlParser(self._factory, projection=projection)
+		try:
+			for result in parser.iterResults(stream):
+				yield result
 		except ParseError, e:
 			raise ResponseError(str(e), e)
 
+	def _getValidated(self, key):
+		"""Returns a tuple (validator, result) for a key, or None."""
+		self._validatedLock.acquire()
+		try:
+			entry = self._validated.get(key)
+		finally:
+			self._validatedLock.release()
+
+		if entry is None:
+			return None
+		result = entry[1]()
+		if result is None:
+			return None
+		return (entry[0], result)
+
+	def _putValidated(self, key, validator, result):
+		"""Remembers the validator of the response a result came from."""
+		self._validatedLock.acquire()
+		try:
+			if len(self._validated) >= self._MAX_INDEX_SIZE:
+				self._validated.clear()
+			self._validated[key] = (validator, weakref.ref(result))
+		finally:
+			self._validatedLock.release()
+
 
 	def submitPuids(self, tracks2puids):
 		"""Submit track to PUID mappings.
@@ -1249,6 +2078,146 @@ class Query(object):
 
 		self._ws.post('track', '', encodedStr)
 
+	def submitPuidsInBulk(self, tracks2puids, chunkSize=500,
+			maxWorkers=2, maxAttempts=3, retryPolicy=None):
+		"""Submit a large number of track to PUID mappings.
+
+		This works like L{submitPuids}, but the mappings are split into
+		chunks of at most C{chunkSize} mappings, which are submitted
+		using up to C{maxWorkers} concurrent requests. Submitting the
+		same mapping twice has no effect, so chunks failing because of
+		temporary problems are submitted again, up to C{maxAttempts}
+		times in total. Between attempts, the delay requested by the
+		server's C{Retry-After} header or an exponential backoff is
+		taken, as decided by C{retryPolicy}. Note that a L{WebService}
+		may retry each of these attempts as well, as specified by its own
+		retry policy (by default, it retries POST requests only if the
+		connection was refused).
+
+		If the server rejects a chunk as invalid, it is split in halves
+		until the invalid mappings are found. If both halves of a chunk
+		are rejected with the same error, the problem probably isn't
+		caused by single mappings (think of an invalid client ID), so
+		the error is reported for the whole chunk without splitting it
+		further.
+
+		Errors aren't raised. Instead, a dictionary is returned which
+		maps each track ID in C{tracks2puids} to None if the mapping
+		has been submitted, or to the exception which occurred.
+
+		@param tracks2puids: a dictionary mapping track IDs to PUIDs
+		@param chunkSize: the max. number of mappings per request
+		@param maxWorkers: the max. number of concurrent requests
+		@param maxAttempts: the max. number of attempts per chunk
+		@param retryPolicy: a L{RetryPolicy
+			<musicbrainz2.transport.RetryPolicy>}, or None to use
+			C{RetryPolicy(maxAttempts, retryPosts=True)}
+
+		@return: a dictionary mapping track IDs to exceptions or None
+		"""
+		assert self._clientId is not None, 'Please supply a client ID'
+		params = [ ('client', self._clientId.encode('utf-8')) ]
+
+		return self._submitInBulk('puid', tracks2puids, params,
+			chunkSize, maxWorkers, maxAttempts, retryPolicy)
+
+	def submitISRCsInBulk(self, tracks2isrcs, chunkSize=500,
+			maxWorkers=2, maxAttempts=3, retryPolicy=None):
+		"""Submit a large number of track to ISRC mappings.
+
+		This works like L{submitISRCs}, but submits the mappings in
+		chunks, as described in L{submitPuidsInBulk}.
+
+		@param tracks2isrcs: a dictionary mapping track IDs to ISRCs
+		@param chunkSize: the max. number of mappings per request
+		@param maxWorkers: the max. number of concurrent requests
+		@param maxAttempts: the max. number of attempts per chunk
+		@param retryPolicy: a L{RetryPolicy
+			<musicbrainz2.transport.RetryPolicy>}, or None
+
+		@return: a dictionary mapping track IDs to exceptions or None
+		"""
+		return self._submitInBulk('isrc', tracks2isrcs, [ ],
+			chunkSize, maxWorkers, maxAttempts, retryPolicy)
+
+	def _submitInBulk(self, name, mappings, params, chunkSize,
+			maxWorkers, maxAttempts, retryPolicy):
+		if retryPolicy is None:
+			retryPolicy = RetryPolicy(maxAttempts, retryPosts=True)
+
+		report = { }
+		items = [ ]
+		for (trackId, value) in mappings.iteritems():
+			try:
+				uuid = mbutils.extractUuid(trackId, 'track')
+				items.append( (trackId, (name, uuid + ' ' + value)) )
+			except ValueError, e:
+				report[trackId] = e
+
+		def submit(chunk):
+			return self._submitChunk(chunk, params, retryPolicy)
+
+		chunks = [items[i:i + chunkSize]
+			for i in range(0, len(items), chunkSize)]
+		pool = WorkerPool(maxWorkers)
+		try:
+			for future in pool.map(submit, chunks):
+				report.update(future.result())
+		finally:
+			pool.shutdown(wait=False)
+
+		return report
+
+	def _submitChunk(self, chunk, params, retryPolicy):
+		"""Submits (trackId, param) tuples, returning a report."""
+		error = self._postChunk(chunk, params, retryPolicy)
+		if isinstance(error, RequestError) and len(chunk) > 1:
+			return self._bisectChunk(chunk, params, retryPolicy)
+		return _makeSubmitReport(chunk, error)
+
+	def _bisectChunk(self, chunk, params, retryPolicy):
+		"""Finds the invalid mappings in a rejected chunk."""
+		half = len(chunk) / 2
+		halves = (chunk[:half], chunk[half:])
+		errors = [self._postChunk(part, params, retryPolicy)
+			for part in halves]
+
+		if isinstance(errors[0], RequestError) and \
+				isinstance(errors[1], RequestError) and \
+				str(errors[0]) == str(errors[1]):
+			# not caused by single mappings
+			return _makeSubmitReport(chunk, errors[1])
+
+		report = { }
+		for (part, error) in zip(halves, errors):
+			if isinstance(error, RequestError) and len(part) > 1:
+				report.update(self._bisectChunk(part, params,
+					retryPolicy))
+			else:
+				report.update(_makeSubmitReport(part, error))
+		return report
+
+	def _postChunk(self, chunk, params, retryPolicy):
+		"""Submits (trackId, param) tuples, returning an error or None."""
+		data = urllib.urlencode(params + [p for (t, p) in chunk], True)
+
+		attempt = 0
+		while True:
+			attempt += 1
+			try:
+				self._ws.post('track', '', data)
+				return None
+			except (RequestError, AuthenticationError,
+					ResourceNotFoundError), e:
+				return e
+			except WebServiceError, e:
+				self._log.debug('submitting %d mappings failed: %s',
+					len(chunk), e)
+				delay = retryPolicy.getDelay('POST', attempt, e.reason)
+				if delay is None:
+					return e
+				time.sleep(delay)
+
 	def addToUserCollection(self, releases):
 		"""Add releases to a user's collection.
 
@@ -1310,16 +2279,107 @@ class Query(object):
 		@raise ConnectionError: couldn't connect to server
 		@raise AuthenticationError: invalid user name and/or password
 		"""
+		result = self._getCollectionPage(offset, maxitems)
+		return result.getReleaseResults()
+
+	def iterUserCollection(self, pageSize=100, maxWorkers=4):
+		"""Returns all releases in a user's collection, in order.
+
+		The first page is requested immediately. It contains the size
+		of the collection, and the remaining pages are then requested
+		concurrently using up to C{maxWorkers} threads, while the
+		results are returned by a generator in collection order.
+
+		@param pageSize: the number of releases to request at once,
+			at most 100
+		@param maxWorkers: the max. number of concurrent requests
+
+		@return: a generator yielding L{musicbrainz2.wsxml.ReleaseResult}
+			objects
+
+		@raise ConnectionError: couldn't connect to server
+		@raise AuthenticationError: invalid user name and/or password
+		"""
+		first = self._getCollectionPage(0, pageSize)
+		return self._iterCollection(first, pageSize, maxWorkers)
+
+	def getUserCollectionChanges(self, snapshot, pageSize=100,
+			maxWorkers=4):
+		"""Compares a user's collection to a previous snapshot.
+
+		The C{snapshot} is a collection of release IDs, like the IDs of
+		the releases returned by an earlier call to
+		L{iterUserCollection}. Both UUIDs and absolute IDs may be used.
+		The collection is fetched as in L{iterUserCollection}, and
+		the releases added since then and the IDs of the releases
+		removed since then are returned.
+
+		To get the new snapshot, add the IDs of the added releases to
+		the old snapshot and remove the removed IDs.
+
+		@param snapshot: a list or set of release IDs
+		@param pageSize: the number of releases to request at once
+		@param maxWorkers: the max. number of concurrent requests
+
+		@return: a tuple (added, removed) containing a list of
+			L{musicbrainz2.wsxml.ReleaseResult} objects and a list of
+			release IDs taken from C{snapshot}
+
+		@raise ValueError: invalid release IDs in C{snapshot}
+		@raise ConnectionError: couldn't connect to server
+		@raise AuthenticationError: invalid user name and/or password
+		"""
+		previous = { }
+		for id_ in snapshot:
+			previous[mbutils.extractUuid(id_, 'release')] = id_
+
+		added = [ ]
+		current = set()
+		for result in self.iterUserCollection(pageSize, maxWorkers):
+			uuid = mbutils.extractUuid(result.release.id, 'release')
+			current.add(uuid)
+			if uuid not in previous:
+				added.append(result)
+
+		removed = [id_ for (uuid, id_) in previous.items()
+			if uuid not in current]
+		return (added, removed)
+
+	def _getCollectionPage(self, offset, maxitems):
 		params = { 'offset': offset, 'maxitems': maxitems }
 		
 		stream = self._ws.get('collection', '', filter=params)
 		try:
-			parser = MbXmlParser()
-			result = parser.parse(stream)
+			parser = MbXmlParser(self._factory)
+			return parser.parse(stream)
 		except ParseError, e:
 			raise ResponseError(str(e), e)
-		
-		return result.getReleaseResults()
+
+	def _iterCollection(self, first, pageSize, maxWorkers):
+		count = first.getReleaseResultsCount()
+		if count is None:
+			offsets = [ ]
+		else:
+			offsets = range(pageSize, count, pageSize)
+
+		pool = WorkerPool(maxWorkers)
+		pending = [ ]
+		page = first
+		try:
+			while True:
+				# request the next pages while this one is consumed
+				while len(offsets) > 0 and len(pending) < maxWorkers:
+					pending.append(pool.submit(self._getCollectionPage,
+						offsets.pop(0), pageSize))
+
+				for result in page.getReleaseResults():
+					yield result
+
+				if len(pending) == 0:
+					break
+				page = pending.pop(0).result()
+		finally:
+			pool.shutdown(wait=False)
 
 	def submitUserTags(self, entityUri, tags):
 		"""Submit folksonomy tags for an entity.
@@ -1378,7 +2438,7 @@ class Query(object):
 		
 		stream = self._ws.get('tag', '', filter=params)
 		try:
-			parser = MbXmlParser()
+			parser = MbXmlParser(self._factory)
 			result = parser.parse(stream)
 		except ParseError, e:
 			raise ResponseError(str(e), e)
@@ -1442,7 +2502,7 @@ class Query(object):
 		
 		stream = self._ws.get('rating', '', filter=params)
 		try:
-			parser = MbXmlParser()
+			parser = MbXmlParser(self._factory)
 			result = parser.parse(stream)
 		except ParseError, e:
 			raise ResponseError(str(e), e)
@@ -1491,6 +2551,329 @@ class Query(object):
 		encodedStr = urllib.urlencode(params)
 		self._ws.post('release', '', encodedStr)
 
+def _makeError(e):
+	"""Turns a urllib2 exception into a WebServiceError."""
+	if isinstance(e, urllib2.HTTPError):
+		if e.code == 400:   # in python 2.4: httplib.BAD_REQUEST
+			return RequestError(str(e), e)
+		elif e.code == 401: # httplib.UNAUTHORIZED
+			return AuthenticationError(str(e), e)
+		elif e.code == 404: # httplib.NOT_FOUND
+			return ResourceNotFoundError(str(e), e)
+		else:
+			return WebServiceError(str(e), e)
+	else:
+		return ConnectionError(str(e), e)
+
+class _CountingReader(object):
+	"""A file-like object counting the bytes read from another one."""
+
+	def __init__(self, stream):
+		self._stream = stream
+		self.count = 0
+
+	def read(self, size=-1):
+		data = self._stream.read(size)
+		self.count += len(data)
+		return data
+
+class _ResultIterator(object):
+	"""An iterator over results parsed from a stream.
+
+	The stream is closed once all results have been read, if reading
+	fails, or if the iterator is closed or garbage collected, even if
+	iterating hasn't started yet.
+	"""
+
+	def __init__(self, stream, results):
+		self._stream = stream
+		self._results = results
+
+	def __iter__(self):
+		return self
+
+	def next(self):
+		if self._stream is None:
+			raise StopIteration()
+		try:
+			return self._results.next()
+		except:
+			self.close()
+			raise
+
+	def close(self):
+		"""Stops reading and closes the stream."""
+		stream = self._stream
+		if stream is None:
+			return
+		self._stream = None
+		try:
+			self._results.close()
+		finally:
+			stream.close()
+
+	def __del__(self):
+		self.close()
+
+class _ResponseReader(object):
+	"""A file-like object reading a response body.
+
+	Bodies compressed using gzip or deflate are decompressed while they
+	are read. The time spent reading is recorded as a C{ws.transfer}
+	child of the request's span. Once the body has been read completely
+	or the stream is closed, both spans are finished and tagged with the
+	number of bytes received and decoded, and C{done} is called with
+	these numbers. Other attributes are taken from the wrapped stream.
+
+	The C{validators} attribute is a dictionary containing the response's
+	C{ETag} and C{Last-Modified} headers, if present. C{validator} is
+	one of them, or None (see L{_getValidator}).
+	"""
+
+	def __init__(self, stream, span, encoding=None, done=None,
+			validators={ }):
+		self._stream = stream
+		self.validators = validators
+		self.validator = _getValidator(validators)
+		self._span = span
+		self._encoding = encoding
+		self._done = done
+		self._transferSpan = None
+		self._elapsed = 0.0
+		self._received = 0
+		self._count = 0
+
+		self._buffer = ''
+		self._eof = False
+		if encoding == 'gzip':
+			self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+		elif encoding == 'deflate':
+			self._decompressor = zlib.decompressobj()
+		else:
+			self._decompressor = None
+
+	def read(self, size=-1):
+		data = self._timed(self._read, size)
+		if len(data) == 0 or size < 0:
+			self._finish()
+		return data
+
+	def readline(self, size=-1):
+		data = self._timed(self._readline, size)
+		if len(data) == 0:
+			self._finish()
+		return data
+
+	def __iter__(self):
+		return iter(self.readline, '')
+
+	def close(self):
+		self._finish()
+		self._stream.close()
+
+	def __getattr__(self, name):
+		return getattr(self._stream, name)
+
+	def _read(self, size):
+		if self._decompressor is None:
+			data = self._stream.read(size)
+			self._received += len(data)
+			return data
+
+		while not self._eof and (size < 0 or len(self._buffer) < size):
+			self._fill()
+
+		if size < 0 or size >= len(self._buffer):
+			data = self._buffer
+			self._buffer = ''
+		else:
+			data = self._buffer[:size]
+			self._buffer = self._buffer[size:]
+		return data
+
+	def _readline(self, size):
+		if self._decompressor is None:
+			data = self._stream.readline(size)
+			self._received += len(data)
+			return data
+
+		while not self._eof and '\n' not in self._buffer \
+				and (size < 0 or len(self._buffer) < size):
+			self._fill()
+
+		end = self._buffer.find('\n') + 1
+		if end == 0:
+			end = len(self._buffer)
+		if size >= 0:
+			end = min(end, size)
+		data = self._buffer[:end]
+		self._buffer = self._buffer[end:]
+		return data
+
+	def _fill(self):
+		"""Reads and decompresses the next chunk of the body."""
+		chunk = self._stream.read(_CHUNK_SIZE)
+		first = self._received == 0
+		self._received += len(chunk)
+		try:
+			if len(chunk) == 0:
+				self._buffer += self._decompressor.flush()
+				self._eof = True
+				return
+
+			try:
+				self._buffer += self._decompressor.decompress(chunk)
+			except zlib.error:
+				# Some servers send raw deflate data without the zlib
+				# header, so try that if the first chunk is invalid.
+				if self._encoding != 'deflate' or not first:
+					raise
+				self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+				self._buffer += self._decompressor.decompress(chunk)
+		except zlib.error, e:
+			raise ResponseError('invalid %s data: %s'
+				% (self._encoding, e), e)
+
+	def _timed(self, func, size):
+		if self._span is None:
+			return func(size)
+
+		if self._transferSpan is None:
+			self._transferSpan = self._span.startChild('ws.transfer')
+
+		start = time.time()
+		try:
+			data = func(size)
+		except Exception, e:
+			self._finish(e)
+			raise
+		self._elapsed += time.time() - start
+		self._count += len(data)
+		return data
+
+	def _finish(self, error=None):
+		span = self._span
+		if span is None:
+			return
+		self._span = None
+
+		for each in (self._transferSpan, span):
+			if each is not None:
+				each.setTag('bytes', self._count)
+				each.setTag('wireBytes', self._received)
+		if self._transferSpan is not None:
+			self._transferSpan.finish(error, self._elapsed)
+		span.finish(error)
+
+		if self._done is not None:
+			self._done(self._received, self._count)
+
+# The number of compressed bytes read at once.
+_CHUNK_SIZE = 8192
+
+class _CachedResponse(StringIO.StringIO):
+	"""A response body from the response cache.
+
+	The C{validators} and C{validator} attributes work like in
+	L{_ResponseReader}.
+	"""
+
+	def __init__(self, body, validators):
+		StringIO.StringIO.__init__(self, body)
+		self.validators = validators
+		self.validator = _getValidator(validators)
+
+def _getValidator(validators):
+	"""Returns a string identifying a version of a response, or None."""
+	return validators.get('ETag') or validators.get('Last-Modified')
+
+def _packResponse(url, body, validators, stored):
+	"""Returns a string containing a response for the response cache.
+
+	The time the response was stored, its URL and the validators are
+	written in front of the body, like HTTP headers.
+	"""
+	lines = [ 'X-Stored: %.3f' % stored, 'X-Url: %s' % url ]
+	for (name, value) in validators.items():
+		lines.append('%s: %s' % (name, value.replace('\n', ' ')))
+	return '\n'.join(lines) + '\n\n' + body
+
+def _unpackResponse(value):
+	"""Returns a tuple (url, body, validators, stored), or None.
+
+	None is returned if C{value} is None or wasn't created by
+	L{_packResponse}.
+	"""
+	if value is None or not value.startswith('X-Stored: '):
+		return None
+
+	try:
+		(head, body) = value.split('\n\n', 1)
+		lines = head.split('\n')
+		stored = float(lines[0].split(': ', 1)[1])
+		validators = { }
+		for line in lines[1:]:
+			(name, v) = line.split(': ', 1)
+			validators[name] = v
+		url = validators.pop('X-Url')
+	except (ValueError, KeyError):
+		return None
+	return (url, body, validators, stored)
+
+def _makeCacheKey(entity, id_, includeParams, filterParams):
+	"""Returns a key identifying a request in caches."""
+	includes = list(includeParams)
+	includes.sort()
+	filters = list(filterParams)
+	filters.sort()
+	return (entity, id_, tuple(includes), tuple(filters))
+
+# The filters supported by ResultPager and their entity types.
+_PAGED_FILTERS = (
+	(ArtistFilter, 'artist'),
+	(LabelFilter, 'label'),
+	(ReleaseFilter, 'release'),
+	(ReleaseGroupFilter, 'release-group'),
+	(TrackFilter, 'track'),
+)
+
+class _PagedFilter(IFilter):
+	"""Wraps a filter, replacing its limit and offset."""
+
+	def __init__(self, filter, offset, limit):
+		self._filter = filter
+		self._offset = offset
+		self._limit = limit
+
+	def createParameters(self):
+		params = [p for p in self._filter.createParameters()
+			if p[0] not in ('limit', 'offset')]
+		params.append( ('limit', self._limit) )
+		params.append( ('offset', self._offset) )
+		return params
+
+def _getResultEntity(result):
+	"""Returns the entity contained in a search result."""
+	for name in ('artist', 'label', 'release', 'releaseGroup', 'track'):
+		entity = getattr(result, name, None)
+		if entity is not None:
+			return entity
+	return None
+
+def _makeSubmitReport(chunk, error):
+	"""Maps the track IDs of (trackId, param) tuples to an error."""
+	report = { }
+	for (trackId, param) in chunk:
+		report[trackId] = error
+	return report
+
+def _makeBatchKey(id_, entity):
+	"""Returns a key identifying an ID in batch requests."""
+	try:
+		return mbutils.extractUuid(id_, entity)
+	except ValueError:
+		return id_ # invalid, the request will report it
+
 def _createIncludes(tagMap):
 	selected = filter(lambda x: x[1] == True, tagMap.items())
 	return map(lambda x: x[0], selected)
@@ -0,0 +1,313 @@
+"""Helpers for running web service requests in background threads.
+
+This module contains a minimal implementation of futures and a thread
+pool executing functions in the background. Other modules use them to
+run several web service requests at the same time.
+
+Example:
+
+>>> from musicbrainz2.workers import WorkerPool
+>>> pool = WorkerPool(maxWorkers=2)
+>>> future = pool.submit(pow, 2, 10)
+>>> future.result()
+1024
+>>> pool.shutdown()
+>>>
+"""
+__revision__ = '$Id$'
+
+import sys
+import Queue
+import threading
+
+__all__ = [ 'Future', 'WorkerPool', 'SingleFlight' ]
+
+
+class Future(object):
+	"""The result of a computation which may not have finished yet.
+
+	A Future is either pending or done. Once done, it contains either
+	a result or an exception. Use L{result} to wait for the computation
+	and get its result, or L{addDoneCallback} to be notified when it is
+	done.
+	"""
+
+	def __init__(self):
+		self._condition = threading.Condition()
+		self._done = False
+		self._result = None
+		self._excInfo = None
+		self._callbacks = [ ]
+
+	def done(self):
+		"""Checks if the computation has finished.
+
+		@return: True, if a result or an exception is available
+		"""
+		return self._done
+
+	def result(self, timeout=None):
+		"""Returns the result, waiting for it if necessary.
+
+		If the computation raised an exception, it is raised again.
+
+		@param timeout: max. number of seconds to wait, or None
+
+		@return: the result of the computation
+
+		@raise RuntimeError: the timeout expired
+		"""
+		self._wait(timeout)
+		if self._excInfo is not None:
+			(type_, value, tb) = self._excInfo
+			raise type_, value, tb
+		return self._result
+
+	def exception(self, timeout=None):
+		"""Returns the exception raised by the computation.
+
+		@param timeout: max. number of seconds to wait, or None
+
+		@return: an exception, or None if there was none
+
+		@raise RuntimeError: the timeout expired
+		"""
+		self._wait(timeout)
+		if self._excInfo is not None:
+			return self._excInfo[1]
+		return None
+
+	def addDoneCallback(self, callback):
+		"""Registers a function to call when the future is done.
+
+		The callback is called with the future as its only argument.
+		If the future is done already, it is called immediately.
+		Otherwise, it is called by the thread finishing the computation.
+
+		@param callback: a callable object
+		"""
+		self._condition.acquire()
+		try:
+			if not self._done:
+				self._callbacks.append(callback)
+				return
+		finally:
+			self._condition.release()
+		callback(self)
+
+	def setResult(self, result):
+		"""Marks the future as done, setting its result.
+
+		This is used by the code running the computation.
+
+		@param result: the result of the computation
+		"""
+		self._finish(result, None)
+
+	def setException(self, excInfo):
+		"""Marks the future as done, setting an exception.
+
+		This is used by the code running the computation.
+
+		@param excInfo: a tuple as returned by C{sys.exc_info()}
+		"""
+		self._finish(None, excInfo)
+
+	def _finish(self, result, excInfo):
+		self._condition.acquire()
+		try:
+			assert not self._done, 'future is done already'
+			self._result = result
+			self._excInfo = excInfo
+			self._done = True
+			callbacks = self._callbacks
+			self._callbacks = [ ]
+			self._condition.notifyAll()
+		finally:
+			self._condition.release()
+
+		for callback in callbacks:
+			callback(self)
+
+	def _wait(self, timeout):
+		self._condition.acquire()
+		try:
+			if not self._done:
+				self._condition.wait(timeout)
+			if not self._done:
+				raise RuntimeError('timeout expired')
+		finally:
+			self._condition.release()
+
+
+class WorkerPool(object):
+	"""A pool of threads executing functions in the background.
+
+	Functions passed to L{submit} are queued and executed by up to
+	C{maxWorkers} threads, which are started on demand. The threads
+	are daemon threads, so they don't keep the program from exiting.
+	"""
+
+	def __init__(self, maxWorkers=4):
+		"""Constructor.
+
+		@param maxWorkers: the max. number of threads to use
+		"""
+		assert maxWorkers >= 1, 'at least one worker is required'
+		self._maxWorkers = maxWorkers
+		self._queue = Queue.Queue()
+		self._threads = [ ]
+		self._idle = 0
+		self._lock = threading.Lock()
+		self._shutdown = False
+
+	def getMaxWorkers(self):
+		"""Returns the max. number of threads.
+
+		@return: an integer
+		"""
+		return self._maxWorkers
+
+	maxWorkers = property(getMaxWorkers,
+		doc='The max. number of worker threads.')
+
+	def submit(self, func, *args, **kwargs):
+		"""Schedules a function for execution.
+
+		@param func: a callable object
+		@param args: positional arguments for C{func}
+		@param kwargs: keyword arguments for C{func}
+
+		@return: a L{Future} containing the function's result
+		"""
+		future = Future()
+
+		self._lock.acquire()
+		try:
+			assert not self._shutdown, 'pool has been shut down'
+			self._queue.put( (future, func, args, kwargs) )
+
+			if self._queue.qsize() > self._idle and \
+					len(self._threads) < self._maxWorkers:
+				t = threading.Thread(target=self._work)
+				t.setDaemon(True)
+				self._threads.append(t)
+				t.start()
+		finally:
+			self._lock.release()
+
+		return future
+
+	def map(self, func, iterable):
+		"""Applies a function to all items, using the worker threads.
+
+		@param func: a callable object taking one argument
+		@param iterable: the items to process
+
+		@return: a list of L{Future} objects, in the order of the items
+		"""
+		return [self.submit(func, item) for item in iterable]
+
+	def shutdown(self, wait=True):
+		"""Stops all threads after the queued functions have finished.
+
+		@param wait: if True, block until all threads have finished
+		"""
+		self._lock.acquire()
+		try:
+			self._shutdown = True
+			threads = list(self._threads)
+			for t in threads:
+				self._queue.put(None)
+		finally:
+			self._lock.release()
+
+		if wait:
+			for t in threads:
+				t.join()
+
+	def _work(self):
+		while True:
+			self._lock.acquire()
+			self._idle += 1
+			self._lock.release()
+
+			item = self._queue.get()
+
+			self._lock.acquire()
+			self._idle -= 1
+			self._lock.release()
+
+			if item is None:
+				return
+
+			(future, func, args, kwargs) = item
+			try:
+				result = func(*args, **kwargs)
+			except:
+				future.setException(sys.exc_info())
+			else:
+				future.setResult(result)
+
+
+class SingleFlight(object):
+	"""Suppresses duplicate concurrent function calls.
+
+	Calls to L{do} with the same key are coalesced while one of them
+	is running: Only the first call executes the function, the others
+	wait for it and return its result (or raise its exception).
+	Calls made after the function has returned execute it again.
+	"""
+
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._calls = { }
+		self._coalesced = 0
+
+	def do(self, key, func, *args, **kwargs):
+		"""Calls a function, unless a call for C{key} is in progress.
+
+		@param key: a hashable object identifying the call
+		@param func: a callable object
+		@param args: positional arguments for C{func}
+		@param kwargs: keyword arguments for C{func}
+
+		@return: the function's result
+		"""
+		self._lock.acquire()
+		try:
+			future = self._calls.get(key)
+			if future is not None:
+				self._coalesced += 1
+			else:
+				self._calls[key] = running = Future()
+		finally:
+			self._lock.release()
+
+		if future is not None:
+			return future.result()
+
+		try:
+			try:
+				result = func(*args, **kwargs)
+			except:
+				running.setException(sys.exc_info())
+				raise
+			running.setResult(result)
+			return result
+		finally:
+			self._lock.acquire()
+			del self._calls[key]
+			self._lock.release()
+
+	def getCoalesced(self):
+		"""Returns the number of calls which didn't run the function.
+
+		@return: an integer
+		"""
+		return self._coalesced
+
+	coalesced = property(getCoalesced,
+		doc='The number of coalesced calls.')
+
+# EOF
@@ -5,36 +5,80 @@ Format (MMD) <http://musicbrainz.org/development/mmd/>} returned by the
 MusicBrainz webservice. 
 
 There are also DOM helper functions in this module used by the parser which
-probably aren't useful to users.
+probably aren't useful to users. They work on C{xml.dom.minidom} nodes, on
+the lightweight element tree built by the expat parser engine and on lxml
+elements.
+
+The parser engines read documents into element trees. The available engines
+are returned by L{getParserEngines}, and more can be added using
+L{registerParserEngine}. If U{lxml <http://lxml.de/>} is installed, it is
+used by default.
 """
 __revision__ = '$Id$'
 
 import re
 import logging
+import weakref
 import urlparse
+import threading
 import xml.dom.minidom
 import xml.sax.saxutils as saxutils 
+import xml.parsers.expat as expat
 from xml.parsers.expat import ExpatError
 from xml.dom import DOMException
 
 import musicbrainz2.utils as mbutils
 import musicbrainz2.model as model
 from musicbrainz2.model import NS_MMD_1, NS_REL_1, NS_EXT_1
+from musicbrainz2.metrics import NullTracer
+
+try:
+	import lxml.etree as _lxml
+	_LxmlElement = _lxml._Element
+except ImportError:
+	_lxml = None
+	_LxmlElement = None
 
 __all__ = [
-	'DefaultFactory', 'Metadata', 'ParseError',
+	'DefaultFactory', 'LazyFactory', 'IdentityMap', 'Metadata', 'ParseError',
+	'Projection',
 	'MbXmlParser', 'MbXmlWriter',
+	'IParserEngine', 'registerParserEngine', 'getParserEngines',
 	'AbstractResult',
 	'ArtistResult', 'ReleaseResult', 'TrackResult', 'LabelResult',
 	'ReleaseGroupResult'
 ]
 
+_NULL_TRACER = NullTracer()
+
 
 class DefaultFactory(object):
 	"""A factory to instantiate classes from the domain model. 
 
 	This factory may be used to create objects from L{musicbrainz2.model}.
+
+	If an L{IdentityMap} is given, entities with the same ID are shared
+	by all documents parsed using this factory.
 	"""
+	# for derived classes not calling the constructor
+	_identityMap = None
+
+	def __init__(self, identityMap=None):
+		"""Constructor.
+
+		@param identityMap: an L{IdentityMap} object, or None
+		"""
+		self._identityMap = identityMap
+
+	def getIdentityMap(self):
+		"""Returns the identity map.
+
+		@return: an L{IdentityMap} object, or None
+		"""
+		return self._identityMap
+
+	identityMap = property(getIdentityMap, doc='The identity map.')
+
 	def newArtist(self): return model.Artist()
 	def newRelease(self): return model.Release()
 	def newReleaseGroup(self): return model.ReleaseGroup()
@@ -49,6 +93,373 @@ class DefaultFactory(object):
 	def newTag(self): return model.Tag()
 	def newRating(self): return model.Rating()
 
+	def defer(self, entity, name, decode, node):
+		"""Decodes a child list of an entity, now or later.
+
+		The parser calls this for lists which may be large, like the
+		tracks of a release. C{name} is the name of the list, which is
+		one of C{'releases'}, C{'releaseGroups'}, C{'tracks'},
+		C{'releaseEvents'}, C{'discs'} or C{'relations'}. Calling
+		C{decode(node, entity)} adds the list's contents to the entity.
+		This implementation does that right away.
+
+		@param entity: an object created by this factory
+		@param name: a string
+		@param decode: a callable object
+		@param node: the list's element
+		"""
+		decode(node, entity)
+
+	def intern(self, obj):
+		"""Returns the object to use for a newly parsed object.
+
+		The parser calls this for each artist, label, release, release
+		group, track, relation, release event and alias once it is
+		complete, and uses the returned object instead. This
+		implementation passes C{obj} to the identity map, if there is
+		one, and returns C{obj} otherwise.
+
+		@param obj: an object created by this factory
+
+		@return: C{obj}, or an equivalent object
+		"""
+		if self._identityMap is None:
+			return obj
+		return self._identityMap.intern(obj)
+
+
+class LazyFactory(DefaultFactory):
+	"""A factory creating objects which decode their child lists later.
+
+	Artists, releases, release groups and tracks created by this factory
+	keep the elements of their larger child lists (see
+	L{DefaultFactory.defer}) and decode each of them when it is first
+	accessed. This makes parsing faster if only some of the lists are
+	used. The objects may be shared between threads.
+
+	Child lists are only decoded later with the parser engines whose
+	element trees may be kept, like C{'expat'} and C{'lxml'}. The
+	C{'minidom'} engine decodes everything right away. An lxml element
+	keeps its whole document alive, so the C{'lxml'} engine's lists are
+	kept as serialized XML and parsed again when they are decoded.
+
+	Example:
+
+	>>> parser = MbXmlParser(factory=LazyFactory())
+	>>> artist = parser.parse(stream).artist
+	>>> releases = artist.releases # decoded now
+	>>>
+	"""
+	def newArtist(self): return _LazyArtist()
+	def newRelease(self): return _LazyRelease()
+	def newReleaseGroup(self): return _LazyReleaseGroup()
+	def newTrack(self): return _LazyTrack()
+
+	def defer(self, entity, name, decode, node):
+		if isinstance(entity, _LazyEntity):
+			entity._defer('_' + name, decode, node)
+		else:
+			decode(node, entity)
+
+
+# Serializes decoding deferred lists.
+_decodeLock = threading.RLock()
+
+class _LazyEntity(object):
+	"""A mixin for model classes decoding child lists on first access.
+
+	Deferred lists are removed from the object, so accessing them calls
+	L{__getattr__}, which decodes them into a new object of the model
+	class and moves them over. Derived classes have a C{_deferred} slot,
+	mapping attribute names to lists of (decode, node) tuples. It is
+	unset if nothing has been deferred. lxml nodes are stored as
+	strings, see L{LazyFactory}.
+	"""
+	__slots__ = ( )
+
+	_modelClass = None
+
+	def _defer(self, attr, decode, node):
+		if self._deferred is None:
+			self._deferred = { }
+		if attr not in self._deferred:
+			self._deferred[attr] = [ ]
+			delattr(self, attr)
+		if node.__class__ is _LxmlElement:
+			node = _lxml.tostring(node, with_tail=False)
+		self._deferred[attr].append( (decode, node) )
+
+	def __getattr__(self, name):
+		if name == '_deferred':
+			return None
+		_decodeLock.acquire()
+		try:
+			deferred = self._deferred
+			if deferred is None or name not in deferred:
+				# decoded by another thread while we were waiting
+				return object.__getattribute__(self, name)
+
+			scratch = self._modelClass()
+			for (decode, node) in deferred[name]:
+				if isinstance(node, str):
+					node = _lxml.fromstring(node)
+				decode(node, scratch)
+			value = getattr(scratch, name)
+			setattr(self, name, value)
+			del deferred[name]
+			return value
+		finally:
+			_decodeLock.release()
+
+	def __getstate__(self):
+		# decode everything, the parser isn't picklable
+		for name in list(self._deferred or ( )):
+			getattr(self, name)
+		state = self._modelClass.__getstate__(self)
+		state.pop('_deferred', None)
+		return state
+
+
+def _getSlot(obj, name):
+	# doesn't call __getattr__, so deferred lists aren't decoded
+	try:
+		return object.__getattribute__(obj, name)
+	except AttributeError:
+		return None
+
+
+class IdentityMap(object):
+	"""Shares entities and URIs between parsed documents.
+
+	Without an identity map, each parsed document contains new objects,
+	even for entities already returned by earlier requests. If a factory
+	has an identity map (see L{DefaultFactory.__init__}), entities are
+	looked up by ID after parsing. If there is one already, the new
+	entity's attributes are merged into it, and the existing entity is
+	used in the new document. Only simple attributes the existing
+	entity doesn't have (which are None) are taken from the new one,
+	so later responses don't overwrite them. Lists, like the releases
+	of an artist, are replaced if the new document contains them,
+	along with their offset and count. So after reading the second
+	page of an artist's releases, the artist has the releases of that
+	page. Use a new map or L{clear} to pick up changed simple
+	attributes.
+
+	Type, format and relation URIs are shared, too. Relation target
+	IDs are replaced by the ID string of the target entity, if it is
+	in the map.
+
+	The map only keeps weak references to entities, so entities are
+	removed when they aren't used anymore. It may be shared by several
+	factories and threads. Note that the merged entities are shared,
+	too, so they shouldn't be modified by one thread while others
+	are using them.
+
+	Example:
+
+	>>> factory = DefaultFactory(identityMap=IdentityMap())
+	>>> q = Query(factory=factory)
+	>>> r1 = q.getTracks(TrackFilter(title='Cornflake Girl'))
+	>>> r2 = q.getTracks(TrackFilter(title='Winter'))
+	>>> r1[0].track.artist is r2[0].track.artist
+	True
+	>>>
+	"""
+	_URI_ATTRS = ('_type', '_relationType', '_targetType', '_format')
+	_URI_LIST_ATTRS = ('_types', '_attributes')
+
+	def __init__(self):
+		"""Constructor."""
+		self._lock = threading.Lock()
+		self._entities = weakref.WeakValueDictionary()
+		self._uris = { }
+		self._classInfo = { }
+		self._mergedCount = 0
+
+	def get(self, id_):
+		"""Returns the entity with the given ID.
+
+		@param id_: a string containing an absolute URI
+
+		@return: a L{model.Entity} object, or None
+		"""
+		self._lock.acquire()
+		try:
+			return self._entities.get(id_)
+		finally:
+			self._lock.release()
+
+	def __len__(self):
+		self._lock.acquire()
+		try:
+			return len(self._entities)
+		finally:
+			self._lock.release()
+
+	def clear(self):
+		"""Removes all entities and URIs from the map.
+
+		Entities which are still used are not changed.
+		"""
+		self._lock.acquire()
+		try:
+			self._entities.clear()
+			self._uris.clear()
+		finally:
+			self._lock.release()
+
+	def getMergedCount(self):
+		"""Returns how many entities have been merged into existing ones.
+
+		@return: an integer
+		"""
+		return self._mergedCount
+
+	mergedCount = property(getMergedCount,
+		doc='How many entities have been merged into existing ones.')
+
+	def internUri(self, uri):
+		"""Returns a shared string equal to C{uri}.
+
+		@param uri: a string
+
+		@return: a string
+		"""
+		# atomic, no need to lock
+		return self._uris.setdefault(uri, uri)
+
+	def intern(self, obj):
+		"""Returns the shared object for a newly parsed object.
+
+		If C{obj} is an entity with an ID, the entity with this ID is
+		returned, after merging C{obj} into it. Otherwise, C{obj} is
+		returned. In both cases, the URIs of C{obj} are shared.
+
+		@param obj: a model object
+
+		@return: a model object
+		"""
+		self._internUris(obj)
+		if not isinstance(obj, model.Entity) or obj.getId() is None:
+			return obj
+
+		self._lock.acquire()
+		try:
+			existing = self._entities.get(obj.getId())
+			if existing is None:
+				self._entities[obj.getId()] = obj
+				return obj
+			self._mergedCount += 1
+		finally:
+			self._lock.release()
+
+		# Merging may move deferred lists, so it is serialized with
+		# decoding them.
+		_decodeLock.acquire()
+		try:
+			self._merge(existing, obj)
+		finally:
+			_decodeLock.release()
+		return existing
+
+	def _internUris(self, obj):
+		(slotNames, uriNames, uriListNames, paging) = \
+			self._getClassInfo(type(obj))
+		for name in uriNames:
+			value = _getSlot(obj, name)
+			if value is not None:
+				setattr(obj, name, self.internUri(value))
+		for name in uriListNames:
+			values = _getSlot(obj, name)
+			if values:
+				values[:] = [self.internUri(v) for v in values]
+
+		if isinstance(obj, model.Relation):
+			target = self.get(obj.getTargetId())
+			if target is not None:
+				obj.setTargetId(target.getId())
+
+	def _getClassInfo(self, cls):
+		# Returns the slot names of a class, which of them are URIs, and
+		# the offset and count slots of lists.
+		info = self._classInfo.get(cls)
+		if info is None:
+			names = [ ]
+			for c in cls.__mro__:
+				for name in c.__dict__.get('__slots__', ( )):
+					if name not in ('__weakref__', '_deferred'):
+						names.append(name)
+			paging = { }
+			for name in names:
+				if name + 'Offset' in names and name + 'Count' in names:
+					paging[name] = (name + 'Offset', name + 'Count')
+			info = (names,
+				[n for n in self._URI_ATTRS if n in names],
+				[n for n in self._URI_LIST_ATTRS if n in names],
+				paging)
+			self._classInfo[cls] = info
+		return info
+
+	def _merge(self, target, source):
+		targetDeferred = getattr(target, '_deferred', None) or { }
+		sourceDeferred = getattr(source, '_deferred', None) or { }
+		(names, uriNames, uriListNames, paging) = \
+			self._getClassInfo(type(source))
+
+		skipped = { }
+		for (offsetName, countName) in paging.values():
+			skipped[offsetName] = skipped[countName] = True
+
+		for name in names:
+			if name in skipped:
+				continue
+
+			if name in sourceDeferred:
+				# the list is replaced
+				if name in targetDeferred:
+					del targetDeferred[name]
+					setattr(target, name, None)
+
+				if isinstance(target, _LazyEntity):
+					# move the list's elements over, without decoding them
+					for (decode, node) in sourceDeferred[name]:
+						target._defer(name, decode, node)
+				else:
+					setattr(target, name, getattr(source, name))
+			else:
+				value = _getSlot(source, name)
+				if value is None:
+					continue
+				if not isinstance(value, (list, dict)):
+					if name in targetDeferred or \
+							_getSlot(target, name) is not None:
+						continue
+				elif name in targetDeferred:
+					del targetDeferred[name]
+				setattr(target, name, value)
+
+			if name in paging:
+				for pagingName in paging[name]:
+					setattr(target, pagingName,
+						_getSlot(source, pagingName))
+
+
+class _LazyArtist(_LazyEntity, model.Artist):
+	__slots__ = ('_deferred',)
+	_modelClass = model.Artist
+
+class _LazyRelease(_LazyEntity, model.Release):
+	__slots__ = ('_deferred',)
+	_modelClass = model.Release
+
+class _LazyReleaseGroup(_LazyEntity, model.ReleaseGroup):
+	__slots__ = ('_deferred',)
+	_modelClass = model.ReleaseGroup
+
+class _LazyTrack(_LazyEntity, model.Track):
+	__slots__ = ('_deferred',)
+	_modelClass = model.Track
+
 
 class ParseError(Exception):
 	"""Exception to be thrown if a parse error occurs.
@@ -66,6 +477,87 @@ class ParseError(Exception):
 		return self.msg
 
 
+class Projection(object):
+	"""Selects the parts of a document L{MbXmlParser} reads.
+
+	A projection maps element names of entities, like C{'release'} or
+	C{'artist'}, to the names of the child elements which should be
+	read, like C{'title'} or C{'release-event-list'}. All other child
+	elements of these entities are skipped, so no objects are created
+	for them. Attributes like IDs, types and scores are always read.
+	Entities not in the projection are read completely.
+
+	Projections apply to nested entities as well. In this example, the
+	artists of releases are read, but only their names::
+
+		>>> p = Projection({
+		...     'release': ['title', 'artist'],
+		...     'artist': ['name'],
+		... })
+		>>> q.getReleases(ReleaseFilter(title='Hips'), projection=p)
+		...
+
+	The expat engine skips elements while reading the document, and
+	the lxml engine discards them as soon as they have been read, so
+	neither keeps them in memory. The minidom engine reads the complete
+	document first.
+
+	Projections selecting the same fields are equal, so they may be
+	used as dictionary keys. Don't modify them.
+	"""
+
+	def __init__(self, fields):
+		"""Constructor.
+
+		@param fields: a dictionary mapping entity names to lists of
+			child element names
+		"""
+		self._fields = { }
+		for (entity, children) in fields.iteritems():
+			self._fields[entity] = frozenset(children)
+
+	def getEntities(self):
+		"""Returns the names of the entities in this projection.
+
+		@return: a list of strings
+		"""
+		return self._fields.keys()
+
+	def getFields(self, entity):
+		"""Returns the names of the child elements read for an entity.
+
+		@param entity: a string, like C{'release'}
+
+		@return: a frozenset of strings, or None if all children are read
+		"""
+		return self._fields.get(entity)
+
+	def isSkipped(self, entity, child):
+		"""Checks if a child element of an entity is skipped.
+
+		@param entity: a string, like C{'release'}
+		@param child: a string, like C{'disc-list'}
+
+		@return: a boolean
+		"""
+		fields = self._fields.get(entity)
+		return fields is not None and child not in fields
+
+	def __eq__(self, other):
+		if not isinstance(other, Projection):
+			return NotImplemented
+		return self._fields == other._fields
+
+	def __ne__(self, other):
+		result = self.__eq__(other)
+		if result is NotImplemented:
+			return result
+		return not result
+
+	def __hash__(self):
+		return hash(frozenset(self._fields.iteritems()))
+
+
 class Metadata(object):
 	"""Represents a parsed Music Metadata XML document.
 
@@ -651,7 +1143,8 @@ class MbXmlParser(object):
 		<http://musicbrainz.org/development/mmd/>}
 	"""
 
-	def __init__(self, factory=DefaultFactory()):
+	def __init__(self, factory=DefaultFactory(), engine=None,
+			projection=None):
 		"""Constructor.
 
 		The C{factory} parameter has be an instance of L{DefaultFactory}
@@ -661,12 +1154,45 @@ class MbXmlParser(object):
 		returned objects have the same interface as their counterparts
 		from L{musicbrainz2.model}.
 
+		The C{engine} selects how the XML is read. C{'expat'} builds
+		a lightweight element tree in a single pass and is considerably
+		faster and uses less memory than C{'minidom'}, which builds a
+		complete C{xml.dom.minidom} DOM. C{'lxml'} lets U{lxml
+		<http://lxml.de/>} build its element tree in C, which is faster
+		still, and is only available if lxml is installed. All engines
+		return identical results. By default, the first engine returned
+		by L{getParserEngines} is used.
+
+		If a L{Projection} is given, only the selected parts of the
+		documents are read.
+
 		@param factory: an object factory 
+		@param engine: a string, like C{'expat'} or C{'minidom'}, or None
+		@param projection: a L{Projection} object, or None
+
+		@raise ValueError: if the engine is unknown
 		"""
+		if engine is None:
+			engine = _engineNames[0]
+		elif engine not in _engines:
+			raise ValueError('unknown parser engine: ' + str(engine))
+
 		self._log = logging.getLogger(str(self.__class__))
 		self._factory = factory
+		self._engine = engine
+		self._engineClass = _engines[engine]
+		self._projection = projection
 
-	def parse(self, inStream):
+	def getEngine(self):
+		"""Returns the name of the parser engine.
+
+		@return: a string
+		"""
+		return self._engine
+
+	engine = property(getEngine, doc='The name of the parser engine.')
+
+	def parse(self, inStream, span=None):
 		"""Parses the MusicBrainz web service XML.
 
 		Returns a L{Metadata} object representing the parsed XML or
@@ -677,36 +1203,95 @@ class MbXmlParser(object):
 		Note that an L{IOError} may be raised if there is a problem
 		reading C{inStream}.
 
+		If a L{Span <musicbrainz2.metrics.Span>} is given, reading the
+		document and creating the objects are timed as its C{xml.parse}
+		and C{xml.build} children.
+
 		@param inStream: a file-like object
+		@param span: a L{Span <musicbrainz2.metrics.Span>}, or None
 		@return: a L{Metadata} object (never None)
 		@raise ParseError: if the document is not valid
 		@raise IOError: if reading from the stream failed
 		"""
+		if span is None:
+			span = _NULL_TRACER.startSpan('xml')
 
+		engine = self._engineClass()
+		phase = span.startChild('xml.parse', {'engine': self._engine})
 		try:
-			doc = xml.dom.minidom.parse(inStream)
+			elems = engine.parse(inStream, self._projection)
+		except ParseError, e:
+			self._log.debug('ParseError: %s', e)
+			phase.finish(error=e)
+			raise
+		phase.finish()
+
+		if len(elems) == 0:
+			msg = 'cannot find root element mmd:metadata'
+			self._log.debug('ParseError: %s', msg)
+			raise ParseError(msg)
+
+		phase = span.startChild('xml.build')
+		md = self._createMetadata(elems[0])
+		phase.finish()
+
+		engine.dispose(elems)
+		return md
 
-			# Try to find the root element. If this isn't an mmd
-			# XML file or the namespace is wrong, this will fail.
-			elems = doc.getElementsByTagNameNS(NS_MMD_1, 'metadata')
 
-			if len(elems) != 0:
-				md = self._createMetadata(elems[0])
-			else:
-				msg = 'cannot find root element mmd:metadata'
-				self._log.debug('ParseError: ' + msg)
-				raise ParseError(msg)
+	def iterResults(self, inStream, chunkSize=4096):
+		"""Parses search results incrementally.
 
-			doc.unlink()
+		This is a generator yielding an L{AbstractResult} subclass
+		for each entry of the result lists (like C{artist-list}) in
+		the document. It reads C{inStream} in chunks of C{chunkSize}
+		bytes and yields results as soon as they are complete, so the
+		first results can be used while the rest of the document is
+		still being read. Completed results aren't kept in memory.
 
-			return md
-		except ExpatError, e:
-			self._log.debug('ExpatError: ' + str(e))
-			raise ParseError(msg=str(e), reason=e)
-		except DOMException, e:
-			self._log.debug('DOMException: ' + str(e))
-			raise ParseError(msg=str(e), reason=e)
-			
+		This always uses the expat engine. Other contents of the
+		document are ignored.
+
+		@param inStream: a file-like object
+		@param chunkSize: the number of bytes to read at once
+
+		@return: a generator yielding L{AbstractResult} objects
+		@raise ParseError: if the document is not valid
+		@raise IOError: if reading from the stream failed
+		"""
+		creators = {
+			'artist-list': (self._createArtist, ArtistResult),
+			'label-list': (self._createLabel, LabelResult),
+			'release-list': (self._createRelease, ReleaseResult),
+			'release-group-list':
+				(self._createReleaseGroup, ReleaseGroupResult),
+			'track-list': (self._createTrack, TrackResult),
+		}
+		builder = _TreeBuilder(creators.keys(), self._projection)
+		parser = builder.createParser()
+
+		while True:
+			data = inStream.read(chunkSize)
+			try:
+				parser.Parse(data, data == '')
+			except ExpatError, e:
+				self._log.debug('ExpatError: %s', e)
+				raise ParseError(msg=str(e), reason=e)
+
+			for (listNode, node) in builder.popResults():
+				(create, resultClass) = creators[listNode.localName]
+				entity = create(node)
+				score = _getIntAttr(node, 'score', 0, 100, ns=NS_EXT_1)
+				if entity is not None:
+					yield resultClass(entity, score)
+
+			if data == '':
+				break
+
+		if len(builder.getMetadata()) == 0:
+			msg = 'cannot find root element mmd:metadata'
+			self._log.debug('ParseError: %s', msg)
+			raise ParseError(msg)
 
 	def _createMetadata(self, metadata):
 		md = Metadata()
@@ -814,6 +1399,22 @@ class MbXmlParser(object):
 		rating = self._createRating(attrNode)
 		entity.setRating(rating)
 
+	def _addReleases(self, listNode, entity):
+		self._addReleasesToList(listNode, entity.getReleases())
+
+	def _addReleaseGroups(self, listNode, entity):
+		self._addReleaseGroupsToList(listNode, entity.getReleaseGroups())
+
+	def _addTracks(self, listNode, release):
+		self._addTracksToList(listNode, release.getTracks())
+
+	def _defer(self, entity, name, decode, node):
+		# other trees, like minidom's, may be destroyed after parsing
+		if isinstance(node, _Element) or node.__class__ is _LxmlElement:
+			self._factory.defer(entity, name, decode, node)
+		else:
+			decode(node, entity)
+
 	def _addToList(self, listNode, resultList, creator):
 		for c in _getChildElements(listNode):
 			resultList.append(creator(c))
@@ -845,20 +1446,22 @@ class MbXmlParser(object):
 				(offset, count) = self._getListAttrs(node)
 				artist.setReleasesOffset(offset)
 				artist.setReleasesCount(count)
-				self._addReleasesToList(node, artist.getReleases())
+				self._defer(artist, 'releases', self._addReleases, node)
 			elif _matches(node, 'release-group-list'):
 				(offset, count) = self._getListAttrs(node)
 				artist.setReleaseGroupsOffset(offset)
 				artist.setReleaseGroupsCount(count)
-				self._addReleaseGroupsToList(node, artist.getReleaseGroups())
+				self._defer(artist, 'releaseGroups', self._addReleaseGroups,
+					node)
 			elif _matches(node, 'relation-list'):
-				self._addRelationsToEntity(node, artist)
+				self._defer(artist, 'relations', self._addRelationsToEntity,
+					node)
 			elif _matches(node, 'tag-list'):
 				self._addTagsToEntity(node, artist)
 			elif _matches(node, 'rating'):
 				self._addRatingToEntity(node, artist)
 
-		return artist
+		return self._factory.intern(artist)
 
 	def _createLabel(self, labelNode):
 		label = self._factory.newLabel()
@@ -887,7 +1490,7 @@ class MbXmlParser(object):
 			elif _matches(node, 'rating'):
 				self._addRatingToEntity(node, label)
 
-		return label
+		return self._factory.intern(label)
 
 	def _createRelease(self, releaseNode):
 		release = self._factory.newRelease()
@@ -908,24 +1511,26 @@ class MbXmlParser(object):
 			elif _matches(node, 'artist'):
 				release.setArtist(self._createArtist(node))
 			elif _matches(node, 'release-event-list'):
-				self._addReleaseEvents(node, release)
+				self._defer(release, 'releaseEvents', self._addReleaseEvents,
+					node)
 			elif _matches(node, 'release-group'):
 				release.setReleaseGroup(self._createReleaseGroup(node))
 			elif _matches(node, 'disc-list'):
-				self._addDiscs(node, release)
+				self._defer(release, 'discs', self._addDiscs, node)
 			elif _matches(node, 'track-list'):
 				(offset, count) = self._getListAttrs(node)
 				release.setTracksOffset(offset)
 				release.setTracksCount(count)
-				self._addTracksToList(node, release.getTracks())
+				self._defer(release, 'tracks', self._addTracks, node)
 			elif _matches(node, 'relation-list'):
-				self._addRelationsToEntity(node, release)
+				self._defer(release, 'relations', self._addRelationsToEntity,
+					node)
 			elif _matches(node, 'tag-list'):
 				self._addTagsToEntity(node, release)
 			elif _matches(node, 'rating'):
 				self._addRatingToEntity(node, release)
 
-		return release
+		return self._factory.intern(release)
 
 	def _createReleaseGroup(self, node):
 		rg = self._factory.newReleaseGroup()
@@ -941,9 +1546,9 @@ class MbXmlParser(object):
 				(offset, count) = self._getListAttrs(child)
 				rg.setReleasesOffset(offset)
 				rg.setReleasesCount(count)
-				self._addReleasesToList(child, rg.getReleases())
+				self._defer(rg, 'releases', self._addReleases, child)
 
-		return rg
+		return self._factory.intern(rg)
 
 	def _addReleaseEvents(self, releaseListNode, release):
 		for node in _getChildElements(releaseListNode):
@@ -968,14 +1573,15 @@ class MbXmlParser(object):
 						if _matches(subNode, 'label'):
 							event.setLabel(self._createLabel(subNode))
 					
-					release.addReleaseEvent(event)
+					release.addReleaseEvent(self._factory.intern(event))
 
 
 	def _addDiscs(self, discIdListNode, release):
 		for node in _getChildElements(discIdListNode):
-			if _matches(node, 'disc') and node.hasAttribute('id'):
+			id_ = _getAttr(node, 'id')
+			if _matches(node, 'disc') and id_ is not None:
 				d = self._factory.newDisc()
-				d.setId(node.getAttribute('id'))
+				d.setId(id_)
 				d.setSectors(_getIntAttr(node, 'sectors', 0))
 				release.addDisc(d)
 
@@ -985,7 +1591,7 @@ class MbXmlParser(object):
 			if _matches(node, 'alias'):
 				alias = self._factory.newArtistAlias()
 				self._initializeAlias(alias, node)
-				artist.addAlias(alias)
+				artist.addAlias(self._factory.intern(alias))
 
 
 	def _addLabelAliases(self, aliasListNode, label):
@@ -993,7 +1599,7 @@ class MbXmlParser(object):
 			if _matches(node, 'alias'):
 				alias = self._factory.newLabelAlias()
 				self._initializeAlias(alias, node)
-				label.addAlias(alias)
+				label.addAlias(self._factory.intern(alias))
 
 
 	def _initializeAlias(self, alias, node):
@@ -1015,19 +1621,20 @@ class MbXmlParser(object):
 			elif _matches(node, 'duration'):
 				track.setDuration(_getPositiveIntText(node))
 			elif _matches(node, 'release-list'):
-				self._addReleasesToList(node, track.getReleases())
+				self._defer(track, 'releases', self._addReleases, node)
 			elif _matches(node, 'puid-list'):
 				self._addPuids(node, track)
 			elif _matches(node, 'isrc-list'):
 				self._addISRCs(node, track)
 			elif _matches(node, 'relation-list'):
-				self._addRelationsToEntity(node, track)
+				self._defer(track, 'relations', self._addRelationsToEntity,
+					node)
 			elif _matches(node, 'tag-list'):
 				self._addTagsToEntity(node, track)
 			elif _matches(node, 'rating'):
 				self._addRatingToEntity(node, track)
 
-		return track
+		return self._factory.intern(track)
 
 	# MusicBrainz extension
 	def _createUser(self, userNode):
@@ -1058,13 +1665,15 @@ class MbXmlParser(object):
 	
 	def _addPuids(self, puidListNode, track):
 		for node in _getChildElements(puidListNode):
-			if _matches(node, 'puid') and node.hasAttribute('id'):
-				track.addPuid(node.getAttribute('id'))
+			id_ = _getAttr(node, 'id')
+			if _matches(node, 'puid') and id_ is not None:
+				track.addPuid(id_)
 
 	def _addISRCs(self, isrcListNode, track):
 		for node in _getChildElements(isrcListNode):
-			if _matches(node, 'isrc') and node.hasAttribute('id'):
-				track.addISRC(node.getAttribute('id'))
+			id_ = _getAttr(node, 'id')
+			if _matches(node, 'isrc') and id_ is not None:
+				track.addISRC(id_)
 
 	def _addRelationsToEntity(self, relationListNode, entity):
 		targetType = _getUriAttr(relationListNode, 'target-type', NS_REL_1)
@@ -1112,7 +1721,7 @@ class MbXmlParser(object):
 
 		relation.setTarget(target)
 
-		return relation
+		return self._factory.intern(relation)
 
 
 #
@@ -1498,12 +2107,444 @@ class MbXmlWriter(object):
 			xml.end()
 			
 
+#
+# Expat parser engine
+#
+
+class _Element(object):
+	"""A lightweight replacement for xml.dom.Element.
+
+	This has only the attributes and methods needed by the parser.
+	Attributes are stored in a dictionary keyed by (namespace, name)
+	tuples. The child elements and the concatenated text content are
+	stored separately, so no text or whitespace nodes are created.
+	"""
+	ELEMENT_NODE = xml.dom.Node.ELEMENT_NODE
+	nodeType = ELEMENT_NODE
+
+	def __init__(self, namespaceURI, localName, attributes):
+		self.namespaceURI = namespaceURI
+		self.localName = localName
+		self.attributes = attributes
+		self.children = [ ]
+		self.text = [ ] # joined when the element is complete
+
+	def hasAttribute(self, name):
+		return (None, name) in self.attributes
+
+	def getAttribute(self, name):
+		return self.attributes.get( (None, name), u'' )
+
+	def hasAttributeNS(self, namespaceURI, localName):
+		return (namespaceURI, localName) in self.attributes
+
+	def getAttributeNS(self, namespaceURI, localName):
+		return self.attributes.get( (namespaceURI, localName), u'' )
+
+
+class _TreeBuilder(object):
+	"""Builds a tree of L{_Element} objects using expat.
+
+	Children of the mmd lists named in C{resultLists} (like
+	C{artist-list}) directly below the mmd:metadata element are removed
+	from the tree as soon as they are complete. They are collected until
+	L{popResults} is called.
+
+	Elements skipped by the L{Projection} aren't added to the tree,
+	and neither are their contents.
+	"""
+
+	def __init__(self, resultLists=( ), projection=None):
+		self._stack = [ ]
+		self._names = { }
+		self._inCdata = False
+		self._metadata = [ ]
+		self._resultLists = resultLists
+		self._results = [ ]
+		self._skipDepth = 0 # > 0 while inside a skipped element
+		self._projection = projection
+
+	def createParser(self):
+		"""Returns an expat parser feeding this builder."""
+		parser = expat.ParserCreate(None, ' ')
+		parser.buffer_text = True
+		parser.StartElementHandler = self._startElement
+		parser.EndElementHandler = self._endElement
+		parser.CharacterDataHandler = self._characterData
+		parser.StartCdataSectionHandler = self._startCdata
+		parser.EndCdataSectionHandler = self._endCdata
+		return parser
+
+	def parse(self, inStream):
+		"""Parses a document.
+
+		@param inStream: a file-like object or a file name
+
+		@return: a list containing the first mmd:metadata element,
+			or an empty list if there is none
+
+		@raise ExpatError: if the document isn't well-formed
+		"""
+		parser = self.createParser()
+
+		if isinstance(inStream, basestring):
+			inStream = open(inStream, 'rb')
+			try:
+				parser.ParseFile(inStream)
+			finally:
+				inStream.close()
+		else:
+			parser.ParseFile(inStream)
+
+		return self._metadata
+
+	def getMetadata(self):
+		"""Returns a list containing the first mmd:metadata element.
+
+		@return: a list with one element, or an empty list
+		"""
+		return self._metadata
+
+	def popResults(self):
+		"""Returns and forgets the result elements completed so far.
+
+		@return: a list of (listElement, element) tuples
+		"""
+		results = self._results
+		self._results = [ ]
+		return results
+
+	def _splitName(self, name):
+		# expat reports names as 'namespace localName'
+		try:
+			return self._names[name]
+		except KeyError:
+			parts = name.split(' ', 1)
+			if len(parts) == 1:
+				parts.insert(0, None)
+			result = self._names[name] = tuple(parts)
+			return result
+
+	def _startElement(self, name, attrs):
+		if self._skipDepth:
+			self._skipDepth += 1
+			return
+
+		(namespaceURI, localName) = self._splitName(name)
+		if self._projection is not None and self._stack and \
+				self._projection.isSkipped(self._stack[-1].localName,
+					localName):
+			self._skipDepth = 1
+			return
+
+		attributes = { }
+		for (key, value) in attrs.iteritems():
+			attributes[self._splitName(key)] = value
+
+		elem = _Element(namespaceURI, localName, attributes)
+
+		if self._stack:
+			self._stack[-1].children.append(elem)
+		self._stack.append(elem)
+
+		if localName == 'metadata' and namespaceURI == NS_MMD_1 \
+				and not self._metadata:
+			self._metadata.append(elem)
+
+	def _endElement(self, name):
+		if self._skipDepth:
+			self._skipDepth -= 1
+			return
+
+		elem = self._stack.pop()
+		elem.text = u''.join(elem.text)
+
+		if len(self._stack) < 2 or not self._metadata or \
+				self._stack[-2] is not self._metadata[0]:
+			return
+
+		listElem = self._stack[-1]
+		if listElem.localName in self._resultLists and \
+				listElem.namespaceURI == NS_MMD_1:
+			listElem.children.pop()
+			listElem.text = [ ] # whitespace between the results
+			self._results.append( (listElem, elem) )
+
+	def _characterData(self, data):
+		# minidom creates separate CDATA nodes, which _getText ignores
+		if not self._inCdata and not self._skipDepth:
+			self._stack[-1].text.append(data)
+
+	def _startCdata(self):
+		self._inCdata = True
+
+	def _endCdata(self):
+		self._inCdata = False
+
+
+#
+# Parser engines
+#
+
+class IParserEngine(object):
+	"""An interface for parser engines used by L{MbXmlParser}.
+
+	An engine reads a document into a tree of element objects. The
+	elements have to be lxml elements or provide the attributes and
+	methods of C{xml.dom.minidom} elements used by the DOM utilities in
+	this module (see L{_Element} for a minimal implementation). A new
+	engine object is created for each document.
+
+	@see: L{registerParserEngine}
+	"""
+
+	def parse(self, inStream, projection=None):
+		"""Reads a document.
+
+		Elements skipped by the C{projection} must not be part of the
+		returned tree.
+
+		@param inStream: a file-like object or a file name
+		@param projection: a L{Projection} object, or None
+
+		@return: a list containing the first mmd:metadata element,
+			or an empty list if there is none
+
+		@raise ParseError: if the document isn't well-formed
+		@raise IOError: if reading from the stream failed
+		"""
+		raise NotImplementedError()
+
+	def dispose(self, elements):
+		"""Frees the element tree once it isn't needed anymore.
+
+		@param elements: the list returned by L{parse}
+		"""
+		raise NotImplementedError()
+
+
+class _ExpatEngine(IParserEngine):
+	"""Builds a tree of L{_Element} objects using expat."""
+
+	def parse(self, inStream, projection=None):
+		try:
+			return _TreeBuilder(projection=projection).parse(inStream)
+		except ExpatError, e:
+			raise ParseError(msg=str(e), reason=e)
+
+	def dispose(self, elements):
+		pass
+
+
+class _MinidomEngine(IParserEngine):
+	"""Builds an C{xml.dom.minidom} DOM.
+
+	Elements skipped by a projection are removed after reading the
+	complete document.
+	"""
+
+	def parse(self, inStream, projection=None):
+		try:
+			doc = xml.dom.minidom.parse(inStream)
+		except (ExpatError, DOMException), e:
+			raise ParseError(msg=str(e), reason=e)
+
+		# Try to find the root element. If this isn't an mmd
+		# XML file or the namespace is wrong, this will fail.
+		elems = doc.getElementsByTagNameNS(NS_MMD_1, 'metadata')
+		if len(elems) == 0:
+			doc.unlink()
+		elif projection is not None:
+			self._prune(elems[0], projection)
+		return elems
+
+	def _prune(self, node, projection):
+		for child in _getChildElements(node):
+			if projection.isSkipped(node.localName, child.localName):
+				node.removeChild(child)
+				child.unlink()
+			else:
+				self._prune(child, projection)
+
+	def dispose(self, elements):
+		elements[0].ownerDocument.unlink()
+
+
+class _LxmlEngine(IParserEngine):
+	"""Builds an lxml element tree.
+
+	The tree is built by libxml2 without calling Python code for each
+	element, and the DOM utilities in this module use the lxml elements
+	directly. With a projection, lxml reports the start and end of each
+	element, and elements skipped by the projection (including their
+	contents) are removed from the tree as soon as they end. So the tree
+	never contains more of them than one chunk of the document.
+
+	The other engines ignore the text of CDATA sections, but lxml doesn't
+	tell it apart from other text. Documents containing CDATA sections,
+	which the web service doesn't send, are serialized again and read
+	using expat.
+	"""
+
+	# The number of bytes passed to lxml at once.
+	_CHUNK_SIZE = 65536
+
+	_CDATA_START = '<![CDATA['
+
+	def parse(self, inStream, projection=None):
+		if isinstance(inStream, basestring):
+			inStream = open(inStream, 'rb')
+			try:
+				return self._parse(inStream, projection)
+			finally:
+				inStream.close()
+		else:
+			return self._parse(inStream, projection)
+
+	def _parse(self, inStream, projection):
+		if projection is None:
+			parser = _lxml.XMLParser(resolve_entities=False,
+				no_network=True, strip_cdata=False)
+		else:
+			parser = _lxml.XMLPullParser(events=('start', 'end'),
+				resolve_entities=False, no_network=True, strip_cdata=False)
+		stack = [ ] # (localName, skipped) of the open elements
+		hasCdata = False
+		tail = '' # the start of a CDATA section may span two chunks
+		try:
+			while True:
+				data = inStream.read(self._CHUNK_SIZE)
+				if data == '':
+					break
+				if not hasCdata:
+					hasCdata = self._CDATA_START in tail + data[:8] \
+						or self._CDATA_START in data
+					tail = data[-8:]
+				parser.feed(data)
+				if projection is not None:
+					self._prune(parser.read_events(), projection, stack)
+			root = parser.close()
+			if projection is not None:
+				self._prune(parser.read_events(), projection, stack)
+		except _lxml.XMLSyntaxError, e:
+			raise ParseError(msg=str(e), reason=e)
+
+		if hasCdata:
+			return self._parseWithExpat(root, projection)
+
+		if _matches(root, 'metadata'):
+			metadata = root
+		else:
+			metadata = root.find('.//{%s}metadata' % NS_MMD_1)
+			if metadata is None:
+				return [ ]
+
+		return [ metadata ]
+
+	def _parseWithExpat(self, root, projection):
+		builder = _TreeBuilder(projection=projection)
+		parser = builder.createParser()
+		try:
+			parser.Parse(_lxml.tostring(root.getroottree()), True)
+		except ExpatError, e:
+			raise ParseError(msg=str(e), reason=e)
+		return builder.getMetadata()
+
+	def _prune(self, events, projection, stack):
+		for (event, node) in events:
+			if event == 'start':
+				name = _getLxmlLocalName(node.tag)
+				if stack:
+					(parentName, skipped) = stack[-1]
+					skipped = skipped or \
+						projection.isSkipped(parentName, name)
+				else:
+					skipped = False
+				stack.append( (name, skipped) )
+			elif stack.pop()[1]:
+				node.getparent().remove(node)
+
+	def dispose(self, elements):
+		pass
+
+
+# Maps engine names to IParserEngine subclasses.
+_engines = { }
+
+# The engine names, the preferred engine first.
+_engineNames = [ ]
+
+def registerParserEngine(name, engineClass, preferred=False):
+	"""Adds a parser engine, or replaces an existing one.
+
+	The engine can be selected using its name in the L{MbXmlParser}
+	constructor. If C{preferred} is True, it is used by default.
+
+	@param name: a string
+	@param engineClass: an L{IParserEngine} subclass, or a callable
+		object creating an L{IParserEngine} without parameters
+	@param preferred: a boolean
+	"""
+	if name in _engineNames:
+		_engineNames.remove(name)
+
+	_engines[name] = engineClass
+	if preferred:
+		_engineNames.insert(0, name)
+	else:
+		_engineNames.append(name)
+
+def getParserEngines():
+	"""Returns the names of all available parser engines.
+
+	The engine used by default comes first.
+
+	@return: a list of strings
+	"""
+	return list(_engineNames)
+
+registerParserEngine('expat', _ExpatEngine)
+registerParserEngine('minidom', _MinidomEngine)
+if _lxml is not None:
+	registerParserEngine('lxml', _LxmlEngine, preferred=True)
+
+
 #
 # DOM Utilities
 #
 
+# Maps (namespace, name) tuples to lxml's '{namespace}name' tags.
+_lxmlTags = { }
+
+# Maps lxml tags to local names.
+_lxmlLocalNames = { }
+
+def _getLxmlLocalName(tag):
+	"""Returns the local name of an lxml tag."""
+	try:
+		return _lxmlLocalNames[tag]
+	except KeyError:
+		name = _lxmlLocalNames[tag] = tag[tag.find('}') + 1:]
+		return name
+
+def _getLxmlTag(namespace, name):
+	"""Returns the lxml tag for a name and namespace."""
+	try:
+		return _lxmlTags[(namespace, name)]
+	except KeyError:
+		if namespace is None:
+			tag = name
+		else:
+			tag = '{%s}%s' % (namespace, name)
+		_lxmlTags[(namespace, name)] = tag
+		return tag
+
+
 def _matches(node, name, namespace=NS_MMD_1):
 	"""Checks if an xml.dom.Node and a given name and namespace match."""
+	if node.__class__ is _LxmlElement:
+		return node.tag == (_lxmlTags.get((namespace, name))
+			or _getLxmlTag(namespace, name))
 
 	if node.localName == name and node.namespaceURI == namespace:
 		return True
@@ -1513,6 +2554,10 @@ def _matches(node, name, namespace=NS_MMD_1):
 
 def _getChildElements(parentNode):
 	"""Returns all direct child elements of the given xml.dom.Node."""
+	if isinstance(parentNode, _Element):
+		return parentNode.children
+	elif parentNode.__class__ is _LxmlElement:
+		return list(parentNode.iterchildren('*'))
 
 	children = [ ]
 	for node in parentNode.childNodes:
@@ -1528,10 +2573,19 @@ def _getText(element, regex=None, default=None):
 	This function simply fetches all contained text nodes, so the element
 	should not contain child elements.
 	"""
-	res = ''
-	for node in element.childNodes:
-		if node.nodeType == node.TEXT_NODE:
-			res += node.data
+	if isinstance(element, _Element):
+		res = element.text
+	elif element.__class__ is _LxmlElement:
+		# lxml returns str objects for ASCII text
+		res = unicode(element.text or u'')
+		for child in element:
+			if child.tail is not None:
+				res += child.tail
+	else:
+		res = ''
+		for node in element.childNodes:
+			if node.nodeType == node.TEXT_NODE:
+				res += node.data
 
 	if regex is None or re.match(regex, res):
 		return res
@@ -1559,13 +2613,19 @@ def _getAttr(element, attrName, regex=None, default=None, ns=None):
 	If there is no attribute with that name or the attribute doesn't
 	match the regular expression, default is returned.
 	"""
-	if element.hasAttributeNS(ns, attrName):
+	if element.__class__ is _LxmlElement:
+		content = element.get(_lxmlTags.get((ns, attrName))
+			or _getLxmlTag(ns, attrName))
+		if content is None:
+			return default
+		content = unicode(content) # lxml returns str objects for ASCII
+	elif element.hasAttributeNS(ns, attrName):
 		content = element.getAttributeNS(ns, attrName)
+	else:
+		return default
 
-		if regex is None or re.match(regex, content):
-			return content
-		else:
-			return default
+	if regex is None or re.match(regex, content):
+		return content
 	else:
 		return default
 
@@ -1603,11 +2663,12 @@ def _getIntAttr(element, attrName, min=0, max=None, ns=None):
 
 def _getUriListAttr(element, attrName, prefix=NS_MMD_1):
 	"""Gets a list of URIs from an attribute."""
-	if not element.hasAttribute(attrName):
+	value = _getAttr(element, attrName)
+	if value is None:
 		return [ ]
 
 	f = lambda x: x != ''
-	uris = filter(f, re.split('\s+', element.getAttribute(attrName)))
+	uris = filter(f, re.split('\s+', value))
 
 	m = lambda x: _makeAbsoluteUri(prefix, x)
 	uris = map(m, uris)
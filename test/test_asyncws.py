@@ -0,0 +1,64 @@
+"""Tests for asyncws.AsyncQuery and asyncws.AsyncWebService."""
+import unittest
+import StringIO
+from musicbrainz2.webservice import IWebService, ResourceNotFoundError
+from musicbrainz2.asyncws import AsyncWebService, AsyncQuery
+
+
+ARTIST_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<metadata xmlns="http://musicbrainz.org/ns/mmd-1.0#">
+  <artist id="%s" type="Person">
+    <name>Tori Amos</name>
+  </artist>
+</metadata>
+"""
+
+
+class FakeWebService(IWebService):
+
+	def __init__(self):
+		self.requests = [ ]
+
+	def get(self, entity, id_, include=( ), filter={ }, version='1'):
+		self.requests.append( (entity, id_) )
+		if id_ == 'c0b2500e-0cef-4130-869d-732b23ed9df5':
+			return StringIO.StringIO(ARTIST_XML % id_)
+		raise ResourceNotFoundError()
+
+	def post(self, entity, id_, data, version='1'):
+		self.requests.append( (entity, data) )
+		return StringIO.StringIO('')
+
+
+class AsyncQueryTest(unittest.TestCase):
+
+	def testGetArtistById(self):
+		ws = FakeWebService()
+		q = AsyncQuery(ws, maxWorkers=2)
+
+		f = q.getArtistById('c0b2500e-0cef-4130-869d-732b23ed9df5')
+		self.assertEquals(f.result().name, 'Tori Amos')
+
+		f = q.getArtistById('00000000-0000-0000-0000-000000000000')
+		self.assertRaises(ResourceNotFoundError, f.result)
+		self.assertEquals(len(ws.requests), 2)
+		q.getPool().shutdown()
+
+	def testAsyncWebService(self):
+		fake = FakeWebService()
+		ws = AsyncWebService(fake)
+		f = ws.post('track', '', 'a=b')
+		self.assertEquals(f.result().read(), '')
+		self.assertEquals(fake.requests, [ ('track', 'a=b') ])
+
+		q = AsyncQuery(ws, clientId='test-1')
+		self.assert_(q.getPool() is ws.getPool())
+		q.submitPuids({ }).result()
+		self.assertEquals(len(fake.requests), 2)
+		ws.getPool().shutdown()
+
+	def testMethods(self):
+		self.assertEquals(AsyncQuery.getReleases.__name__, 'getReleases')
+		self.assert_(hasattr(AsyncQuery, 'submitCDStub'))
+
+# EOF
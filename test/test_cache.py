@@ -0,0 +1,174 @@
+"""Tests for the cache module."""
+import time
+import unittest
+import StringIO
+from musicbrainz2.cache import MemoryCache
+from musicbrainz2.webservice import IWebService, Query, ReleaseIncludes, \
+	ArtistIncludes
+
+
+class FakeWebService(IWebService):
+	XML = ('<metadata xmlns="http://musicbrainz.org/ns/mmd-1.0#">'
+		'<%s id="%s"><title>Title</title><name>Name</name></%s>'
+		'</metadata>')
+
+	def __init__(self):
+		self.requests = [ ]
+
+	def get(self, entity, id_, include=( ), filter={ }, version='1'):
+		self.requests.append( (entity, id_, include) )
+		return StringIO.StringIO(self.XML % (entity, id_, entity))
+
+
+class MemoryCacheTest(unittest.TestCase):
+
+	def testGetPut(self):
+		c = MemoryCache()
+		self.assertEquals(c.get('a'), None)
+		c.put('a', 1)
+		self.assertEquals(c.get('a'), 1)
+		self.assertEquals(c.hits, 1)
+		self.assertEquals(c.misses, 1)
+
+		c.remove('a')
+		self.assertEquals(c.get('a'), None)
+		self.assertEquals(len(c), 0)
+
+	def testLru(self):
+		c = MemoryCache(maxEntries=2)
+		c.put('a', 1)
+		c.put('b', 2)
+		c.get('a')
+		c.put('c', 3)
+
+		self.assertEquals(c.get('b'), None)
+		self.assertEquals(c.get('a'), 1)
+		self.assertEquals(c.get('c'), 3)
+		self.assertEquals(c.evictions, 1)
+
+	def testMaxBytes(self):
+		c = MemoryCache(maxBytes=100)
+		c.put('a', 1, 40)
+		c.put('b', 2, 40)
+		c.put('a', 1, 50)
+		self.assertEquals(c.size, 90)
+
+		c.put('c', 3, 30)
+		self.assertEquals(c.get('b'), None)
+		self.assertEquals(c.size, 80)
+
+		c.put('d', 4, 101)
+		self.assertEquals(c.get('d'), None)
+		self.assertEquals(len(c), 2)
+
+	def testTtl(self):
+		c = MemoryCache(ttl=0.01)
+		c.put('a', 1)
+		time.sleep(0.02)
+		self.assertEquals(c.get('a'), None)
+		self.assertEquals(len(c), 0)
+
+	def testClear(self):
+		c = MemoryCache()
+		c.put('a', 1, 10)
+		c.clear()
+		self.assertEquals(len(c), 0)
+		self.assertEquals(c.size, 0)
+		c.put('b', 2)
+		self.assertEquals(c.get('b'), 2)
+
+	def testGetSuperset(self):
+		c = MemoryCache()
+		c.put( ('release', 'x', ('artist', 'tracks'), ()), 1)
+		c.put( ('release', 'x', ('sa-Official',), ()), 2)
+		c.put( ('release', 'y', ('artist', 'tracks'), ()), 3)
+
+		self.assertEquals(c.getSuperset(('release', 'x', ('artist',), ())), 1)
+		self.assertEquals(c.getSuperset(('release', 'x', (), ())), 1)
+		self.assertEquals(c.getSuperset(('release', 'x', ('labels',), ())),
+			None)
+		self.assertEquals(c.getSuperset(
+			('release', 'x', ('artist',), ('limit=1',))), None)
+		self.assertEquals(c.hits, 2)
+		self.assertEquals(c.misses, 2)
+
+		c.remove( ('release', 'x', ('artist', 'tracks'), ()) )
+		self.assertEquals(c.getSuperset(('release', 'x', ('artist',), ())),
+			None)
+		c.clear()
+		self.assertEquals(c.getSuperset(('release', 'y', (), ())), None)
+		self.assertEquals(c.getSuperset('a'), None)
+
+
+class QueryCacheTest(unittest.TestCase):
+
+	def testQuery(self):
+		ws = FakeWebService()
+		cache = MemoryCache()
+		q = Query(ws, cache=cache)
+		uuid = 'c0b2500e-0cef-4130-869d-732b23ed9df5'
+
+		r1 = q.getReleaseById(uuid)
+		r2 = q.getReleaseById(uuid)
+		self.assert_(r1 is r2)
+		self.assertEquals(len(ws.requests), 1)
+		self.assertEquals(cache.hits, 1)
+		self.assert_(cache.size > 0)
+
+		# different includes are different resources
+		q.getReleaseById(uuid, ReleaseIncludes(artist=True))
+		self.assertEquals(len(ws.requests), 2)
+
+	def testIncludeSuperset(self):
+		ws = FakeWebService()
+		q = Query(ws, cache=MemoryCache())
+		uuid = 'c0b2500e-0cef-4130-869d-732b23ed9df5'
+
+		r1 = q.getReleaseById(uuid, ReleaseIncludes(artist=True,
+			tracks=True, releaseEvents=True))
+		r2 = q.getReleaseById(uuid, ReleaseIncludes(artist=True))
+		r3 = q.getReleaseById(uuid)
+		self.assert_(r1 is r2 and r2 is r3)
+		self.assertEquals(len(ws.requests), 1)
+
+		q.getReleaseById(uuid, ReleaseIncludes(artist=True, labels=True))
+		self.assertEquals(len(ws.requests), 2)
+
+	def testIncludeSupersetShared(self):
+		ws = FakeWebService()
+		cache = MemoryCache()
+		uuid = 'c0b2500e-0cef-4130-869d-732b23ed9df5'
+
+		r1 = Query(ws, cache=cache).getReleaseById(uuid,
+			ReleaseIncludes(artist=True, tracks=True))
+		r2 = Query(ws, cache=cache).getReleaseById(uuid,
+			ReleaseIncludes(tracks=True))
+		self.assert_(r1 is r2)
+		self.assertEquals(len(ws.requests), 1)
+		self.assertEquals(cache.hits, 1)
+		self.assertEquals(cache.misses, 1)
+
+	def testIncludeSupersetEvicted(self):
+		ws = FakeWebService()
+		cache = MemoryCache()
+		q = Query(ws, cache=cache)
+		uuid = 'c0b2500e-0cef-4130-869d-732b23ed9df5'
+
+		q.getReleaseById(uuid, ReleaseIncludes(artist=True, tracks=True))
+		cache.clear()
+		q.getReleaseById(uuid, ReleaseIncludes(artist=True))
+		self.assertEquals(len(ws.requests), 2)
+
+	def testReleaseTypesMustMatch(self):
+		ws = FakeWebService()
+		q = Query(ws, cache=MemoryCache())
+		uuid = 'c0b2500e-0cef-4130-869d-732b23ed9df5'
+
+		q.getArtistById(uuid, ArtistIncludes(aliases=True,
+			releases=('Album', 'Official')))
+		q.getArtistById(uuid, ArtistIncludes(releases=('Album',)))
+		q.getArtistById(uuid, ArtistIncludes(
+			releases=('Official', 'Album')))
+		self.assertEquals(len(ws.requests), 2)
+
+# EOF
@@ -0,0 +1,195 @@
+"""Tests for the diskcache module."""
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from musicbrainz2.diskcache import DiskCache
+from musicbrainz2.transport import ConnectionPool, NullScheduler
+from musicbrainz2.webservice import WebService
+from test.test_transport import _Server, ARTIST_XML
+
+
+ARTIST_URL = 'http://musicbrainz.org/ws/1/artist/' \
+	'c0b2500e-0cef-4130-869d-732b23ed9df5?type=xml'
+RELEASE_URL = 'http://musicbrainz.org/ws/1/release/' \
+	'33dbcf02-25b9-4a35-bdb7-729455f33ad7?type=xml&inc=tracks'
+
+
+class DiskCacheTest(unittest.TestCase):
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.path = os.path.join(self.dir, 'cache.db')
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def testGetPut(self):
+		c = DiskCache(self.path)
+		self.assertEquals(c.get(ARTIST_URL), None)
+		c.put(ARTIST_URL, ARTIST_XML)
+		self.assertEquals(c.get(ARTIST_URL), ARTIST_XML)
+		self.assertEquals(c.hits, 1)
+		self.assertEquals(c.misses, 1)
+		self.assert_(0 < c.size < len(ARTIST_XML))
+
+		c.remove(ARTIST_URL)
+		self.assertEquals(c.get(ARTIST_URL), None)
+
+	def testPersistent(self):
+		DiskCache(self.path).put(ARTIST_URL, ARTIST_XML)
+		self.assertEquals(DiskCache(self.path).get(ARTIST_URL), ARTIST_XML)
+
+	def testEntityTtls(self):
+		c = DiskCache(self.path, ttl=3600, entityTtls={ 'release': -1 })
+		self.assertEquals(c.getTtl('artist'), 3600)
+		c.put(ARTIST_URL, ARTIST_XML)
+		c.put(RELEASE_URL, ARTIST_XML)
+		self.assertEquals(len(c), 1)
+
+		c = DiskCache(self.path, ttl=0.01, entityTtls={ })
+		c.put(RELEASE_URL, ARTIST_XML)
+		time.sleep(0.02)
+		self.assertEquals(c.get(RELEASE_URL), None)
+		self.assertEquals(c.prune(), 1)
+		self.assertEquals(len(c), 1)
+
+	def testNoUserData(self):
+		c = DiskCache(self.path)
+		c.put('http://musicbrainz.org/ws/1/user/?type=xml&name=x', 'x')
+		self.assertEquals(len(c), 0)
+
+		# other TTLs don't replace the defaults
+		c = DiskCache(self.path, entityTtls={ 'release': 3600 })
+		self.assertEquals(c.getTtl('release'), 3600)
+		c.put('http://musicbrainz.org/ws/1/user/?type=xml&name=x', 'x')
+		c.put('http://musicbrainz.org/ws/1/tag/?type=xml&id=x', 'x')
+		self.assertEquals(len(c), 0)
+
+		c = DiskCache(self.path, entityTtls={ 'tag': 60 })
+		c.put('http://musicbrainz.org/ws/1/tag/?type=xml&id=x', 'x')
+		self.assertEquals(len(c), 1)
+
+	def testErrors(self):
+		c = DiskCache(self.path)
+		c.put(ARTIST_URL, ARTIST_XML)
+		c._getConnection().execute('DROP TABLE includes')
+
+		# logged, and nothing is changed
+		c.remove(ARTIST_URL)
+		c.clear()
+		self.assertEquals(c.prune(), 0)
+		self.assertEquals(len(c), 1)
+
+	def testEviction(self):
+		c = DiskCache(self.path)
+		c.put(ARTIST_URL, ARTIST_XML)
+		size = c.size
+
+		c = DiskCache(self.path, maxBytes=size * 2)
+		urls = [ARTIST_URL + '&n=%d' % i for i in range(3)]
+		for url in urls:
+			time.sleep(0.01)
+			c.put(url, ARTIST_XML)
+			c.get(ARTIST_URL)
+
+		self.assertEquals(c.get(ARTIST_URL), ARTIST_XML)
+		self.assertEquals(c.get(urls[0]), None)
+		self.assertEquals(c.get(urls[1]), None)
+		self.assertEquals(c.get(urls[2]), ARTIST_XML)
+		self.assertEquals(c.evictions, 2)
+		self.assert_(c.size <= size * 2)
+
+	def testGetSuperset(self):
+		url = RELEASE_URL.replace('inc=tracks', 'inc=artist+tracks')
+		DiskCache(self.path).put(url, ARTIST_XML)
+
+		c = DiskCache(self.path)
+		self.assertEquals(c.getSuperset(RELEASE_URL), ARTIST_XML)
+		self.assertEquals(c.getSuperset(url), ARTIST_XML)
+		self.assertEquals(c.getSuperset(
+			RELEASE_URL.replace('inc=tracks', 'inc=labels')), None)
+		self.assertEquals(c.getSuperset(
+			RELEASE_URL.replace('type=xml', 'type=json')), None)
+		self.assertEquals(c.hits, 2)
+		self.assertEquals(c.misses, 2)
+
+		c.remove(url)
+		self.assertEquals(c.getSuperset(RELEASE_URL), None)
+
+	def testStats(self):
+		c = DiskCache(self.path)
+		c.put(ARTIST_URL, ARTIST_XML)
+		c.put(RELEASE_URL, ARTIST_XML)
+
+		stats = c.getEntityStats()
+		self.assertEquals(len(stats), 2)
+		self.assertEquals(stats['artist'][0], 1)
+		self.assertEquals([e[0] for e in c.getEntries('release')],
+			[RELEASE_URL])
+		self.assertEquals(len(c.getEntries()), 2)
+
+		c.clear()
+		self.assertEquals(c.size, 0)
+
+
+class WebServiceCacheTest(unittest.TestCase):
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.server = _Server()
+		self.pool = ConnectionPool()
+
+	def tearDown(self):
+		self.pool.closeAll()
+		self.server.stop()
+		shutil.rmtree(self.dir)
+
+	def testGet(self):
+		cache = DiskCache(os.path.join(self.dir, 'cache.db'))
+		ws = WebService(host='127.0.0.1', port=self.server.server_port,
+			connectionPool=self.pool, scheduler=NullScheduler(),
+			responseCache=cache)
+		uuid = 'c0b2500e-0cef-4130-869d-732b23ed9df5'
+
+		for i in range(2):
+			self.assertEquals(ws.get('artist', uuid).read(), ARTIST_XML)
+
+		self.assertEquals(len(self.server.requests), 1)
+		self.assertEquals(cache.hits, 1)
+		self.assertEquals(self.pool.getIdleCount(), 1)
+
+		# another process asking for fewer include tags
+		ws = WebService(host='127.0.0.1', port=self.server.server_port,
+			connectionPool=self.pool, scheduler=NullScheduler(),
+			responseCache=DiskCache(cache.path))
+		ws.get('artist', uuid, ['aliases', 'releases'])
+		self.assertEquals(ws.get('artist', uuid, ['aliases']).read(),
+			ARTIST_XML)
+		self.assertEquals(len(self.server.requests), 2)
+
+	def testRevalidateSuperset(self):
+		self.server.etag = '"v1"'
+		cache = DiskCache(os.path.join(self.dir, 'cache.db'))
+		ws = WebService(host='127.0.0.1', port=self.server.server_port,
+			connectionPool=self.pool, scheduler=NullScheduler(),
+			responseCache=cache, maxAge=0.1)
+		uuid = 'c0b2500e-0cef-4130-869d-732b23ed9df5'
+		ws.get('artist', uuid, ['aliases', 'releases']).read()
+
+		time.sleep(0.2)
+		self.assertEquals(ws.get('artist', uuid, ['aliases']).read(),
+			ARTIST_XML)
+		deadline = time.time() + 5
+		while ws.notModifiedCount == 0:
+			self.assert_(time.time() < deadline)
+			time.sleep(0.01)
+
+		# the URL the response was stored with is revalidated
+		self.assertEquals(self.server.requests[1], self.server.requests[0])
+		self.assertEquals(self.server.headers[1]['If-None-Match'], '"v1"')
+		self.assertEquals(cache.get(ws._makeUrl('artist', uuid,
+			['aliases'])), None)
+
+# EOF
@@ -0,0 +1,232 @@
+"""Tests for the metrics module."""
+import logging
+import StringIO
+import unittest
+from musicbrainz2.metrics import Tracer, NullTracer, MultiTracer, \
+	HistogramCollector, Histogram, LoggingTracer
+from musicbrainz2.transport import ConnectionPool, NullScheduler, \
+	RetryPolicy
+from musicbrainz2.webservice import WebService, Query, \
+	ResourceNotFoundError
+from musicbrainz2.cache import MemoryCache
+from test.test_transport import _Server, ARTIST_XML
+
+
+class _RecordingTracer(Tracer):
+	def __init__(self):
+		self.spans = [ ]
+
+	def spanFinished(self, span):
+		self.spans.append(span)
+
+	def getNames(self):
+		return [span.name for span in self.spans]
+
+	def getSpan(self, name):
+		return [span for span in self.spans if span.name == name][0]
+
+
+class _RecordingHandler(logging.Handler):
+	def __init__(self):
+		logging.Handler.__init__(self)
+		self.records = [ ]
+
+	def emit(self, record):
+		self.records.append(record)
+
+
+class HistogramTest(unittest.TestCase):
+
+	def testEmpty(self):
+		h = Histogram()
+		self.assertEquals(h.count, 0)
+		self.assertEquals(h.mean, None)
+		self.assertEquals(h.getPercentile(50), None)
+
+	def testStatistics(self):
+		h = Histogram(growth=1.1)
+		for i in range(1, 101):
+			h.add(i / 1000.0)
+
+		self.assertEquals(h.count, 100)
+		self.assertEquals(h.min, 0.001)
+		self.assertEquals(h.max, 0.1)
+		self.assertAlmostEquals(h.total, 5.05)
+		self.assertAlmostEquals(h.mean, 0.0505)
+
+		p50 = h.getPercentile(50)
+		self.assert_(0.050 <= p50 <= 0.050 * 1.1, p50)
+		self.assertEquals(h.getPercentile(100), 0.1)
+		self.assertEquals(h.getPercentile(0), 0.001)
+
+	def testSmallValues(self):
+		h = Histogram(minValue=0.01)
+		h.add(0.0)
+		h.add(0.001)
+		self.assertEquals(h.getPercentile(100), 0.001)
+
+
+class TracerTest(unittest.TestCase):
+
+	def testSpans(self):
+		tracer = _RecordingTracer()
+		span = tracer.startSpan('a', {'entity': 'artist'})
+		child = span.startChild('b', {'bytes': 10})
+		self.assertEquals(child.tags, {'entity': 'artist', 'bytes': 10})
+		self.assertEquals(child.parent, span)
+		self.assertEquals(child.duration, None)
+
+		child.finish(duration=0.5)
+		span.finish(error=ValueError())
+		span.finish()
+		self.assertEquals(tracer.getNames(), ['b', 'a'])
+		self.assertEquals(child.duration, 0.5)
+		self.assert_(isinstance(span.error, ValueError))
+
+	def testNullTracer(self):
+		span = NullTracer().startSpan('a')
+		span.setTag('x', 1)
+		span.startChild('b').finish()
+		span.finish()
+		self.assertEquals(span.getTag('x'), None)
+		self.assertEquals(span.duration, None)
+
+	def testHistogramCollector(self):
+		collector = HistogramCollector(groupBy=('entity',))
+		for (entity, duration) in (('artist', 0.1), ('artist', 0.3),
+				('release', 0.2)):
+			span = collector.startSpan('ws.get', {'entity': entity})
+			span.finish(duration=duration)
+		collector.startSpan('ws.get').finish(ValueError(), 0.1)
+
+		self.assertEquals(collector.getKeys(), ['ws.get',
+			('ws.get', None), ('ws.get', 'artist'), ('ws.get', 'release')])
+		self.assertEquals(collector.getHistogram('ws.get').count, 4)
+		self.assertEquals(collector.getHistogram(('ws.get', 'artist')).max,
+			0.3)
+		self.assertEquals(collector.getErrorCount('ws.get'), 1)
+		self.assertEquals(collector.getErrorCount(('ws.get', 'artist')), 0)
+
+		out = StringIO.StringIO()
+		collector.writeSummary(out)
+		self.assertEquals(len(out.getvalue().splitlines()), 5)
+
+		collector.reset()
+		self.assertEquals(collector.getKeys(), [ ])
+
+	def testMultiTracer(self):
+		(t1, t2) = (_RecordingTracer(), _RecordingTracer())
+		MultiTracer([t1, t2]).startSpan('a').finish()
+		self.assertEquals(t1.getNames(), ['a'])
+		self.assertEquals(t2.getNames(), ['a'])
+
+
+class LoggingTracerTest(unittest.TestCase):
+
+	def setUp(self):
+		self.handler = _RecordingHandler()
+		self.logger = logging.getLogger('test.test_metrics')
+		self.logger.addHandler(self.handler)
+		self.logger.setLevel(logging.INFO)
+		self.logger.propagate = False
+
+	def tearDown(self):
+		self.logger.removeHandler(self.handler)
+
+	def testRecord(self):
+		tracer = LoggingTracer(self.logger)
+		tracer.startSpan('ws.schedule').finish()
+		span = tracer.startSpan('ws.get', {'status': 200, 'entity': 'artist'})
+		span.finish(duration=0.25)
+
+		self.assertEquals(len(self.handler.records), 1)
+		record = self.handler.records[0]
+		self.assertEquals(record.getMessage(),
+			'ws.get duration=0.250 entity=artist status=200')
+		self.assertEquals(record.levelno, logging.INFO)
+		self.assertEquals(record.spanName, 'ws.get')
+		self.assertEquals(record.duration, 0.25)
+		self.assertEquals(record.tags['status'], 200)
+
+	def testSampling(self):
+		tracer = LoggingTracer(self.logger, sampleRate=0.1, seed=1)
+		for i in range(1000):
+			tracer.startSpan('ws.get').finish()
+		self.assert_(50 < len(self.handler.records) < 150)
+
+		self.handler.records = [ ]
+		tracer = LoggingTracer(self.logger, sampleRate=0.0)
+		tracer.startSpan('ws.get').finish()
+		tracer.startSpan('ws.post').finish(error=IOError('x'))
+		self.assertEquals(len(self.handler.records), 1)
+		self.assertEquals(self.handler.records[0].levelno, logging.WARNING)
+		self.assert_('error=x' in self.handler.records[0].getMessage())
+
+	def testDisabled(self):
+		tracer = LoggingTracer(self.logger, level=logging.DEBUG)
+		tracer.startSpan('ws.get').finish()
+		self.assertEquals(len(self.handler.records), 0)
+
+
+class WebServiceTracingTest(unittest.TestCase):
+
+	def setUp(self):
+		self.server = _Server()
+		self.pool = ConnectionPool()
+		self.tracer = _RecordingTracer()
+		self.ws = WebService(host='127.0.0.1', port=self.server.server_port,
+			connectionPool=self.pool, scheduler=NullScheduler(),
+			retryPolicy=RetryPolicy(maxAttempts=1), tracer=self.tracer)
+
+	def tearDown(self):
+		self.pool.closeAll()
+		self.server.stop()
+
+	def testGet(self):
+		stream = self.ws.get('artist', 'x', ['aliases'])
+		self.assertEquals(self.tracer.getNames(),
+			['ws.schedule', 'ws.connect', 'ws.server'])
+		self.assertEquals(stream.read(), ARTIST_XML)
+		self.assertEquals(self.tracer.getNames(), ['ws.schedule',
+			'ws.connect', 'ws.server', 'ws.transfer', 'ws.get'])
+
+		span = self.tracer.getSpan('ws.get')
+		self.assertEquals(span.getTag('entity'), 'artist')
+		self.assertEquals(span.getTag('include'), 'aliases')
+		self.assertEquals(span.getTag('status'), 200)
+		self.assertEquals(span.getTag('bytes'), len(ARTIST_XML))
+		self.assertEquals(span.getTag('cached'), False)
+		self.assertEquals(self.tracer.getSpan('ws.server').parent, span)
+		self.assertEquals(
+			self.tracer.getSpan('ws.transfer').getTag('entity'), 'artist')
+
+		# the connection is reused now
+		self.tracer.spans = [ ]
+		self.ws.get('artist', 'x').close()
+		self.assertEquals(self.tracer.getNames(),
+			['ws.schedule', 'ws.server', 'ws.get'])
+
+	def testError(self):
+		self.server.errors = [ (404, None) ]
+		self.assertRaises(ResourceNotFoundError, self.ws.get, 'artist', 'x')
+
+		span = self.tracer.getSpan('ws.get')
+		self.assertEquals(span.getTag('status'), 404)
+		self.assert_(span.error is not None)
+
+	def testQuery(self):
+		q = Query(self.ws, cache=MemoryCache(), tracer=self.tracer)
+		q.getArtistById('c0b2500e-0cef-4130-869d-732b23ed9df5')
+		self.assertEquals(self.tracer.getNames()[-5:], ['ws.transfer',
+			'ws.get', 'xml.parse', 'xml.build', 'query'])
+
+		span = self.tracer.getSpan('query')
+		self.assertEquals(span.getTag('source'), 'server')
+		self.assertEquals(self.tracer.getSpan('xml.build').parent, span)
+
+		self.tracer.spans = [ ]
+		q.getArtistById('c0b2500e-0cef-4130-869d-732b23ed9df5')
+		self.assertEquals(self.tracer.getNames(), ['query'])
+		self.assertEquals(self.tracer.spans[0].getTag('source'), 'cache')
+
+# EOF
@@ -1,6 +1,9 @@
 """Tests for various model classes."""
+import copy
+import pickle
 import unittest
-from musicbrainz2.model import Artist, Release, Track, Relation, Tag, NS_REL_1
+from musicbrainz2.model import Artist, Release, Track, Relation, Tag, \
+	ReleaseEvent, Disc, NS_REL_1
 
 class MiscModelTest(unittest.TestCase):
 	
@@ -101,4 +104,69 @@ class ArtistTest(unittest.TestCase):
         artist.addRelease(release)
         self.assertEquals(artist.releases, [release])
 
+
+class _MyTrack(Track):
+	pass
+
+class SlotsTest(unittest.TestCase):
+
+	def _makeRelease(self):
+		release = Release('r_id', u'Under the Pink')
+		track = Track('t_id', u'Cornflake Girl')
+		track.addPuid('p_id')
+		track.addTag(Tag(u'rock', 2))
+		track.getRating().setValue(4)
+		release.addTrack(track)
+		release.addReleaseEvent(ReleaseEvent('GB', '1994-01-31'))
+		release.addRelation(Relation(NS_REL_1 + 'Wikipedia',
+			Relation.TO_URL, 'http://example.com/'))
+		return release
+
+	def testNoDict(self):
+		for obj in (Artist(), Release(), Track(), Relation(), Tag(),
+				ReleaseEvent(), Disc()):
+			self.failIf(hasattr(obj, '__dict__'), obj)
+
+	def testLazyCollections(self):
+		track = Track()
+		self.assert_(track._puids is None)
+		self.assert_(track._tags is None)
+		self.assert_(track._rating is None)
+		self.assertEquals(track.getTags(), [ ])
+		self.assertEquals(track.getRelationTargetTypes(), [ ])
+		self.assertEquals(track.getRelations(), [ ])
+		self.assertRaises(KeyError, track.getTag, 'rock')
+		self.assert_(track._tags is None)
+
+		track.getPuids().append('p_id')
+		self.assertEquals(track.puids, ['p_id'])
+		self.assertEquals(track.getRating().getValue(), None)
+
+	def testPickle(self):
+		for protocol in (0, 1, 2):
+			release = pickle.loads(pickle.dumps(self._makeRelease(),
+				protocol))
+			track = release.tracks[0]
+			self.assertEquals(release.title, u'Under the Pink')
+			self.assertEquals(track.puids, ['p_id'])
+			self.assertEquals(track.getTag(u'rock').count, 2)
+			self.assertEquals(track.rating.value, 4)
+			self.assertEquals(release.getEarliestReleaseDate(),
+				'1994-01-31')
+			self.assertEquals(len(release.getRelations()), 1)
+
+	def testCopy(self):
+		release = self._makeRelease()
+		clone = copy.deepcopy(release)
+		self.assertEquals(clone.tracks[0].title, u'Cornflake Girl')
+		self.failIf(clone.tracks[0] is release.tracks[0])
+		self.assert_(copy.copy(release).tracks is release.tracks)
+
+	def testSubclass(self):
+		track = _MyTrack('t_id')
+		track.note = 'extra'
+		track = pickle.loads(pickle.dumps(track, 2))
+		self.assertEquals(track.note, 'extra')
+		self.assertEquals(track.id, 't_id')
+
 # EOF
@@ -0,0 +1,153 @@
+"""Tests for the replay module."""
+import time
+import shutil
+import tempfile
+import unittest
+import StringIO
+from musicbrainz2.replay import RecordingWebService, ReplayWebService, \
+	StandInServer
+from musicbrainz2.transport import ConnectionPool, NullScheduler, RetryPolicy
+from musicbrainz2.webservice import IWebService, WebService, Query, \
+	ReleaseIncludes, ArtistFilter, ResourceNotFoundError, WebServiceError
+
+
+ARTIST_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<metadata xmlns="http://musicbrainz.org/ns/mmd-1.0#">
+  <artist id="c0b2500e-0cef-4130-869d-732b23ed9df5" type="Person">
+    <name>Tori Amos</name>
+  </artist>
+</metadata>
+"""
+
+RELEASE_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<metadata xmlns="http://musicbrainz.org/ns/mmd-1.0#">
+  <release id="33dbcf02-25b9-4a35-bdb7-729455f33ad7">
+    <title>Tales of a Librarian</title>
+  </release>
+</metadata>
+"""
+
+SEARCH_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<metadata xmlns="http://musicbrainz.org/ns/mmd-1.0#">
+  <artist-list count="1">
+    <artist id="c0b2500e-0cef-4130-869d-732b23ed9df5">
+      <name>Tori Amos</name>
+    </artist>
+  </artist-list>
+</metadata>
+"""
+
+ARTIST_ID = 'c0b2500e-0cef-4130-869d-732b23ed9df5'
+RELEASE_ID = '33dbcf02-25b9-4a35-bdb7-729455f33ad7'
+
+
+class FakeWebService(IWebService):
+	def get(self, entity, id_, include=( ), filter={ }, version='1'):
+		if entity == 'artist' and id_ == '':
+			return StringIO.StringIO(SEARCH_XML)
+		elif entity == 'artist':
+			return StringIO.StringIO(ARTIST_XML)
+		else:
+			return StringIO.StringIO(RELEASE_XML)
+
+
+class ReplayTest(unittest.TestCase):
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+
+		q = Query(RecordingWebService(FakeWebService(), self.dir))
+		q.getArtistById(ARTIST_ID)
+		q.getReleaseById(RELEASE_ID, ReleaseIncludes(artist=True,
+			tracks=True))
+		q.getArtists(ArtistFilter(name=u'Tori Amos', limit=10))
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def testReplay(self):
+		q = Query(ReplayWebService(self.dir))
+
+		self.assertEquals(q.getArtistById(ARTIST_ID).name, 'Tori Amos')
+		release = q.getReleaseById(RELEASE_ID,
+			ReleaseIncludes(tracks=True, artist=True))
+		self.assertEquals(release.title, 'Tales of a Librarian')
+		results = q.getArtists(ArtistFilter(limit=10, name=u'Tori Amos'))
+		self.assertEquals(len(results), 1)
+
+		self.assertRaises(ResourceNotFoundError, q.getReleaseById,
+			RELEASE_ID)
+		self.assertRaises(ResourceNotFoundError, q.getArtists,
+			ArtistFilter(name=u'Tori Amos'))
+
+	def testStandInServer(self):
+		server = StandInServer(self.dir)
+		server.start()
+		pool = ConnectionPool()
+		try:
+			ws = WebService(host='127.0.0.1', port=server.port,
+				connectionPool=pool, scheduler=NullScheduler())
+			q = Query(ws)
+
+			self.assertEquals(q.getArtistById(ARTIST_ID).name,
+				'Tori Amos')
+			release = q.getReleaseById(RELEASE_ID,
+				ReleaseIncludes(artist=True, tracks=True))
+			self.assertEquals(release.title, 'Tales of a Librarian')
+			results = q.getArtists(ArtistFilter(name=u'Tori Amos',
+				limit=10))
+			self.assertEquals(len(results), 1)
+
+			self.assertRaises(ResourceNotFoundError, q.getReleaseById,
+				RELEASE_ID)
+			self.assertEquals(server.requestCount, 4)
+			self.assertEquals(pool.misses, 1)
+		finally:
+			pool.closeAll()
+			server.stop()
+
+	def testCompression(self):
+		server = StandInServer(self.dir, compression=True)
+		server.start()
+		pool = ConnectionPool()
+		try:
+			ws = WebService(host='127.0.0.1', port=server.port,
+				connectionPool=pool, scheduler=NullScheduler())
+			self.assertEquals(ws.get('artist', ARTIST_ID).read(), ARTIST_XML)
+			self.assert_(ws.bytesReceived < len(ARTIST_XML))
+
+			ws = WebService(host='127.0.0.1', port=server.port,
+				connectionPool=pool, scheduler=NullScheduler(),
+				compression=False)
+			self.assertEquals(ws.get('artist', ARTIST_ID).read(), ARTIST_XML)
+			self.assertEquals(ws.bytesReceived, len(ARTIST_XML))
+		finally:
+			pool.closeAll()
+			server.stop()
+
+	def testLatencyAndErrors(self):
+		server = StandInServer(self.dir, latency=0.05, errorRate=0.5,
+			seed=1)
+		server.start()
+		pool = ConnectionPool()
+		try:
+			ws = WebService(host='127.0.0.1', port=server.port,
+				connectionPool=pool, scheduler=NullScheduler(),
+				retryPolicy=RetryPolicy(maxAttempts=1))
+
+			failures = 0
+			start = time.time()
+			for i in range(10):
+				try:
+					ws.get('artist', ARTIST_ID).read()
+				except WebServiceError:
+					failures += 1
+			self.assert_(time.time() - start >= 0.5)
+
+			self.assertEquals(failures, server.errorCount)
+			self.assert_(0 < failures < 10)
+		finally:
+			pool.closeAll()
+			server.stop()
+
+# EOF
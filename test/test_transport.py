@@ -0,0 +1,444 @@
+"""Tests for the transport module."""
+import time
+import zlib
+import unittest
+import threading
+import SocketServer
+import BaseHTTPServer
+from musicbrainz2.transport import ConnectionPool, TokenBucketScheduler, \
+	NullScheduler, getDefaultScheduler, RetryPolicy
+from musicbrainz2.webservice import WebService, Query, WebServiceError, \
+	ResourceNotFoundError, ConnectionError, ResponseError
+from musicbrainz2.cache import MemoryCache
+
+
+ARTIST_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<metadata xmlns="http://musicbrainz.org/ns/mmd-1.0#">
+  <artist id="c0b2500e-0cef-4130-869d-732b23ed9df5" type="Person">
+    <name>Tori Amos</name>
+    <sort-name>Amos, Tori</sort-name>
+  </artist>
+</metadata>
+"""
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+
+	def do_GET(self):
+		self.server.requests.append(self.path)
+		self.server.clients.add(self.client_address)
+
+		if len(self.server.errors) > 0:
+			(code, retryAfter) = self.server.errors.pop(0)
+			self.send_response(code)
+			if retryAfter is not None:
+				self.send_header('Retry-After', retryAfter)
+			self.send_header('Content-Length', '0')
+			self.end_headers()
+			return
+
+		self.server.headers.append(self.headers)
+		etag = self.server.etag
+		if etag is not None and self.headers.get('If-None-Match') == etag:
+			self.send_response(304)
+			self.send_header('ETag', etag)
+			self.end_headers()
+			return
+
+		(encoding, body) = _ENCODINGS[self.server.encoding](ARTIST_XML)
+
+		self.send_response(200)
+		self.send_header('Content-Type', 'text/xml; charset=utf-8')
+		if etag is not None:
+			self.send_header('ETag', etag)
+		if encoding is not None:
+			self.send_header('Content-Encoding', encoding)
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def do_POST(self):
+		self.rfile.read(int(self.headers['Content-Length']))
+		self.do_GET()
+
+	def log_message(self, *args):
+		pass
+
+
+def _gzip(data):
+	c = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+	return ('gzip', c.compress(data) + c.flush())
+
+def _rawDeflate(data):
+	c = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+	return ('deflate', c.compress(data) + c.flush())
+
+_ENCODINGS = {
+	None: lambda data: (None, data),
+	'gzip': _gzip,
+	'deflate': lambda data: ('deflate', zlib.compress(data)),
+	'raw': _rawDeflate,
+	'corrupt': lambda data: ('gzip', data),
+	'unknown': lambda data: ('br', data),
+}
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	daemon_threads = True
+
+	def __init__(self):
+		BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), _Handler)
+		self.requests = [ ]
+		self.headers = [ ]
+		self.clients = set()
+		self.errors = [ ]
+		self.encoding = None
+		self.etag = None
+		self._thread = threading.Thread(target=self.serve_forever)
+		self._thread.setDaemon(True)
+		self._thread.start()
+
+	def handle_error(self, request, clientAddress):
+		pass # clients drop idle connections
+
+	def stop(self):
+		self.shutdown()
+		self.server_close()
+
+
+class ConnectionPoolTest(unittest.TestCase):
+
+	def setUp(self):
+		self.server = _Server()
+		self.pools = [ ]
+
+	def tearDown(self):
+		for pool in self.pools:
+			pool.closeAll()
+		self.server.stop()
+
+	def _makeService(self, pool):
+		self.pools.append(pool)
+		return WebService(host='127.0.0.1', port=self.server.server_port,
+			connectionPool=pool, scheduler=NullScheduler())
+
+	def testReuse(self):
+		pool = ConnectionPool()
+		ws = self._makeService(pool)
+		uuid = 'c0b2500e-0cef-4130-869d-732b23ed9df5'
+
+		for i in range(3):
+			self.assertEquals(ws.get('artist', uuid).read(), ARTIST_XML)
+
+		self.assertEquals(len(self.server.requests), 3)
+		self.assertEquals(len(self.server.clients), 1)
+		self.assertEquals(pool.misses, 1)
+		self.assertEquals(pool.hits, 2)
+
+		ws.get('artist', uuid).read()
+		pool.closeAll()
+		self.assertEquals(pool.getIdleCount(), 0)
+
+	def testQuery(self):
+		pool = ConnectionPool()
+		q = Query(self._makeService(pool))
+
+		for i in range(2):
+			artist = q.getArtistById('c0b2500e-0cef-4130-869d-732b23ed9df5')
+			self.assertEquals(artist.name, 'Tori Amos')
+
+		self.assertEquals(len(self.server.clients), 1)
+		self.assertEquals(pool.hits, 1)
+
+	def testNoReuse(self):
+		pool = ConnectionPool(maxConnections=0)
+		ws = self._makeService(pool)
+
+		for i in range(2):
+			ws.get('artist', 'c0b2500e-0cef-4130-869d-732b23ed9df5').read()
+
+		self.assertEquals(len(self.server.clients), 2)
+		self.assertEquals(pool.hits, 0)
+		self.assertEquals(pool.getIdleCount(), 0)
+
+	def testMaxRequests(self):
+		pool = ConnectionPool(maxRequests=2)
+		ws = self._makeService(pool)
+
+		for i in range(4):
+			ws.get('artist', 'c0b2500e-0cef-4130-869d-732b23ed9df5').read()
+
+		self.assertEquals(len(self.server.clients), 2)
+
+	def testUnreadResponse(self):
+		pool = ConnectionPool()
+		ws = self._makeService(pool)
+
+		f = ws.get('artist', 'c0b2500e-0cef-4130-869d-732b23ed9df5')
+		f.read(10)
+		f.close()
+		self.assertEquals(pool.getIdleCount(), 0)
+
+		ws.get('artist', 'c0b2500e-0cef-4130-869d-732b23ed9df5').read()
+		self.assertEquals(pool.getIdleCount(), 1)
+		self.assertEquals(len(self.server.clients), 2)
+
+
+class TokenBucketSchedulerTest(unittest.TestCase):
+
+	def testRate(self):
+		s = TokenBucketScheduler(rate=50, burst=2)
+
+		start = time.time()
+		delays = [s.acquire('example.org') for i in range(6)]
+		elapsed = time.time() - start
+
+		self.assertEquals(delays[:2], [0.0, 0.0])
+		self.assert_(elapsed >= 4 / 50.0 - 0.01)
+		self.assertEquals(s.requestCount, 6)
+		self.assert_(s.totalDelay > 0)
+		self.assertEquals(s.maxDelay, max(delays))
+
+	def testHostsAreIndependent(self):
+		s = TokenBucketScheduler(rate=1, burst=1)
+		self.assertEquals(s.acquire('example.org'), 0.0)
+		self.assertEquals(s.acquire('example.com'), 0.0)
+
+	def testThreadsShareBudget(self):
+		s = TokenBucketScheduler(rate=50, burst=1)
+		delays = [ ]
+		def run():
+			delays.append(s.acquire('example.org'))
+
+		threads = [threading.Thread(target=run) for i in range(4)]
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+
+		delays.sort()
+		self.assertEquals(delays[0], 0.0)
+		self.assert_(delays[-1] >= 3 / 50.0 - 0.01)
+
+	def testThrottled(self):
+		s = TokenBucketScheduler(rate=1000, burst=10)
+		s.throttled('example.org', 0.05)
+		self.assert_(s.acquire('example.org') >= 0.04)
+
+	def testDefault(self):
+		self.assert_(getDefaultScheduler() is getDefaultScheduler())
+		self.assertEquals(NullScheduler().acquire('example.org'), 0.0)
+
+
+class _RecordingPolicy(RetryPolicy):
+	def __init__(self, **kwargs):
+		RetryPolicy.__init__(self, **kwargs)
+		self.attempts = [ ]
+
+	def attemptFinished(self, method, url, attempt, duration, error):
+		self.attempts.append( (method, attempt, error is None) )
+
+
+class RetryPolicyTest(unittest.TestCase):
+
+	def setUp(self):
+		self.server = _Server()
+		self.pool = ConnectionPool()
+
+	def tearDown(self):
+		self.pool.closeAll()
+		self.server.stop()
+
+	def _makeService(self, policy, port=None):
+		if port is None:
+			port = self.server.server_port
+		return WebService(host='127.0.0.1', port=port,
+			connectionPool=self.pool, scheduler=NullScheduler(),
+			retryPolicy=policy)
+
+	def testRetryGet(self):
+		policy = _RecordingPolicy(backoff=0.01)
+		ws = self._makeService(policy)
+		self.server.errors = [ (503, '0'), (502, None) ]
+
+		self.assertEquals(ws.get('artist', 'x').read(), ARTIST_XML)
+		self.assertEquals(len(self.server.requests), 3)
+		self.assertEquals(policy.retryCount, 2)
+		self.assertEquals(policy.attempts, [ ('GET', 1, False),
+			('GET', 2, False), ('GET', 3, True) ])
+
+	def testGiveUp(self):
+		ws = self._makeService(RetryPolicy(maxAttempts=2, backoff=0.01))
+		self.server.errors = [ (503, None), (503, None), (503, None) ]
+
+		self.assertRaises(WebServiceError, ws.get, 'artist', 'x')
+		self.assertEquals(len(self.server.requests), 2)
+
+	def testNoRetryOnClientError(self):
+		ws = self._makeService(RetryPolicy(backoff=0.01))
+		self.server.errors = [ (404, None) ]
+
+		self.assertRaises(ResourceNotFoundError, ws.get, 'artist', 'x')
+		self.assertEquals(len(self.server.requests), 1)
+
+	def testRetryAfterTooLong(self):
+		ws = self._makeService(RetryPolicy(maxBackoff=5))
+		self.server.errors = [ (503, '3600') ]
+
+		self.assertRaises(WebServiceError, ws.get, 'artist', 'x')
+		self.assertEquals(len(self.server.requests), 1)
+
+	def testNoRetryPost(self):
+		ws = self._makeService(RetryPolicy(backoff=0.01))
+		self.server.errors = [ (503, None) ]
+
+		self.assertRaises(WebServiceError, ws.post, 'track', '', 'a=b')
+		self.assertEquals(len(self.server.requests), 1)
+
+		ws = self._makeService(RetryPolicy(backoff=0.01, retryPosts=True))
+		self.server.errors = [ (503, None) ]
+		ws.post('track', '', 'a=b').read()
+		self.assertEquals(len(self.server.requests), 3)
+
+	def testRetryRefusedPost(self):
+		# find a port nobody listens on
+		port = self.server.server_port
+		self.server.stop()
+
+		policy = _RecordingPolicy(maxAttempts=2, backoff=0.01)
+		ws = self._makeService(policy, port)
+		self.assertRaises(ConnectionError, ws.post, 'track', '', 'a=b')
+		self.assertEquals(len(policy.attempts), 2)
+
+		self.server = _Server()
+
+
+class CompressionTest(unittest.TestCase):
+
+	def setUp(self):
+		self.server = _Server()
+		self.pool = ConnectionPool()
+
+	def tearDown(self):
+		self.pool.closeAll()
+		self.server.stop()
+
+	def _makeService(self, compression=True):
+		return WebService(host='127.0.0.1', port=self.server.server_port,
+			connectionPool=self.pool, scheduler=NullScheduler(),
+			retryPolicy=RetryPolicy(maxAttempts=1),
+			compression=compression)
+
+	def testEncodings(self):
+		ws = self._makeService()
+		decoded = 0
+		for encoding in ('gzip', 'deflate', 'raw', None):
+			self.server.encoding = encoding
+			stream = ws.get('artist', 'x')
+			self.assertEquals(stream.read(7), ARTIST_XML[:7])
+			self.assertEquals(stream.readline(), ARTIST_XML[7:39])
+			self.assertEquals(stream.read(), ARTIST_XML[39:])
+			self.assertEquals(stream.read(), '')
+
+			decoded += len(ARTIST_XML)
+			self.assertEquals(ws.bytesDecoded, decoded)
+
+		self.assert_(ws.bytesReceived < ws.bytesDecoded)
+		self.assertEquals(self.server.headers[0]['Accept-Encoding'],
+			'gzip, deflate')
+		# all responses were read, so the connection was reused
+		self.assertEquals(self.pool.misses, 1)
+
+	def testQuery(self):
+		self.server.encoding = 'gzip'
+		ws = self._makeService()
+		artist = Query(ws).getArtistById(
+			'c0b2500e-0cef-4130-869d-732b23ed9df5')
+		self.assertEquals(artist.name, 'Tori Amos')
+		self.assertEquals(ws.bytesReceived, len(_gzip(ARTIST_XML)[1]))
+
+	def testDisabled(self):
+		ws = self._makeService(compression=False)
+		self.assertEquals(ws.get('artist', 'x').read(), ARTIST_XML)
+		self.assertEquals(self.server.headers[0]['Accept-Encoding'],
+			'identity')
+		self.assertEquals(ws.bytesReceived, len(ARTIST_XML))
+
+	def testErrors(self):
+		ws = self._makeService()
+		self.server.encoding = 'corrupt'
+		stream = ws.get('artist', 'x')
+		self.assertRaises(ResponseError, stream.read)
+
+		self.server.encoding = 'unknown'
+		self.assertRaises(ResponseError, ws.get, 'artist', 'x')
+
+
+class RevalidationTest(unittest.TestCase):
+
+	def setUp(self):
+		self.server = _Server()
+		self.server.etag = '"v1"'
+		self.pool = ConnectionPool()
+
+	def tearDown(self):
+		self.pool.closeAll()
+		self.server.stop()
+
+	def _makeService(self, maxAge=None, responseCache=None):
+		return WebService(host='127.0.0.1', port=self.server.server_port,
+			connectionPool=self.pool, scheduler=NullScheduler(),
+			retryPolicy=RetryPolicy(maxAttempts=1), maxAge=maxAge,
+			responseCache=responseCache)
+
+	def _waitFor(self, predicate):
+		deadline = time.time() + 5
+		while not predicate():
+			self.assert_(time.time() < deadline)
+			time.sleep(0.01)
+
+	def testNotModified(self):
+		ws = self._makeService(maxAge=0.2, responseCache=MemoryCache())
+		self.assertEquals(ws.get('artist', 'x').validator, '"v1"')
+
+		# fresh responses are used without asking the server
+		self.assertEquals(ws.get('artist', 'x').read(), ARTIST_XML)
+		self.assertEquals(len(self.server.requests), 1)
+
+		time.sleep(0.25)
+		self.assertEquals(ws.get('artist', 'x').read(), ARTIST_XML)
+		self._waitFor(lambda: ws.notModifiedCount == 1)
+		self.assertEquals(ws.revalidationCount, 1)
+		self.assertEquals(self.server.headers[1]['If-None-Match'], '"v1"')
+
+		ws.get('artist', 'x').read()
+		self.assertEquals(len(self.server.requests), 2)
+
+	def testModified(self):
+		ws = self._makeService(maxAge=0.2, responseCache=MemoryCache())
+		ws.get('artist', 'x').read()
+
+		time.sleep(0.25)
+		self.server.etag = '"v2"'
+		# the stale response is returned while revalidating
+		self.assertEquals(ws.get('artist', 'x').validator, '"v1"')
+		self._waitFor(lambda: ws.get('artist', 'x').validator == '"v2"')
+		self.assertEquals(ws.revalidationCount, 1)
+		self.assertEquals(ws.notModifiedCount, 0)
+
+	def testQuery(self):
+		q = Query(self._makeService(), cache=MemoryCache(ttl=0.05))
+		uuid = 'c0b2500e-0cef-4130-869d-732b23ed9df5'
+		artist = q.getArtistById(uuid)
+
+		# unchanged documents aren't parsed again
+		time.sleep(0.1)
+		self.assert_(q.getArtistById(uuid) is artist)
+		self.assertEquals(len(self.server.requests), 2)
+
+		time.sleep(0.1)
+		self.server.etag = '"v2"'
+		self.assert_(q.getArtistById(uuid) is not artist)
+
+# EOF
@@ -0,0 +1,105 @@
+"""Tests for the workers module."""
+import unittest
+import threading
+import time
+from musicbrainz2.workers import Future, WorkerPool, SingleFlight
+
+
+class WorkerPoolTest(unittest.TestCase):
+
+	def testSubmit(self):
+		pool = WorkerPool(maxWorkers=2)
+		futures = pool.map(lambda x: x * 2, range(10))
+		self.assertEquals([f.result() for f in futures], range(0, 20, 2))
+		pool.shutdown()
+
+	def testException(self):
+		pool = WorkerPool(maxWorkers=1)
+		f = pool.submit(int, 'no number')
+		self.assertRaises(ValueError, f.result)
+		self.assert_(isinstance(f.exception(), ValueError))
+		pool.shutdown()
+
+	def testConcurrency(self):
+		pool = WorkerPool(maxWorkers=3)
+		barrier = threading.Semaphore(0)
+		release = threading.Event()
+
+		def work():
+			barrier.release()
+			release.wait(5)
+
+		futures = [pool.submit(work) for i in range(3)]
+		# all three functions have to run at the same time
+		for i in range(3):
+			barrier.acquire()
+		release.set()
+		for f in futures:
+			f.result()
+		pool.shutdown()
+
+
+class FutureTest(unittest.TestCase):
+
+	def testCallback(self):
+		calls = [ ]
+		f = Future()
+		f.addDoneCallback(calls.append)
+		self.failIf(f.done())
+		f.setResult(42)
+		self.assert_(f.done())
+		self.assertEquals(calls, [f])
+
+		f.addDoneCallback(calls.append)
+		self.assertEquals(len(calls), 2)
+
+	def testTimeout(self):
+		f = Future()
+		self.assertRaises(RuntimeError, f.result, 0.01)
+
+
+class SingleFlightTest(unittest.TestCase):
+
+	def testCoalesce(self):
+		sf = SingleFlight()
+		started = threading.Event()
+		release = threading.Event()
+		calls = [ ]
+
+		def work():
+			calls.append(1)
+			started.set()
+			release.wait(5)
+			return object()
+
+		results = [ ]
+		def run():
+			results.append(sf.do('key', work))
+
+		threads = [threading.Thread(target=run) for i in range(3)]
+		threads[0].start()
+		started.wait(5)
+		for t in threads[1:]:
+			t.start()
+
+		deadline = time.time() + 5
+		while sf.coalesced < 2 and time.time() < deadline:
+			time.sleep(0.001)
+		release.set()
+		for t in threads:
+			t.join()
+
+		self.assertEquals(len(calls), 1)
+		self.assertEquals(sf.coalesced, 2)
+		self.assert_(results[0] is results[1] is results[2])
+
+		# later calls run the function again
+		sf.do('key', work)
+		self.assertEquals(len(calls), 2)
+
+	def testException(self):
+		sf = SingleFlight()
+		self.assertRaises(ValueError, sf.do, 'key', int, 'no number')
+		self.assertEquals(sf.do('key', int, '42'), 42)
+
+# EOF
@@ -1,9 +1,22 @@
 """Tests for webservice.Query."""
+import gc
+import time
+import urllib2
 import unittest
+import StringIO
+import threading
+import mimetools
 from musicbrainz2.model import Tag
 from musicbrainz2.model import Rating
 from musicbrainz2.model import Release
 from musicbrainz2.webservice import Query, IWebService, AuthenticationError, RequestError
+from musicbrainz2.webservice import ResourceNotFoundError, ReleaseIncludes
+from musicbrainz2.webservice import ResponseError, TrackFilter
+from musicbrainz2.webservice import ResultPager, ArtistFilter, UserFilter
+from musicbrainz2.webservice import ConnectionError, WebServiceError
+from musicbrainz2.transport import RetryPolicy
+from musicbrainz2.wsxml import Projection
+from musicbrainz2.cache import MemoryCache
 
 
 class FakeWebService(IWebService):
@@ -22,6 +35,120 @@ class FakeBadRequestWebService(IWebService):
 	def post(self, entity, id_, data, version='1'):
 		raise RequestError()
 
+class FakeGetWebService(IWebService):
+	XML = ('<metadata xmlns="http://musicbrainz.org/ns/mmd-1.0#">'
+		'<release id="%s"><title>%s</title></release></metadata>')
+
+	def __init__(self, releases):
+		self.releases = releases
+		self.requests = [ ]
+
+	def get(self, entity, id_, include=( ), filter={ }, version='1'):
+		self.requests.append( (entity, id_, include) )
+		if id_ not in self.releases:
+			raise ResourceNotFoundError()
+		return StringIO.StringIO(self.XML % (id_, self.releases[id_]))
+
+class FakeSearchWebService(IWebService):
+	XML = ('<metadata xmlns="http://musicbrainz.org/ns/mmd-1.0#" '
+		'xmlns:ext="http://musicbrainz.org/ns/ext-1.0#">'
+		'<track-list count="2">'
+		'<track id="1c3b0c5b-0b09-4afe-8d53-fe7bc7c8b7e3" ext:score="100">'
+		'<title>A</title></track>'
+		'<track id="e1a41ef8-3ac1-4d3c-a1c4-6cfb5ad1e77c" ext:score="50">'
+		'<title>B</title></track>'
+		'</track-list></metadata>')
+
+	def __init__(self, xml=XML):
+		self.stream = StringIO.StringIO(xml)
+		self.requests = [ ]
+
+	def get(self, entity, id_, include=( ), filter={ }, version='1'):
+		self.requests.append( (entity, id_, filter) )
+		return self.stream
+
+class FakePagingWebService(IWebService):
+	XML = ('<metadata xmlns="http://musicbrainz.org/ns/mmd-1.0#">'
+		'<artist-list count="%d" offset="%d">%s</artist-list></metadata>')
+	ARTIST = '<artist id="%s"><name>%s</name></artist>'
+
+	def __init__(self, names):
+		self.names = names
+		self.requests = [ ]
+
+	def get(self, entity, id_, include=( ), filter={ }, version='1'):
+		params = dict(filter)
+		offset = params['offset']
+		limit = params['limit']
+		self.requests.append( (params.get('name'), offset, limit) )
+
+		artists = ''.join([self.ARTIST % ('%036d' % hash(n), n)
+			for n in self.names[offset:offset + limit]])
+		xml = self.XML % (len(self.names), offset, artists)
+
+		# simulate an insertion while paging
+		if offset == 0 and 'new' in self.names[limit:]:
+			self.names.remove('new')
+			self.names.insert(0, 'new')
+		return StringIO.StringIO(xml)
+
+class FakeCollectionWebService(IWebService):
+	XML = ('<metadata xmlns="http://musicbrainz.org/ns/mmd-1.0#">'
+		'<release-list count="%d" offset="%d">%s</release-list></metadata>')
+	RELEASE = '<release id="%s"><title>%s</title></release>'
+
+	def __init__(self, size):
+		self.ids = ['%08d-0000-0000-0000-000000000000' % i
+			for i in range(size)]
+		self.requests = [ ]
+
+	def get(self, entity, id_, include=( ), filter={ }, version='1'):
+		offset = filter['offset']
+		maxitems = filter['maxitems']
+		self.requests.append(offset)
+
+		releases = ''.join([self.RELEASE % (x, x)
+			for x in self.ids[offset:offset + maxitems]])
+		return StringIO.StringIO(self.XML % (len(self.ids), offset,
+			releases))
+
+class FakeSubmitWebService(IWebService):
+	def __init__(self, failures=0, makeError=ConnectionError):
+		self.failures = failures
+		self.makeError = makeError
+		self.posts = [ ]
+		self.lock = threading.Lock()
+
+	def post(self, entity, id_, data, version='1'):
+		self.lock.acquire()
+		try:
+			self.posts.append(data)
+			if self.failures > 0:
+				self.failures -= 1
+				raise self.makeError()
+		finally:
+			self.lock.release()
+		if 'BAD' in data:
+			raise RequestError()
+
+class RecordingRetryPolicy(RetryPolicy):
+	def __init__(self, *args, **kwargs):
+		RetryPolicy.__init__(self, *args, **kwargs)
+		self.delays = [ ]
+
+	def getDelay(self, method, attempt, error):
+		delay = RetryPolicy.getDelay(self, method, attempt, error)
+		self.delays.append( (method, attempt, delay) )
+		return delay
+
+def makeUnavailableError():
+	hdrs = mimetools.Message(StringIO.StringIO('Retry-After: 0.2\r\n\r\n'))
+	reason = urllib2.HTTPError('http://x/', 503, 'Unavailable', hdrs, None)
+	return WebServiceError(str(reason), reason)
+
+def makeReleaseId(uuid):
+	return 'http://musicbrainz.org/release/' + uuid
+
 class QueryTest(unittest.TestCase):
 
 	def testAddToUserCollection(self):
@@ -191,7 +318,274 @@ class QueryTest(unittest.TestCase):
 		qstring = 'client=test-1&discid=6EmGGSLhuDYz2lNXtqrCiCCqO0o-&title=title&artist=artist&barcode=12345&comment=acomment&track0=tname1&artist0=artist1&track1=tname2&artist1=artist2&track2=tname3&artist2=artist3&track3=tname4&artist3=artist4&toc=1+4+89150+150+20701+46775+66213'
 		self.assertEquals(req[2], qstring)
 
+	def testIterTracks(self):
+		ws = FakeSearchWebService()
+		q = Query(ws)
+
+		it = q.iterTracks(TrackFilter(title='x'))
+		self.assertEquals(len(ws.requests), 1)
+		self.assertEquals(ws.requests[0][0], 'track')
+
+		results = list(it)
+		self.assertEquals([r.track.title for r in results], [u'A', u'B'])
+		self.assertEquals([r.score for r in results], [100, 50])
+		self.assert_(ws.stream.closed)
+
+	def testProjection(self):
+		xml = FakeSearchWebService.XML.replace('<title>A</title>',
+			'<title>A</title><duration>1000</duration>'
+			'<artist id="c0b2500e-0cef-4130-869d-732b23ed9df5">'
+			'<name>N</name></artist>')
+		projection = Projection({'track': ['title']})
+		cache = MemoryCache()
+		q = Query(FakeSearchWebService(xml), cache=cache)
+
+		results = q.getTracks(TrackFilter(title='x'), projection)
+		self.assertEquals([r.track.title for r in results], [u'A', u'B'])
+		self.assertEquals(results[0].score, 100)
+		self.assertEquals(results[0].track.duration, None)
+		self.assertEquals(results[0].track.artist, None)
+		# partial results aren't cached
+		self.assertEquals(len(cache), 0)
+
+		q = Query(FakeSearchWebService(xml))
+		it = q.iterTracks(TrackFilter(title='x'), projection)
+		self.assertEquals(it.next().track.artist, None)
+
+	def testIterTracksInvalid(self):
+		ws = FakeSearchWebService('<metadata>')
+		q = Query(ws)
+		it = q.iterTracks(TrackFilter(title='x'))
+		self.assertRaises(ResponseError, list, it)
+		self.assert_(ws.stream.closed)
+
+	def testIterTracksClose(self):
+		ws = FakeSearchWebService()
+		q = Query(ws)
+
+		it = q.iterTracks(TrackFilter(title='x'))
+		self.assertEquals(it.next().track.title, u'A')
+		it.close()
+		self.assert_(ws.stream.closed)
+		self.assertEquals(list(it), [ ])
+
+		# never started
+		ws = FakeSearchWebService()
+		it = Query(ws).iterTracks(TrackFilter(title='x'))
+		it.close()
+		self.assert_(ws.stream.closed)
+
+		ws = FakeSearchWebService()
+		Query(ws).iterTracks(TrackFilter(title='x'))
+		gc.collect()
+		self.assert_(ws.stream.closed)
+
+	def testResultPager(self):
+		names = ['a%d' % i for i in range(7)]
+		ws = FakePagingWebService(list(names))
+		pager = ResultPager(Query(ws), ArtistFilter(name='x'), 3, 2)
+
+		self.assertEquals([r.artist.name for r in pager], names)
+		self.assertEquals(pager.count, 7)
+		self.assertEquals(sorted([r[1] for r in ws.requests]), [0, 3, 6])
+		self.assertEquals(ws.requests[0], ('x', 0, 3))
+
+	def testResultPagerOffset(self):
+		ws = FakePagingWebService(['a%d' % i for i in range(5)])
+		pager = ResultPager(Query(ws), ArtistFilter(limit=2, offset=1),
+			prefetch=0)
+
+		self.assertEquals([r.artist.name for r in pager],
+			['a1', 'a2', 'a3', 'a4'])
+		self.assertEquals([r[1:] for r in ws.requests],
+			[(1, 2), (3, 2)])
+
+	def testResultPagerDuplicates(self):
+		ws = FakePagingWebService(['a', 'b', 'new', 'c'])
+		pager = ResultPager(Query(ws), ArtistFilter(name='x'), 2, 0)
+
+		self.assertEquals([r.artist.name for r in pager], ['a', 'b', 'c'])
+		self.assertEquals(pager.duplicates, 1)
+
+	def testResultPagerUnsupported(self):
+		self.assertRaises(ValueError, ResultPager, Query(FakeWebService()),
+			UserFilter(name='x'))
+
+	def testIterUserCollection(self):
+		ws = FakeCollectionWebService(25)
+		q = Query(ws)
+
+		it = q.iterUserCollection(pageSize=10, maxWorkers=2)
+		self.assertEquals(ws.requests, [0])
+
+		ids = [r.release.id for r in it]
+		self.assertEquals(ids, [makeReleaseId(x) for x in ws.ids])
+		self.assertEquals(sorted(ws.requests), [0, 10, 20])
+
+	def testGetUserCollectionChanges(self):
+		ws = FakeCollectionWebService(5)
+		q = Query(ws)
+		snapshot = [ws.ids[0], makeReleaseId(ws.ids[1]), 'gone']
+		del ws.ids[0]
+
+		(added, removed) = q.getUserCollectionChanges(snapshot, 2)
+		self.assertEquals([r.release.title for r in added], ws.ids[1:])
+		self.assertEquals(sorted(removed), sorted([snapshot[0], 'gone']))
+
+	def testSubmitPuidsInBulk(self):
+		ws = FakeSubmitWebService()
+		q = Query(ws, clientId='test-1')
+		mappings = { }
+		for i in range(10):
+			mappings['%036d' % i] = 'puid%d' % i
+		mappings['%036d' % 3] = 'BAD'
+		mappings['http://musicbrainz.org/artist/x'] = 'puid'
+
+		report = q.submitPuidsInBulk(mappings, chunkSize=4)
+		self.assertEquals(len(report), 11)
+		self.assert_(isinstance(report['%036d' % 3], RequestError))
+		self.assert_(isinstance(report['http://musicbrainz.org/artist/x'],
+			ValueError))
+		self.assertEquals(len([e for e in report.values() if e is None]), 9)
+
+		# three chunks, one of them split twice
+		self.assertEquals(len(ws.posts), 3 + 2 + 2)
+		for data in ws.posts:
+			self.assert_(data.startswith('client=test-1&puid='))
+
+	def testSubmitPuidsInBulkRejected(self):
+		# every request is rejected, not only those with bad mappings
+		ws = FakeSubmitWebService()
+		q = Query(ws, clientId='BAD-1')
+		mappings = { }
+		for i in range(16):
+			mappings['%036d' % i] = 'puid%d' % i
+
+		report = q.submitPuidsInBulk(mappings, chunkSize=8, maxWorkers=1)
+		self.assertEquals(len(report), 16)
+		for error in report.values():
+			self.assert_(isinstance(error, RequestError))
+		# each chunk and its two halves
+		self.assertEquals(len(ws.posts), 2 * 3)
+
+	def testSubmitISRCsInBulkRetry(self):
+		ws = FakeSubmitWebService(failures=2)
+		q = Query(ws)
+		mappings = { '%036d' % 1: 'DEA123456789', '%036d' % 2: 'DEA123456780' }
+
+		policy = RecordingRetryPolicy(backoff=0.05, jitter=0.0,
+			retryPosts=True)
+		start = time.time()
+		report = q.submitISRCsInBulk(mappings, maxWorkers=1,
+			retryPolicy=policy)
+		self.assertEquals(report.values(), [None, None])
+		self.assertEquals(len(ws.posts), 3)
+		self.assertEquals(policy.delays,
+			[('POST', 1, 0.05), ('POST', 2, 0.1)])
+		self.assert_(time.time() - start >= 0.15)
+
+		ws.failures = 2
+		policy = RetryPolicy(2, backoff=0.01, retryPosts=True)
+		report = q.submitISRCsInBulk(mappings, retryPolicy=policy)
+		for error in report.values():
+			self.assert_(isinstance(error, ConnectionError))
+
+	def testSubmitInBulkRetryAfter(self):
+		ws = FakeSubmitWebService(failures=1, makeError=makeUnavailableError)
+		q = Query(ws)
+		mappings = { '%036d' % 1: 'DEA123456789' }
+
+		start = time.time()
+		report = q.submitISRCsInBulk(mappings, maxAttempts=2)
+		self.assertEquals(report.values(), [None])
+		self.assertEquals(len(ws.posts), 2)
+		self.assert_(time.time() - start >= 0.2)
+
+		ws.failures = 2
+		report = q.submitISRCsInBulk(mappings, maxAttempts=2)
+		self.assertEquals(len(ws.posts), 4)
+		self.assert_(isinstance(report.values()[0], WebServiceError))
+
+	def testCoalesce(self):
+		release = threading.Event()
+		class SlowWebService(FakeGetWebService):
+			def get(self, *args, **kwargs):
+				release.wait(5)
+				return FakeGetWebService.get(self, *args, **kwargs)
+
+		ws = SlowWebService({ 'x': 'Title' })
+		q = Query(ws)
+		results = [ ]
+		def run():
+			results.append(q.getReleaseById('x'))
+
+		threads = [threading.Thread(target=run) for i in range(3)]
+		for t in threads:
+			t.start()
+
+		deadline = time.time() + 5
+		while q.getCoalescedCount() < 2 and time.time() < deadline:
+			time.sleep(0.001)
+		release.set()
+		for t in threads:
+			t.join()
+
+		self.assertEquals(len(ws.requests), 1)
+		self.assertEquals(q.getCoalescedCount(), 2)
+		self.assert_(results[0] is results[1] is results[2])
+
+	def testCoalesceProjection(self):
+		release = threading.Event()
+		class SlowWebService(FakeSearchWebService):
+			def get(self, *args, **kwargs):
+				release.wait(5)
+				return FakeSearchWebService.get(self, *args, **kwargs)
+
+		ws = SlowWebService()
+		q = Query(ws)
+		results = [ ]
+		def run():
+			# equal projections, but not the same object
+			projection = Projection({'track': ['title']})
+			results.append(q.getTracks(TrackFilter(title='x'), projection))
+
+		threads = [threading.Thread(target=run) for i in range(2)]
+		for t in threads:
+			t.start()
+
+		deadline = time.time() + 5
+		while q.getCoalescedCount() < 1 and time.time() < deadline:
+			time.sleep(0.001)
+		release.set()
+		for t in threads:
+			t.join()
+
+		self.assertEquals(len(ws.requests), 1)
+		self.assert_(results[0] is results[1])
+
+	def testGetReleasesByIds(self):
+		r1 = '9e186398-9ae2-45bf-a9f6-d26bc350221e'
+		r2 = '6b050dcf-7ab1-456d-9e1b-c3c41c18eed2'
+		missing = 'd3cc336e-1010-4252-9091-7923f0429824'
+		ws = FakeGetWebService({ r1: 'One', r2: 'Two' })
+		q = Query(ws)
 
+		ids = [r2, missing, r1, 'http://musicbrainz.org/release/' + r2,
+			'http://example.com/no-id']
+		inc = ReleaseIncludes(artist=True)
+		results = q.getReleasesByIds(ids, inc, maxWorkers=2)
+
+		self.assertEquals([r.id for r in results], ids)
+		self.assertEquals(results[0].entity.title, 'Two')
+		self.assert_(isinstance(results[1].error, ResourceNotFoundError))
+		self.assertEquals(results[1].entity, None)
+		self.assertEquals(results[2].entity.title, 'One')
+		self.assert_(results[3].entity is results[0].entity)
+		self.assert_(isinstance(results[4].error, ValueError))
+
+		# r2 was requested only once, the invalid ID not at all
+		self.assertEquals(len(ws.requests), 3)
+		self.assertEquals(ws.requests[0][2], ['artist'])
 
 
 # EOF
@@ -0,0 +1,370 @@
+"""Tests comparing the results of the MbXmlParser engines."""
+import os
+import unittest
+import StringIO
+from musicbrainz2.wsxml import MbXmlParser, MbXmlWriter, ParseError, \
+	Metadata, Projection, registerParserEngine, getParserEngines
+import musicbrainz2.wsxml as wsxml
+
+VALID_DATA_DIR = os.path.join('test-data', 'valid')
+
+ARTIST = """<?xml version="1.0" encoding="UTF-8"?>
+<metadata xmlns="http://musicbrainz.org/ns/mmd-1.0#"
+		xmlns:ext="http://musicbrainz.org/ns/ext-1.0#">
+  <artist id="c0b2500e-0cef-4130-869d-732b23ed9df5" type="Person">
+    <name>Tori Amos</name>
+    <sort-name>Amos, Tori</sort-name>
+    <disambiguation>the &lt;real&gt; one</disambiguation>
+    <life-span begin="1963-08-22"/>
+    <alias-list>
+      <alias type="Misspelling" script="Latn">Tori  Amos</alias>
+      <alias><![CDATA[ignored]]>Myra Ellen Amos</alias>
+    </alias-list>
+    <release-list offset="0" count="2">
+      <release id="02232360-337e-4a3f-ad20-6cdd4c34288c"
+          type="Album Official">
+        <title>Little Earthquakes</title>
+        <text-representation language="ENG" script="Latn"/>
+        <asin>B000002IT2</asin>
+      </release>
+    </release-list>
+    <relation-list target-type="Url">
+      <relation type="Wikipedia" direction="forward"
+          target="http://en.wikipedia.org/wiki/Tori_Amos"
+          begin="2000" attributes="Guest  Additional"/>
+    </relation-list>
+    <tag-list>
+      <tag count="12">piano</tag>
+      <tag count="x">singer-songwriter</tag>
+    </tag-list>
+    <rating votes-count="10">4.5</rating>
+  </artist>
+</metadata>
+"""
+
+RELEASE = """<?xml version="1.0" encoding="UTF-8"?>
+<metadata xmlns="http://musicbrainz.org/ns/mmd-1.0#">
+  <release id="290e10c5-7efc-4f60-ba2c-0dfc0208fbf5" type="Album Official">
+    <title>Under the Pink</title>
+    <text-representation language="ENG" script="Latn"/>
+    <artist id="c0b2500e-0cef-4130-869d-732b23ed9df5">
+      <name>Tori Amos</name>
+    </artist>
+    <release-event-list>
+      <event country="DE" date="1994-01-28" catalog-number="7567-82567-2"
+          barcode="075678256723" format="CD">
+        <label id="50c384a2-0b44-401b-b893-8181173339c7">
+          <name>Atlantic Records</name>
+        </label>
+      </event>
+      <event country="XXX" date="1994-02-01"/>
+    </release-event-list>
+    <disc-list>
+      <disc id="zuO.9qXrwQkV6Tnh7Z4cD4ILjWI-" sectors="230690"/>
+      <disc sectors="1"/>
+    </disc-list>
+    <track-list offset="3" count="12">
+      <track id="e1a41ef8-3ac1-4d3c-a1c4-6cfb5ad1e77c">
+        <title>Cornflake Girl</title>
+        <duration>305000</duration>
+        <puid-list><puid id="c2a2cee5-a8ca-4f89-a092-c3e1e65ab7e6"/></puid-list>
+        <isrc-list><isrc id="USAT29900609"/></isrc-list>
+      </track>
+    </track-list>
+    <release-group id="ef2b891f-ca73-3e14-b38b-a68699dab8c4" type="Album">
+      <title>Under the Pink</title>
+    </release-group>
+  </release>
+</metadata>
+"""
+
+SEARCH = """<?xml version="1.0" encoding="UTF-8"?>
+<metadata xmlns="http://musicbrainz.org/ns/mmd-1.0#"
+		xmlns:ext="http://musicbrainz.org/ns/ext-1.0#">
+  <track-list count="2" offset="0">
+    <track id="1c3b0c5b-0b09-4afe-8d53-fe7bc7c8b7e3" ext:score="100">
+      <title>Silent All These Years</title>
+      <duration>253000</duration>
+      <release-list>
+        <release id="02232360-337e-4a3f-ad20-6cdd4c34288c">
+          <title>Little Earthquakes</title>
+          <track-list offset="2"/>
+        </release>
+      </release-list>
+    </track>
+    <track id="00000000-0000-0000-0000-000000000000" ext:score="200">
+      <title>Out of range</title>
+    </track>
+  </track-list>
+  <label-list count="1">
+    <label id="50c384a2-0b44-401b-b893-8181173339c7" type="OriginalProduction"
+        ext:score="97">
+      <name>Atlantic Records</name>
+      <label-code>121</label-code>
+      <country>US</country>
+    </label>
+  </label-list>
+  <ext:user-list>
+    <ext:user type="AutoEditor NotNaggable">
+      <name>matt</name>
+      <ext:nag show="false"/>
+    </ext:user>
+  </ext:user-list>
+</metadata>
+"""
+
+NESTED = """<?xml version="1.0" encoding="UTF-8"?>
+<wrapper>
+  <metadata xmlns="http://example.com/other#"/>
+  <metadata xmlns="http://musicbrainz.org/ns/mmd-1.0#">
+    <artist id="c0b2500e-0cef-4130-869d-732b23ed9df5"><name>A</name></artist>
+  </metadata>
+  <metadata xmlns="http://musicbrainz.org/ns/mmd-1.0#">
+    <artist id="00000000-0000-0000-0000-000000000000"><name>B</name></artist>
+  </metadata>
+</wrapper>
+"""
+
+
+class _RecordingStream(object):
+	def __init__(self, data):
+		self.data = data
+		self.position = 0
+
+	def read(self, size):
+		chunk = self.data[self.position:self.position + size]
+		self.position += len(chunk)
+		return chunk
+
+
+class EngineParityTest(unittest.TestCase):
+
+	def _parse(self, xml, engine):
+		return MbXmlParser(engine=engine).parse(StringIO.StringIO(xml))
+
+	def _write(self, md):
+		out = StringIO.StringIO()
+		MbXmlWriter().write(out, md)
+		return out.getvalue()
+
+	def _assertParity(self, xml):
+		expected = self._parse(xml, 'minidom')
+		for engine in getParserEngines():
+			actual = self._parse(xml, engine)
+			self.assertEquals(self._write(actual), self._write(expected),
+				engine)
+		return (expected, self._parse(xml, 'expat'))
+
+	def testArtist(self):
+		(expected, actual) = self._assertParity(ARTIST)
+		a1 = expected.artist
+		a2 = actual.artist
+		self.assertEquals(a2.name, u'Tori Amos')
+		self.assertEquals(a2.disambiguation, a1.disambiguation)
+		self.assertEquals([(x.value, x.type, x.script) for x in a2.aliases],
+			[(x.value, x.type, x.script) for x in a1.aliases])
+		self.assertEquals([(t.value, t.count) for t in a2.tags],
+			[(t.value, t.count) for t in a1.tags])
+		self.assertEquals(a2.rating.value, a1.rating.value)
+		self.assertEquals(a2.rating.count, a1.rating.count)
+
+		r1 = a1.getRelations()[0]
+		r2 = a2.getRelations()[0]
+		self.assertEquals(r2.attributes, r1.attributes)
+		self.assertEquals(r2.direction, r1.direction)
+
+	def testRelease(self):
+		(expected, actual) = self._assertParity(RELEASE)
+		r1 = expected.release
+		r2 = actual.release
+		self.assertEquals(r2.tracksOffset, 3)
+		self.assertEquals(r2.tracksCount, r1.tracksCount)
+		self.assertEquals([(d.id, d.sectors) for d in r2.discs],
+			[(d.id, d.sectors) for d in r1.discs])
+		self.assertEquals(r2.tracks[0].isrcs, r1.tracks[0].isrcs)
+		self.assertEquals(r2.releaseGroup.title, r1.releaseGroup.title)
+
+	def testSearchResults(self):
+		(expected, actual) = self._assertParity(SEARCH)
+		self.assertEquals([r.score for r in actual.trackResults],
+			[r.score for r in expected.trackResults])
+		self.assertEquals(actual.trackResults[0].score, 100)
+		self.assertEquals(actual.labelResults[0].score, 97)
+
+		u1 = expected.getUserList()[0]
+		u2 = actual.getUserList()[0]
+		self.assertEquals(u2.name, u1.name)
+		self.assertEquals(u2.types, u1.types)
+		self.assertEquals(u2.showNag, u1.showNag)
+
+	def testFirstMetadataElement(self):
+		(expected, actual) = self._assertParity(NESTED)
+		self.assertEquals(actual.artist.name, u'A')
+
+	def testProjection(self):
+		projection = Projection({
+			'release': ['title', 'track-list'],
+			'track': ['title'],
+		})
+		results = [ ]
+		for engine in getParserEngines():
+			p = MbXmlParser(engine=engine, projection=projection)
+			results.append(self._write(p.parse(StringIO.StringIO(RELEASE))))
+			release = p.parse(StringIO.StringIO(RELEASE)).release
+			self.assertEquals(release.title, u'Under the Pink')
+			self.assertEquals(release.asin, None)
+			self.assertEquals(release.releaseGroup, None)
+			self.assertEquals(release.tracksOffset, 3)
+			self.assertEquals(release.tracks[0].isrcs, [ ])
+			self.assertEquals(release.tracks[0].title, u'Cornflake Girl')
+		self.assertEquals(results, [results[0]] * len(results))
+
+		# skipped elements aren't added to the tree
+		builder = wsxml._TreeBuilder(projection=projection)
+		md = builder.parse(StringIO.StringIO(RELEASE))[0]
+		release = md.children[0]
+		self.assertEquals([c.localName for c in release.children],
+			['title', 'track-list'])
+
+	def testProjectionEquality(self):
+		p1 = Projection({'release': ['title', 'asin'], 'track': [ ]})
+		p2 = Projection({'track': ( ), 'release': ('asin', 'title')})
+		self.assertEquals(p1, p2)
+		self.assertEquals(hash(p1), hash(p2))
+		self.failIf(p1 != p2)
+		self.assertNotEquals(p1, Projection({'release': ['title']}))
+		self.assertNotEquals(p1, None)
+		self.assertEquals(len(set([p1, p2, None])), 2)
+
+	def testIterResultsProjection(self):
+		p = MbXmlParser(projection=Projection({'track': ['title']}))
+		results = list(p.iterResults(StringIO.StringIO(SEARCH)))
+		self.assertEquals(results[0].score, 100)
+		self.assertEquals(results[0].track.duration, None)
+		self.assertEquals(results[0].track.releases, [ ])
+		self.assertEquals(results[0].track.title, u'Silent All These Years')
+
+	def testErrors(self):
+		for engine in getParserEngines():
+			p = MbXmlParser(engine=engine)
+			for xml in ('', '<metadata>', '<metadata/>', ARTIST[:-20]):
+				self.assertRaises(ParseError, p.parse,
+					StringIO.StringIO(xml))
+
+		self.assertRaises(ValueError, MbXmlParser, engine='foo')
+
+	def testLargeDocument(self):
+		# longer than one chunk, CDATA section near the end
+		xml = ARTIST.replace('<alias-list>',
+			'<alias-list>' + '<alias>x</alias>' * 5000)
+		self.assert_(xml.index('CDATA') > 65536)
+		self._assertParity(xml)
+		self._assertParity(xml.replace('<![CDATA[ignored]]>', ''))
+
+	def testLxmlTree(self):
+		if wsxml._lxml is None:
+			return
+		engine = wsxml._LxmlEngine()
+		md = engine.parse(StringIO.StringIO(RELEASE))[0]
+		self.assert_(isinstance(md, wsxml._lxml._Element))
+
+		# comments are skipped, like text in CDATA sections (using expat)
+		xml = RELEASE.replace('Under the Pink</title>',
+			'Under<!-- x --> the Pink</title><!-- y -->')
+		release = self._parse(xml, 'lxml').release
+		self.assertEquals(release.title, u'Under the Pink')
+		self.assert_(isinstance(release.title, unicode))
+		self.assert_(isinstance(release.tracks[0].isrcs[0], unicode))
+		self._assertParity(xml)
+		md = engine.parse(StringIO.StringIO(ARTIST))[0]
+		self.assert_(isinstance(md, wsxml._Element))
+
+	def testLxmlProjection(self):
+		if wsxml._lxml is None:
+			return
+		projection = Projection({'release': ['title', 'track-list']})
+		sizes = [ ]
+		class _Engine(wsxml._LxmlEngine):
+			root = None
+			def _prune(self, events, projection, stack):
+				events = list(events)
+				if self.root is None:
+					self.root = events[0][1]
+				wsxml._LxmlEngine._prune(self, events, projection, stack)
+				sizes.append(len(list(self.root.iter())))
+
+		# three chunks, mostly skipped
+		xml = RELEASE.replace('<disc-list>',
+			'<disc-list>' + '<disc id="x" sectors="1"/>' * 6000)
+		self.assert_(len(xml) > 2 * _Engine._CHUNK_SIZE)
+		md = _Engine().parse(StringIO.StringIO(xml), projection)[0]
+		self.assertEquals([wsxml._getLxmlLocalName(c.tag) for c in md[0]],
+			['title', 'track-list'])
+
+		# skipped elements are removed while reading
+		self.assert_(len(sizes) > 3)
+		self.assert_(max(sizes) < 100, sizes)
+
+	def testRegistry(self):
+		engines = getParserEngines()
+		self.assert_('expat' in engines and 'minidom' in engines)
+		self.assertEquals(MbXmlParser().engine, engines[0])
+		if wsxml._lxml is not None:
+			self.assertEquals(engines[0], 'lxml')
+
+		class _MinidomCopy(wsxml._MinidomEngine):
+			pass
+
+		try:
+			registerParserEngine('test', _MinidomCopy, preferred=True)
+			self.assertEquals(MbXmlParser().engine, 'test')
+			md = MbXmlParser().parse(StringIO.StringIO(ARTIST))
+			self.assertEquals(md.artist.name, u'Tori Amos')
+		finally:
+			wsxml._engineNames.remove('test')
+			del wsxml._engines['test']
+		self.assertEquals(getParserEngines(), engines)
+
+	def testIterResults(self):
+		expected = self._parse(SEARCH, 'minidom')
+		results = list(MbXmlParser().iterResults(
+			StringIO.StringIO(SEARCH), 16))
+
+		self.assertEquals(len(results), 3)
+		md = Metadata()
+		md.trackResultsOffset = 0
+		md.trackResultsCount = 2
+		md.labelResultsCount = 1
+		md.getTrackResults().extend(results[:2])
+		md.getLabelResults().extend(results[2:])
+		self.assertEquals(self._write(md), self._write(expected))
+
+	def testIterResultsIncremental(self):
+		stream = _RecordingStream(SEARCH)
+		it = MbXmlParser().iterResults(stream, 64)
+
+		result = it.next()
+		self.assertEquals(result.track.title, u'Silent All These Years')
+		self.assert_(stream.position < SEARCH.index('</track>') + 2 * 64)
+
+		self.assertEquals(len(list(it)), 2)
+		self.assertEquals(stream.position, len(SEARCH))
+
+	def testIterResultsErrors(self):
+		for xml in ('', '<metadata/>', SEARCH[:-20]):
+			it = MbXmlParser().iterResults(StringIO.StringIO(xml))
+			self.assertRaises(ParseError, list, it)
+
+	def testDataFiles(self):
+		for (dirpath, dirnames, filenames) in os.walk(VALID_DATA_DIR):
+			for name in filenames:
+				if name.endswith('.xml'):
+					path = os.path.join(dirpath, name)
+					expected = self._write(
+						MbXmlParser(engine='minidom').parse(path))
+					for engine in getParserEngines():
+						self.assertEquals(self._write(
+							MbXmlParser(engine=engine).parse(path)),
+							expected, path)
+
+# EOF
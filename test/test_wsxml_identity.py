@@ -0,0 +1,130 @@
+"""Tests for sharing parsed entities using an IdentityMap."""
+import gc
+import unittest
+import StringIO
+from musicbrainz2.model import Release, ReleaseEvent
+from musicbrainz2.wsxml import MbXmlParser, DefaultFactory, LazyFactory, \
+	IdentityMap
+from musicbrainz2.webservice import Query
+from test.test_wsxml_engines import ARTIST, RELEASE
+from test.test_ws_query import FakeSearchWebService
+
+
+ARTIST_PAGE_2 = ARTIST.replace('offset="0" count="2"',
+	'offset="1" count="2"').replace(
+	'02232360-337e-4a3f-ad20-6cdd4c34288c',
+	'290e10c5-7efc-4f60-ba2c-0dfc0208fbf5').replace(
+	'Little Earthquakes', 'Under the Pink')
+
+class IdentityMapTest(unittest.TestCase):
+
+	def setUp(self):
+		self.map = IdentityMap()
+		self.factory = DefaultFactory(self.map)
+
+	def _parse(self, xml, factory=None, engine=None):
+		p = MbXmlParser(factory or self.factory, engine=engine)
+		return p.parse(StringIO.StringIO(xml))
+
+	def testNoMap(self):
+		release = self._parse(RELEASE, DefaultFactory()).release
+		artist = self._parse(ARTIST, DefaultFactory()).artist
+		self.failIf(release.artist is artist)
+		self.assertEquals(DefaultFactory().identityMap, None)
+
+	def testShared(self):
+		release = self._parse(RELEASE).release
+		self.assertEquals(release.artist.releases, [ ])
+		artist = self._parse(ARTIST).artist
+
+		self.assert_(release.artist is artist)
+		self.assertEquals(artist.sortName, u'Amos, Tori')
+		self.assertEquals(len(artist.releases), 1)
+		self.assertEquals(len(artist.getRelations()), 1)
+		self.assertEquals(self.map.mergedCount, 1)
+		self.assert_(self.map.get(artist.id) is artist)
+
+		again = self._parse(RELEASE).release
+		self.assert_(again is release)
+		self.assertEquals(len(release.tracks), 1)
+
+	def testFirstWins(self):
+		artist = self._parse(ARTIST).artist
+		xml = ARTIST.replace('<name>Tori Amos</name>', '<name>Other</name>')
+		self.assert_(self._parse(xml).artist is artist)
+		self.assertEquals(artist.name, u'Tori Amos')
+
+		self.map.clear()
+		self.assertEquals(self._parse(xml).artist.name, u'Other')
+
+	def testPages(self):
+		for factory in (self.factory, LazyFactory(self.map)):
+			self.map.clear()
+			artist = self._parse(ARTIST, factory, 'expat').artist
+			self.assertEquals(artist.releases[0].title,
+				u'Little Earthquakes')
+
+			xml = ARTIST_PAGE_2.replace('<name>Tori Amos</name>',
+				'<name>Other</name>')
+			self.assert_(self._parse(xml, factory, 'expat').artist is artist)
+			self.assertEquals(artist.name, u'Tori Amos')
+			self.assertEquals([r.title for r in artist.releases],
+				[u'Under the Pink'])
+			self.assertEquals(artist.releasesOffset, 1)
+			self.assertEquals(artist.getReleasesCount(), 2)
+
+			# no release list, so the releases are kept
+			self._parse(RELEASE, factory, 'expat')
+			self.assertEquals(len(artist.releases), 1)
+			self.assertEquals(artist.releasesOffset, 1)
+
+	def testPagesDeferred(self):
+		factory = LazyFactory(self.map)
+		artist = self._parse(ARTIST, factory, 'expat').artist
+		self._parse(ARTIST_PAGE_2, factory, 'expat')
+		self.assertEquals(len(artist._deferred['_releases']), 1)
+		self.assertEquals([r.title for r in artist.releases],
+			[u'Under the Pink'])
+
+	def testUris(self):
+		release = self._parse(RELEASE).release
+		other = self._parse(ARTIST).artist.releases[0]
+		self.failIf(release is other)
+		self.assertEquals(release.types, other.types)
+		for (a, b) in zip(release.types, other.types):
+			self.assert_(a is b)
+		self.assertEquals(release.types[0], Release.TYPE_ALBUM)
+
+		format = release.releaseEvents[0].format
+		self.assert_(format is self.map.internUri(ReleaseEvent.FORMAT_CD))
+
+	def testLazy(self):
+		factory = LazyFactory(self.map)
+		release = self._parse(RELEASE, factory, 'expat').release
+		artist = self._parse(ARTIST, factory, 'expat').artist
+
+		self.assert_(release.artist is artist)
+		self.assert_('_releases' in artist._deferred)
+		self.assertEquals(artist.releases[0].title, u'Little Earthquakes')
+
+	def testWeak(self):
+		self._parse(ARTIST)
+		gc.collect()
+		self.assertEquals(len(self.map), 0)
+
+		artist = self._parse(ARTIST).artist
+		self.assertEquals(len(self.map), 2)
+		del artist
+		gc.collect()
+		self.assertEquals(len(self.map), 0)
+
+	def testQuery(self):
+		q1 = Query(FakeSearchWebService(), factory=self.factory)
+		q2 = Query(FakeSearchWebService(), factory=self.factory)
+		tracks1 = [r.track for r in q1.getTracks(None)]
+		tracks2 = [r.track for r in q2.getTracks(None)]
+		self.assertEquals(len(tracks1), 2)
+		for (a, b) in zip(tracks1, tracks2):
+			self.assert_(a is b)
+
+# EOF
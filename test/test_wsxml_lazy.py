@@ -0,0 +1,96 @@
+"""Tests for objects created by the LazyFactory."""
+import pickle
+import unittest
+import StringIO
+import threading
+from musicbrainz2.wsxml import MbXmlParser, MbXmlWriter, LazyFactory, \
+	getParserEngines
+from musicbrainz2.webservice import Query
+from test.test_wsxml_engines import ARTIST, RELEASE, SEARCH
+from test.test_ws_query import FakeSearchWebService
+import musicbrainz2.wsxml as wsxml
+
+
+class LazyFactoryTest(unittest.TestCase):
+
+	def _parse(self, xml, engine=None):
+		p = MbXmlParser(factory=LazyFactory(), engine=engine)
+		return p.parse(StringIO.StringIO(xml))
+
+	def _write(self, md):
+		out = StringIO.StringIO()
+		MbXmlWriter().write(out, md)
+		return out.getvalue()
+
+	def testParity(self):
+		for xml in (ARTIST, RELEASE, SEARCH):
+			expected = self._write(MbXmlParser().parse(StringIO.StringIO(xml)))
+			for engine in getParserEngines():
+				self.assertEquals(self._write(self._parse(xml, engine)),
+					expected, engine)
+
+	def testDeferred(self):
+		release = self._parse(RELEASE, 'expat').release
+		self.assert_(isinstance(release, wsxml._LazyRelease))
+		self.assertEquals(sorted(release._deferred.keys()),
+			['_discs', '_releaseEvents', '_tracks'])
+		self.assertEquals(release.tracksOffset, 3)
+
+		self.assertEquals(release.tracks[0].title, u'Cornflake Girl')
+		self.assertEquals(len(release.getTracks()), 1)
+		self.assert_('_tracks' not in release._deferred)
+		self.assertEquals(len(release._deferred), 2)
+
+		self.assertEquals(release.getEarliestReleaseDate(), '1994-01-28')
+		self.assertEquals(len(release.discs), 1)
+		self.assertEquals(release._deferred, { })
+
+	def testRelations(self):
+		artist = self._parse(ARTIST, 'expat').artist
+		self.assert_('_relations' in artist._deferred)
+		self.assertEquals(len(artist.getRelationTargetTypes()), 1)
+		self.assertEquals(len(artist.getRelations()), 1)
+
+	def testLxmlDetached(self):
+		if wsxml._lxml is None:
+			return
+		release = self._parse(RELEASE, 'lxml').release
+		for (decode, node) in release._deferred['_tracks']:
+			self.assert_(isinstance(node, str))
+		self.assertEquals(release.tracks[0].title, u'Cornflake Girl')
+		self.assertEquals(len(release.releaseEvents), 2)
+
+	def testMinidom(self):
+		release = self._parse(RELEASE, 'minidom').release
+		self.assertEquals(release._deferred, None)
+		self.assertEquals(len(release.tracks), 1)
+
+	def testThreads(self):
+		xml = RELEASE.replace('<track-list offset="3" count="12">',
+			'<track-list>' + '<track><title>x</title></track>' * 500)
+		release = self._parse(xml, 'expat').release
+		counts = [ ]
+
+		def count():
+			counts.append(len(release.tracks))
+
+		threads = [threading.Thread(target=count) for i in range(8)]
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+		self.assertEquals(counts, [501] * 8)
+
+	def testPickle(self):
+		release = self._parse(RELEASE, 'expat').release
+		copy = pickle.loads(pickle.dumps(release, 2))
+		self.assertEquals(copy.tracks[0].title, u'Cornflake Girl')
+		self.assertEquals(len(copy.releaseEvents), 2)
+		self.assertEquals(len(release.releaseEvents), 2)
+
+	def testQuery(self):
+		q = Query(FakeSearchWebService(), factory=LazyFactory())
+		results = q.getTracks(None)
+		self.assert_(isinstance(results[0].track, wsxml._LazyTrack))
+
+# EOF